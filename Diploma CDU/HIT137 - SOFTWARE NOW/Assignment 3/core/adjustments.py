@@ -0,0 +1,179 @@
+"""Non-destructive adjustment layers over an image, evaluated on demand.
+
+An AdjustmentStack keeps the image it starts from (the base) and an
+ordered list of adjustments, each an operation name and its parameters.
+Nothing is computed when a layer is added or changed. render(scale)
+works the stack out at the resolution asked for: the canvas asks for
+about its own size, saving asks for scale 1.
+
+Every prefix of the stack is cached, keyed by the base, the scale and
+the layers up to that point. Changing layer i therefore finds layers
+before it in the cache and only recomputes i and the layers above it;
+changing the top layer costs one operation. A full resolution render
+for a save is not stored, or a few frames of it would push every
+canvas-sized prefix out of the cache.
+
+Layers are immutable Adjustment values and the layer list is a tuple,
+replaced on every change, so frozen() can hand a consistent copy of the
+stack to a background thread (e.g. a save) while editing carries on.
+"""
+from __future__ import annotations
+
+import itertools
+import math
+from dataclasses import dataclass, field, replace
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from core.image_processor import ImageProcessor
+from core.resample import resize
+from core.result_cache import ResultCache
+
+# name -> (parameter, default, lowest, highest) of each kind of layer
+ADJUSTMENTS = {
+    "brightness": ("value", 0, -100, 100),
+    "stretch_contrast": ("factor", 1.0, 0.2, 3.0),
+    "blur": ("intensity", 1, 1, 201),
+}
+
+LABELS = {"brightness": "Brightness", "stretch_contrast": "Contrast", "blur": "Blur"}
+
+# each base image gets its own number, so cache keys never mix bases up
+_bases = itertools.count()
+
+
+@dataclass(frozen=True)
+class Adjustment:
+    name: str
+    params: dict = field(default_factory=dict)
+    enabled: bool = True
+
+    @property
+    def key(self) -> Tuple:
+        return self.name, tuple(sorted(self.params.items())), self.enabled
+
+    @property
+    def label(self) -> str:
+        parameter = ADJUSTMENTS[self.name][0]
+        text = f"{LABELS[self.name]} {self.params[parameter]}"
+        return text if self.enabled else f"{text} (off)"
+
+
+def display_scale(scale: float) -> float:
+    """The power-of-two level at or above scale that a stack is rendered at.
+
+    Rendering for every zoom step would fill the cache with near copies;
+    levels of 1, 1/2, 1/4, ... keep it to a handful.
+    """
+    if scale >= 1.0:
+        return 1.0
+    return 2.0 ** -math.floor(math.log2(1.0 / scale))
+
+
+def scaled_params(name: str, params: dict, scale: float) -> dict:
+    """Parameters that look the same on an image scale times the size."""
+    if name == "blur" and scale != 1.0:
+        return dict(params, intensity=max(1, round(params["intensity"] * scale)))
+    return params
+
+
+class AdjustmentStack:
+    """An ordered stack of adjustments over a base image; see the module docstring."""
+
+    def __init__(self, processor=ImageProcessor, cache: Optional[ResultCache] = None) -> None:
+        self.processor = processor
+        self.cache = cache if cache is not None else ResultCache(128 * 1024 * 1024)
+        self.base = None
+        self.layers: Tuple[Adjustment, ...] = ()
+        self._base_id = next(_bases)
+        self._levels: Dict[float, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.layers)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by cached renders and shrunk copies of the base."""
+        return self.cache.nbytes + sum(level.nbytes for level in self._levels.values())
+
+    def set_base(self, image) -> None:
+        """Put the layers over a new image; what was cached for the old one is dropped."""
+        if image is self.base:
+            return
+        self.base = image
+        self._base_id = next(_bases)
+        self._levels = {}
+        self.cache.clear()
+
+    def add(self, name: str, **params) -> int:
+        """Add a layer on top (with default parameters) and return its index."""
+        if name not in ADJUSTMENTS:
+            raise ValueError(f"{name} is not an adjustment")
+        parameter, default = ADJUSTMENTS[name][:2]
+        params.setdefault(parameter, default)
+        self.layers = self.layers + (Adjustment(name, params),)
+        return len(self.layers) - 1
+
+    def update(self, index: int, **params) -> None:
+        layer = self.layers[index]
+        self._set(index, replace(layer, params=dict(layer.params, **params)))
+
+    def set_enabled(self, index: int, enabled: bool) -> None:
+        self._set(index, replace(self.layers[index], enabled=enabled))
+
+    def remove(self, index: int) -> None:
+        self.layers = self.layers[:index] + self.layers[index + 1:]
+
+    def clear(self) -> None:
+        self.layers = ()
+
+    def _set(self, index: int, layer: Adjustment) -> None:
+        self.layers = self.layers[:index] + (layer,) + self.layers[index + 1:]
+
+    def frozen(self) -> "AdjustmentStack":
+        """A copy that later changes to this stack do not affect; shares the cache."""
+        copy = AdjustmentStack(self.processor, self.cache)
+        copy.base, copy.layers, copy._base_id = self.base, self.layers, self._base_id
+        copy._levels = self._levels
+        return copy
+
+    def base_at(self, scale: float) -> np.ndarray:
+        """The base shrunk by scale, made once per level."""
+        if scale >= 1.0:
+            return self.base
+        level = self._levels.get(scale)
+        if level is None:
+            height, width = self.base.shape[:2]
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            level = resize(self.base, size, "area")
+            self._levels[scale] = level
+        return level
+
+    def render(self, scale: float = 1.0, store: bool = True) -> np.ndarray:
+        """The base with every enabled layer applied, at scale times full size.
+
+        With store False cached prefixes are used but new ones are not kept.
+        """
+        image = self.base_at(scale)
+        key: Tuple = (self._base_id, scale)
+        for layer in self.layers:
+            if not layer.enabled:
+                continue
+            key = key + (layer.key,)
+            result = self.cache.get(key)
+            if result is None:
+                params = scaled_params(layer.name, layer.params, scale)
+                result = self.processor.apply(image, layer.name, **params)
+                if store and result is not image:
+                    self.cache.put(key, result)
+            image = result
+        return image
+
+    def apply_to(self, image: np.ndarray, scale: float = 1.0) -> np.ndarray:
+        """Apply the enabled layers to another image (uncached), e.g. a preview."""
+        for layer in self.layers:
+            if layer.enabled:
+                image = self.processor.apply(
+                    image, layer.name, **scaled_params(layer.name, layer.params, scale))
+        return image
@@ -0,0 +1,407 @@
+"""Apply a recipe of operations to many images without the GUI.
+
+Run from the Assignment 3 folder:
+
+    python -m core.batch recipe.json "photos/**/*.jpg" -o out
+
+A recipe is a list of steps, each an operation name from
+ImageProcessor.OPERATIONS plus its parameters:
+
+    [{"op": "grayscale"}, {"op": "blur", "intensity": 5},
+     {"op": "resize", "scale": 50}]
+
+Thumbnails are a resize to a box, e.g. {"op": "resize", "width": 320,
+"height": 320, "mode": "fill", "interpolation": "lanczos"}.
+
+It may also be an object with the list under "steps". YAML recipes work
+too if PyYAML is installed.
+
+By default each file is handled start to finish by one of a pool of
+processes. With --stream the work is split into read, decode, filter,
+encode and write stages instead, each with its own threads and joined by
+bounded queues (see core.pipeline), and a table at the end shows which
+stage limited the run. Adding --processes N runs the filter stage on N
+worker processes instead: images are decoded into shared memory frames
+(see core.shared_frames), the workers filter them into output frames,
+and the encoder reads those in place, so no pixels are pickled.
+
+Outputs are encoded with one of the image_writer profiles (--profile),
+optionally with --quality or --png-level changed.
+
+Files whose output already exists are skipped, so rerunning the same
+command after a crash carries on where it stopped. Outputs are written
+to a temporary name and renamed into place, so a half-written file is
+never mistaken for a finished one.
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.buffer_pool import BufferPool
+from core.image_processor import ImageProcessor
+from core.image_writer import PROFILES, EncodeOptions, write_atomic
+from core.image_writer import encode as encode_image
+from core.pipeline import Pipeline, Stage
+from core.result_cache import CachedProcessor, ResultCache
+from core.shared_frames import SharedProcessor
+
+Step = Tuple[str, dict]
+
+
+def load_recipe(path: str) -> List[Step]:
+    """Read a JSON or YAML recipe and return it as (name, params) steps."""
+    with open(path, "r", encoding="utf-8") as handle:
+        if path.lower().endswith((".yaml", ".yml")):
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError("YAML recipes need PyYAML (pip install pyyaml)") from None
+            data = yaml.safe_load(handle)
+        else:
+            data = json.load(handle)
+    return parse_recipe(data)
+
+
+def parse_recipe(data) -> List[Step]:
+    """Check a decoded recipe and turn it into (name, params) steps.
+
+    A step can be a bare name ("grayscale") or a mapping with the name
+    under "op" and the parameters alongside it.
+    """
+    if isinstance(data, dict):
+        data = data.get("steps")
+    if not isinstance(data, list):
+        raise ValueError("Recipe must be a list of steps or have a 'steps' list")
+
+    steps = []
+    for number, entry in enumerate(data, 1):
+        if isinstance(entry, str):
+            name, params = entry, {}
+        elif isinstance(entry, dict) and "op" in entry:
+            params = dict(entry)
+            name = params.pop("op")
+        else:
+            raise ValueError(f"Step {number}: expected a name or a mapping with 'op'")
+        if name not in ImageProcessor.OPERATIONS:
+            raise ValueError(f"Step {number}: unknown operation '{name}'")
+        steps.append((name, params))
+    return steps
+
+
+def plan_outputs(inputs: List[str], output_dir: str,
+                 extension: Optional[str] = None) -> List[Tuple[str, str]]:
+    """Pair each input with its output path.
+
+    Outputs keep their path relative to the folder the inputs have in
+    common, so recursive globs cannot make two files collide.
+    """
+    if not inputs:
+        return []
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in inputs])
+    pairs = []
+    for path in inputs:
+        relative = os.path.relpath(os.path.abspath(path), root)
+        if extension:
+            relative = os.path.splitext(relative)[0] + extension
+        pairs.append((path, os.path.join(output_dir, relative)))
+    return pairs
+
+
+# Each process recycles its image buffers from one file to the next, and
+# remembers recent results so duplicate inputs are not processed twice.
+# The cache keeps copies, so the results handed out can go back to the pool.
+_buffers = BufferPool()
+_processor = CachedProcessor(ImageProcessor, ResultCache(max_bytes=128 * 1024 * 1024),
+                             copy_results=True)
+
+
+def _init_worker() -> None:
+    # one process per core already; OpenCV's own threads would only fight them
+    cv2.setNumThreads(1)
+
+
+def decode(source: str, data: bytes) -> np.ndarray:
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Cannot read {source}")
+    return image
+
+
+def encode(target: str, image: np.ndarray,
+           options: EncodeOptions = PROFILES["balanced"]) -> bytes:
+    return encode_image(image, os.path.splitext(target)[1], options)
+
+
+def process_file(source: str, target: str, steps: List[Step],
+                 options: EncodeOptions = PROFILES["balanced"]) -> Tuple[int, int]:
+    """Run steps on one file and write the result. Returns (bytes read, bytes written)."""
+    with open(source, "rb") as handle:
+        data = handle.read()
+    result = _processor.apply_chain(decode(source, data), steps, pool=_buffers)
+    encoded = encode(target, result, options)
+    _buffers.release(result)
+    write_atomic(target, encoded)
+    return len(data), len(encoded)
+
+
+@dataclass
+class BatchReport:
+    """What a batch run did, for the summary printed at the end."""
+
+    processed: int = 0
+    skipped: int = 0
+    failed: List[Tuple[str, str]] = field(default_factory=list)
+    bytes_in: int = 0
+    bytes_out: int = 0
+    seconds: float = 0.0
+    stages: List[str] = field(default_factory=list)
+
+    @property
+    def images_per_second(self) -> float:
+        return self.processed / self.seconds if self.seconds else 0.0
+
+    @property
+    def megabytes_per_second(self) -> float:
+        return self.bytes_in / 1e6 / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        lines = [
+            f"Processed {self.processed} images, skipped {self.skipped}, "
+            f"failed {len(self.failed)} in {self.seconds:.2f}s",
+            f"Throughput: {self.images_per_second:.1f} images/s, "
+            f"{self.megabytes_per_second:.1f} MB/s read, "
+            f"{self.bytes_out / 1e6:.1f} MB written",
+        ]
+        lines += self.stages
+        lines += [f"  FAILED {path}: {error}" for path, error in self.failed]
+        return "\n".join(lines)
+
+
+def _pending(pairs, overwrite: bool, report: BatchReport) -> List[Tuple[str, str]]:
+    """Drop pairs whose output already exists, counting them as skipped."""
+    todo = []
+    for source, target in pairs:
+        if not overwrite and os.path.exists(target):
+            report.skipped += 1
+        else:
+            todo.append((source, target))
+    return todo
+
+
+def run_batch(steps: List[Step], pairs: List[Tuple[str, str]],
+              workers: Optional[int] = None, overwrite: bool = False,
+              progress=None, options: EncodeOptions = PROFILES["balanced"]) -> BatchReport:
+    """Process (input, output) pairs across a pool of processes.
+
+    progress, if given, is called as progress(done, total, path) after
+    each file finishes.
+    """
+    report = BatchReport()
+    todo = _pending(pairs, overwrite, report)
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(process_file, source, target, steps, options): source
+                   for source, target in todo}
+        for done, future in enumerate(as_completed(futures), 1):
+            source = futures[future]
+            try:
+                read, written = future.result()
+            except Exception as error:
+                report.failed.append((source, str(error)))
+            else:
+                report.processed += 1
+                report.bytes_in += read
+                report.bytes_out += written
+            if progress is not None:
+                progress(done, len(todo), source)
+    report.seconds = time.perf_counter() - start
+    return report
+
+
+def run_stream(steps: List[Step], pairs: List[Tuple[str, str]],
+               workers: Optional[dict] = None, queue_size: int = 4,
+               overwrite: bool = False, progress=None,
+               options: EncodeOptions = PROFILES["balanced"],
+               processes: Optional[int] = None) -> BatchReport:
+    """Process pairs through a read/decode/filter/encode/write pipeline.
+
+    workers maps stage names to thread counts; missing stages get a
+    default. Memory stays bounded by queue_size images per stage, so this
+    suits very long file lists. With processes, the filter threads hand
+    their frames to that many worker processes over shared memory.
+    """
+    half = max(1, (os.cpu_count() or 2) // 2)
+    counts = {"read": 2, "decode": half, "filter": half, "encode": half, "write": 2}
+    counts.update(workers or {})
+    cv2.setNumThreads(1)
+
+    def read(job):
+        source, target = job
+        with open(source, "rb") as handle:
+            return source, target, handle.read()
+
+    shared = SharedProcessor(processes) if processes else None
+
+    def decode_stage(job):
+        source, target, data = job
+        image = decode(source, data)
+        if shared is not None:
+            # imdecode cannot write into a given buffer, so this is the
+            # only copy the frame ever gets
+            image = shared.pool.put(image)
+        return source, target, len(data), image
+
+    def filter_stage(job):
+        source, target, size, image = job
+        if shared is None:
+            return source, target, size, _processor.apply_chain(image, steps, pool=_buffers)
+        try:
+            return source, target, size, shared.apply_chain(image, steps)
+        finally:
+            shared.pool.release(image)
+
+    def encode_stage(job):
+        source, target, size, image = job
+        if shared is None:
+            data = encode(target, image, options)
+            _buffers.release(image)
+            return source, target, size, data
+        try:
+            return source, target, size, encode(target, image.array, options)
+        finally:
+            shared.pool.release(image)
+
+    def write(job):
+        source, target, size, data = job
+        write_atomic(target, data)
+        return source, size, len(data)
+
+    pipeline = Pipeline([
+        Stage("read", read, counts["read"]),
+        Stage("decode", decode_stage, counts["decode"]),
+        Stage("filter", filter_stage, counts["filter"]),
+        Stage("encode", encode_stage, counts["encode"]),
+        Stage("write", write, counts["write"]),
+    ], queue_size=queue_size)
+
+    report = BatchReport()
+    todo = _pending(pairs, overwrite, report)
+    done = [0]
+
+    def finished(source):
+        done[0] += 1
+        if progress is not None:
+            progress(done[0], len(todo), source)
+
+    def on_result(result):
+        source, read_bytes, written = result
+        report.processed += 1
+        report.bytes_in += read_bytes
+        report.bytes_out += written
+        finished(source)
+
+    def on_error(stage, job, error):
+        report.failed.append((job[0], f"{stage}: {error}"))
+        finished(job[0])
+
+    try:
+        report.seconds = pipeline.run(todo, on_result, on_error)
+    finally:
+        if shared is not None:
+            shared.close()
+    report.stages = [stats.line(report.seconds) for stats in pipeline.stats]
+    if shared is None:
+        report.stages.append(_processor.cache.summary())
+    return report
+
+
+def _stage_workers(text: str) -> dict:
+    """Parse "decode=4,filter=8" into {"decode": 4, "filter": 8}."""
+    counts = {}
+    for part in filter(None, text.split(",")):
+        name, _, count = part.partition("=")
+        if name not in ("read", "decode", "filter", "encode", "write") or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"bad stage setting '{part}'")
+        counts[name] = int(count)
+    return counts
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m core.batch",
+        description="Apply a recipe of image operations to every file matching a pattern.")
+    parser.add_argument("recipe", help="JSON or YAML file listing the steps")
+    parser.add_argument("inputs", help='glob pattern, e.g. "photos/**/*.jpg"')
+    parser.add_argument("-o", "--output", required=True, help="output directory")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--stream", action="store_true",
+                        help="use a staged thread pipeline instead of a process pool")
+    parser.add_argument("--stage-workers", type=_stage_workers, default={},
+                        metavar="STAGE=N,...",
+                        help="threads per stage for --stream, e.g. decode=4,filter=8")
+    parser.add_argument("--queue", type=int, default=4,
+                        help="images buffered between stages for --stream (default: 4)")
+    parser.add_argument("--processes", type=int, default=None, metavar="N",
+                        help="with --stream, filter on N processes over shared memory")
+    parser.add_argument("--format", help="output extension such as .png (default: keep the input's)")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="balanced",
+                        help="encoder settings: fast, balanced (default) or small")
+    parser.add_argument("--quality", type=int,
+                        help="JPEG and WebP quality, overriding the profile's")
+    parser.add_argument("--png-level", type=int, choices=range(10), metavar="0-9",
+                        help="PNG compression level, overriding the profile's")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="redo files whose output already exists")
+    parser.add_argument("-q", "--quiet", action="store_true", help="no per-file progress")
+    args = parser.parse_args(argv)
+
+    try:
+        steps = load_recipe(args.recipe)
+    except (OSError, ValueError) as error:
+        parser.error(f"bad recipe: {error}")
+
+    inputs = sorted(p for p in glob.glob(args.inputs, recursive=True) if os.path.isfile(p))
+    if not inputs:
+        parser.error(f"no files match {args.inputs}")
+    extension = args.format
+    if extension and not extension.startswith("."):
+        extension = "." + extension
+    pairs = plan_outputs(inputs, args.output, extension)
+    options = PROFILES[args.profile]
+    if args.quality is not None:
+        options = replace(options, jpeg_quality=args.quality, webp_quality=args.quality)
+    if args.png_level is not None:
+        options = replace(options, png_compression=args.png_level)
+
+    def progress(done, total, path):
+        print(f"[{done}/{total}] {path}", flush=True)
+
+    progress = None if args.quiet else progress
+    if args.stream:
+        report = run_stream(steps, pairs, workers=args.stage_workers,
+                            queue_size=args.queue, overwrite=args.overwrite,
+                            progress=progress, options=options,
+                            processes=args.processes)
+    else:
+        report = run_batch(steps, pairs, workers=args.workers,
+                           overwrite=args.overwrite, progress=progress,
+                           options=options)
+    print(report.summary())
+    return 1 if report.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
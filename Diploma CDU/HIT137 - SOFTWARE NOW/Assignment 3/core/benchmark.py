@@ -0,0 +1,407 @@
+"""Timings for every operation, the history and the display path.
+
+Runs each ImageProcessor operation, HistoryManager push/undo/redo, the
+canvas conversion display_image does, and a ten-step edit sequence like
+the app's (history push, operation, model update, redraw) on synthetic
+images, over a matrix of image sizes, channel counts and thread counts.
+Nothing outside the project is needed.
+
+    python -m core.benchmark -o baseline.json
+    python -m core.benchmark --sizes vga,12mp --threads 1,4 --compare baseline.json
+    python -m core.benchmark --load new.json --compare baseline.json
+
+Results are written as JSON. --compare matches cases with a saved run and
+reports every one whose median time grew by more than --tolerance, and
+then exits with status 1, so it can guard a change in a script.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from core.history import HistoryManager
+from core.image_model import ImageModel
+from core.image_processor import ImageProcessor
+from core.tile_executor import TileExecutor
+from core.viewport import Viewport
+
+# (height, width)
+SIZES = {
+    "vga": (480, 640),
+    "hd": (1080, 1920),
+    "12mp": (3000, 4000),
+    "24mp": (4000, 6000),
+    "50mp": (5792, 8688),
+    "100mp": (8192, 12288),
+}
+DEFAULT_SIZES = ("vga", "hd", "12mp")
+
+# (case, operation, parameters), one or more per ImageProcessor method
+OPERATION_CASES = [
+    ("grayscale", "grayscale", {}),
+    ("blur", "blur", {"intensity": 15}),
+    ("blur_large", "blur", {"intensity": 101}),
+    ("edge", "edge", {"t1": 80, "t2": 160}),
+    ("invert", "invert", {}),
+    ("brightness", "brightness", {"value": 30}),
+    ("contrast", "contrast", {"value": 1.3}),
+    ("stretch_contrast", "stretch_contrast", {"factor": 1.3}),
+    ("rotate_90", "rotate", {"angle": 90}),
+    ("rotate_30", "rotate", {"angle": 30}),
+    ("flip", "flip", {"mode": "h"}),
+    ("resize_half", "resize", {"scale": 50}),
+]
+
+# the app's ten-step stress test
+EDIT_SEQUENCE = [
+    ("brightness", {"value": 20}),
+    ("contrast", {"value": 1.2}),
+    ("blur", {"intensity": 9}),
+    ("flip", {"mode": "h"}),
+    ("invert", {}),
+    ("rotate", {"angle": 90}),
+    ("stretch_contrast", {"factor": 1.1}),
+    ("brightness", {"value": -10}),
+    ("resize", {"scale": 80}),
+    ("grayscale", {}),
+]
+
+CANVAS_SIZE = (1280, 800)
+HISTORY_DEPTH = 5
+
+
+def synthetic_image(size: Tuple[int, int], channels: int = 3, seed: int = 0) -> np.ndarray:
+    """A photo-like test image: smooth gradients, hard-edged shapes and noise.
+
+    Flat or random images would flatter the compressed history and the
+    edge detector, so this has a bit of everything.
+    """
+    height, width = size
+    rng = np.random.default_rng(seed)
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    xs = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    planes = [(xs * 0.6 + ys * 0.4), (xs * 0.2 + ys * 0.8), 255 - (xs + ys) * 0.5]
+    image = np.dstack([np.broadcast_to(p, (height, width)) for p in planes]).astype(np.uint8)
+    for _ in range(30):
+        x, y = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(width // 20 + 1, width // 4 + 2)), \
+            int(rng.integers(height // 20 + 1, height // 4 + 2))
+        cv2.rectangle(image, (x, y), (x + w, y + h),
+                      [int(c) for c in rng.integers(0, 256, 3)], -1)
+    image = cv2.add(image, rng.integers(0, 16, image.shape, dtype=np.uint8))
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if channels == 1 else image
+
+
+def _timings(func: Callable[[], object], repeats: int,
+             setup: Optional[Callable[[], object]] = None) -> List[float]:
+    """Seconds for each of repeats calls, after one untimed warm-up.
+
+    setup runs before every call, untimed, and its result is passed in.
+    """
+    times = []
+    for run in range(repeats + 1):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(arg) if setup is not None else func()
+        elapsed = time.perf_counter() - start
+        if run:
+            times.append(elapsed)
+    return times
+
+
+def _record(results: List[dict], group: str, case: str, size: str, channels: int,
+            threads: int, times: List[float], pixels: int) -> None:
+    median = statistics.median(times)
+    results.append({
+        "group": group, "case": case, "size": size, "channels": channels,
+        "threads": threads, "runs": len(times),
+        "median_ms": median * 1000, "min_ms": min(times) * 1000,
+        "mpix_per_s": pixels / 1e6 / median if median else None,
+    })
+
+
+def render_for_display(image: np.ndarray, viewport: Viewport,
+                       canvas: Tuple[int, int] = CANVAS_SIZE) -> Image.Image:
+    """What display_image does before handing pixels to Tk."""
+    view, _ = viewport.render(image, canvas[0], canvas[1])
+    if view.ndim == 3:
+        view = cv2.cvtColor(view, cv2.COLOR_BGR2RGB)
+    return Image.fromarray(view)
+
+
+def _photo_image():
+    """ImageTk.PhotoImage, or None when there is no display to make one on."""
+    try:
+        import tkinter as tk
+        from PIL import ImageTk
+        root = tk.Tk()
+    except Exception:
+        return None, None
+    root.withdraw()
+    return root, ImageTk.PhotoImage
+
+
+def _history_cases(image: np.ndarray, repeats: int):
+    """Push, undo and redo on a history HISTORY_DEPTH states deep."""
+    states = [image]
+    for step in range(HISTORY_DEPTH):
+        states.append(ImageProcessor.adjust_brightness(states[-1], 8 * (step % 2) - 4))
+
+    made = []
+
+    def pushed():
+        history = HistoryManager()
+        made.append(history)
+        for state in states[:-1]:
+            history.push(state)
+        return history
+
+    def push(history):
+        history.push(states[-1])
+
+    def undo_all(history):
+        current = states[-1]
+        for _ in range(HISTORY_DEPTH):
+            current = history.undo(current)
+
+    def undo_redo(history):
+        current = states[-1]
+        for _ in range(HISTORY_DEPTH):
+            current = history.undo(current)
+        for _ in range(HISTORY_DEPTH):
+            current = history.redo(current)
+
+    cases = []
+    for case, func in (("push", push), ("undo", undo_all), ("undo_redo", undo_redo)):
+        times = _timings(func, repeats, pushed)
+        per_step = 1 if case == "push" else HISTORY_DEPTH * (2 if case == "undo_redo" else 1)
+        cases.append((case, [t / per_step for t in times]))
+    for history in made:
+        history.close()
+    return cases
+
+
+def run(sizes=DEFAULT_SIZES, channel_counts=(1, 3), thread_counts=(1,),
+        repeats: int = 5, groups=("processor", "history", "display", "edit"),
+        progress: Optional[Callable[[str], None]] = None) -> dict:
+    """Run the benchmark matrix and return it as a JSON-ready dict.
+
+    Operations run through a TileExecutor with as many workers as the
+    thread count, with OpenCV's own threads set to the same number;
+    history and display do not depend on it and run once per image.
+    """
+    results: List[dict] = []
+    old_threads = cv2.getNumThreads()
+    root, photo_image = _photo_image() if "display" in groups else (None, None)
+    try:
+        for size in sizes:
+            for channels in channel_counts:
+                image = synthetic_image(SIZES[size], channels)
+                pixels = image.shape[0] * image.shape[1]
+                label = f"{size} x{channels}"
+                if "history" in groups:
+                    if progress:
+                        progress(f"{label} history")
+                    for case, times in _history_cases(image, repeats):
+                        _record(results, "history", case, size, channels, 1, times, pixels)
+                if "display" in groups:
+                    if progress:
+                        progress(f"{label} display")
+                    # a new viewport each time, as the viewport keeps its last render
+                    times = _timings(lambda: render_for_display(image, Viewport()), repeats)
+                    _record(results, "display", "render", size, channels, 1, times, pixels)
+                    if photo_image is not None:
+                        shown = render_for_display(image, Viewport())
+                        times = _timings(lambda: photo_image(shown), repeats)
+                        _record(results, "display", "photo_image", size, channels, 1,
+                                times, pixels)
+                for threads in thread_counts:
+                    cv2.setNumThreads(threads)
+                    executor = TileExecutor(threads)
+                    try:
+                        if "processor" in groups:
+                            for case, name, params in OPERATION_CASES:
+                                if progress:
+                                    progress(f"{label} {threads} threads {case}")
+                                times = _timings(
+                                    lambda: executor.apply(image, name, **params), repeats)
+                                _record(results, "processor", case, size, channels,
+                                        threads, times, pixels)
+                        if "edit" in groups:
+                            if progress:
+                                progress(f"{label} {threads} threads edit sequence")
+                            times = _timings(lambda: _edit_sequence(image, executor), repeats)
+                            _record(results, "edit", "ten_steps", size, channels, threads,
+                                    times, pixels)
+                    finally:
+                        executor.shutdown()
+    finally:
+        cv2.setNumThreads(old_threads)
+        if root is not None:
+            root.destroy()
+    return {"meta": environment(repeats), "results": results}
+
+
+def _edit_sequence(image: np.ndarray, executor: TileExecutor) -> None:
+    """EDIT_SEQUENCE the way the app commits edits, then undo all of it."""
+    model, history, viewport = ImageModel(), HistoryManager(), Viewport()
+    model.set_image(image)
+    for name, params in EDIT_SEQUENCE:
+        source = model.current_image
+        out = executor.apply(source, name, **params)
+        history.push(source)
+        model.apply_new_current(out)
+        render_for_display(out, viewport)
+    while True:
+        state = history.undo(model.current_image)
+        if state is None:
+            break
+        model.apply_new_current(state)
+    history.close()
+
+
+def environment(repeats: int) -> dict:
+    return {
+        "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "repeats": repeats,
+    }
+
+
+def _key(result: dict) -> Tuple:
+    return (result["group"], result["case"], result["size"],
+            result["channels"], result["threads"])
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.15,
+            floor_ms: float = 0.5) -> List[dict]:
+    """Cases in both runs, each with its change in median time.
+
+    A case is a regression when it is more than tolerance (a fraction)
+    slower and also more than floor_ms slower, so sub-millisecond jitter
+    on small images is not reported.
+    """
+    old = {_key(result): result for result in baseline["results"]}
+    rows = []
+    for result in current["results"]:
+        before = old.get(_key(result))
+        if before is None:
+            continue
+        ratio = result["median_ms"] / before["median_ms"] if before["median_ms"] else 1.0
+        slower_ms = result["median_ms"] - before["median_ms"]
+        rows.append({
+            "key": _key(result), "before_ms": before["median_ms"],
+            "after_ms": result["median_ms"], "ratio": ratio,
+            "regression": ratio > 1 + tolerance and slower_ms > floor_ms,
+        })
+    return rows
+
+
+def _print_results(data: dict) -> None:
+    for r in data["results"]:
+        rate = f"{r['mpix_per_s']:8.1f} MP/s" if r["mpix_per_s"] else ""
+        print(f"{r['group']:<9} {r['case']:<16} {r['size']:>5} x{r['channels']} "
+              f"t{r['threads']:<2} {r['median_ms']:9.2f} ms  {rate}")
+
+
+def _print_comparison(rows: List[dict]) -> None:
+    for row in rows:
+        group, case, size, channels, threads = row["key"]
+        flag = "REGRESSION" if row["regression"] else ""
+        print(f"{group:<9} {case:<16} {size:>5} x{channels} t{threads:<2} "
+              f"{row['before_ms']:9.2f} -> {row['after_ms']:9.2f} ms "
+              f"({(row['ratio'] - 1) * 100:+6.1f}%) {flag}")
+
+
+def _load(path: str) -> dict:
+    with open(path, encoding="utf-8") as handle:
+        return json.load(handle)
+
+
+def _names(text: str, known) -> List[str]:
+    names = [name for name in text.split(",") if name]
+    if names == ["all"]:
+        return list(known)
+    unknown = [name for name in names if name not in known]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown: {', '.join(unknown)}")
+    return names
+
+
+def _counts(text: str) -> List[int]:
+    try:
+        counts = [int(part) for part in text.split(",") if part]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"bad list of numbers '{text}'") from None
+    if not counts or min(counts) < 1:
+        raise argparse.ArgumentTypeError(f"bad list of numbers '{text}'")
+    return counts
+
+
+def main(argv=None) -> int:
+    groups = ("processor", "history", "display", "edit")
+    parser = argparse.ArgumentParser(
+        prog="python -m core.benchmark",
+        description="Time image operations, history and display on synthetic images.")
+    parser.add_argument("--sizes", type=lambda text: _names(text, SIZES),
+                        default=list(DEFAULT_SIZES),
+                        help=f"comma-separated from {', '.join(SIZES)}, or all "
+                             f"(default: {','.join(DEFAULT_SIZES)})")
+    parser.add_argument("--channels", type=_counts, default=[1, 3],
+                        help="channel counts, 1 and/or 3 (default: 1,3)")
+    parser.add_argument("--threads", type=_counts, default=[1],
+                        help="thread counts for the operations (default: 1)")
+    parser.add_argument("--groups", type=lambda text: _names(text, groups),
+                        default=list(groups), help=f"any of {', '.join(groups)}")
+    parser.add_argument("-r", "--repeats", type=int, default=5,
+                        help="timed runs per case; the median is reported (default: 5)")
+    parser.add_argument("-o", "--output", help="write the results to this JSON file")
+    parser.add_argument("--load", help="compare a saved results file instead of running")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="saved results to check for regressions against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="slowdown reported as a regression, as a fraction (default: 0.15)")
+    args = parser.parse_args(argv)
+    if any(channels not in (1, 3) for channels in args.channels):
+        parser.error("--channels must be 1 and/or 3")
+
+    try:
+        baseline = _load(args.compare) if args.compare else None
+        data = _load(args.load) if args.load else None
+    except (OSError, ValueError) as error:
+        parser.error(f"cannot read results: {error}")
+    if data is None:
+        data = run(args.sizes, args.channels, args.threads, args.repeats, args.groups,
+                   progress=lambda text: print(f"... {text}", file=sys.stderr, flush=True))
+        _print_results(data)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(data, handle, indent=2)
+
+    if baseline is not None:
+        rows = compare(baseline, data, args.tolerance)
+        _print_comparison(rows)
+        regressions = sum(row["regression"] for row in rows)
+        print(f"{len(rows)} cases compared, {regressions} regressions "
+              f"(over {args.tolerance:.0%} slower)")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,141 @@
+"""Recycle image-sized arrays instead of allocating a new one per operation.
+
+    python -m core.buffer_pool
+
+runs a memory benchmark of the same chain of operations with and without
+a pool, each in a fresh process so their peak RSS can be compared.
+"""
+from __future__ import annotations
+
+import json
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+Key = Tuple[Tuple[int, ...], str]
+
+
+class BufferPool:
+    """Arrays kept for reuse, keyed by shape and dtype.
+
+    acquire() hands back a released array of the right shape when there is
+    one and allocates otherwise; release() returns an array to the pool.
+    Arrays come back uninitialised. The pool holds at most max_bytes of
+    free arrays; anything released beyond that is simply left to the
+    garbage collector. Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        self._free: Dict[Key, List[np.ndarray]] = {}
+        self._held = 0
+        self._lock = threading.Lock()
+        self.allocations = 0
+        self.reuses = 0
+
+    @staticmethod
+    def _key(shape, dtype) -> Key:
+        return tuple(int(n) for n in shape), np.dtype(dtype).str
+
+    def acquire(self, shape, dtype=np.uint8) -> np.ndarray:
+        key = self._key(shape, dtype)
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                array = free.pop()
+                self._held -= array.nbytes
+                self.reuses += 1
+                return array
+            self.allocations += 1
+        return np.empty(key[0], np.dtype(key[1]))
+
+    def release(self, array: np.ndarray) -> None:
+        """Give array back. Views and read-only arrays are ignored."""
+        if array is None or array.base is not None or not array.flags.writeable:
+            return
+        with self._lock:
+            if self._held + array.nbytes > self.max_bytes:
+                return
+            free = self._free.setdefault(self._key(array.shape, array.dtype), [])
+            if any(a is array for a in free):
+                return
+            free.append(array)
+            self._held += array.nbytes
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes currently waiting in the pool."""
+        return self._held
+
+    def clear(self) -> None:
+        with self._lock:
+            self._free.clear()
+            self._held = 0
+
+
+# Shared pool for the short-lived intermediates inside single operations,
+# such as the grayscale image edge detection runs Canny on.
+scratch = BufferPool(max_bytes=64 * 1024 * 1024)
+
+
+# ---- benchmark --------------------------------------------------------
+
+BENCH_STEPS = [
+    ("grayscale", {}), ("blur", {"intensity": 7}), ("brightness", {"value": 15}),
+    ("edge", {}), ("invert", {}), ("flip", {"mode": "h"}),
+]
+
+
+def _measure(pooled: bool, frames: int, size: Tuple[int, int]) -> dict:
+    """Run the benchmark chain over frames images in this process."""
+    import resource
+
+    from core.image_processor import ImageProcessor
+
+    rng = np.random.default_rng(0)
+    source = rng.integers(0, 256, size + (3,), dtype=np.uint8)
+    # max_bytes=0 keeps nothing, so every request is a fresh allocation
+    # and the count shows what the unpooled path allocates
+    pool = BufferPool() if pooled else BufferPool(max_bytes=0)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for _ in range(frames):
+        result = ImageProcessor.apply_chain(source, BENCH_STEPS, pool=pool)
+        pool.release(result)
+    seconds = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != "darwin":
+        rss *= 1024  # Linux reports kilobytes
+    return {"allocations": pool.allocations, "reuses": pool.reuses,
+            "peak_traced_mb": peak / 1e6, "peak_rss_mb": rss / 1e6,
+            "seconds": seconds}
+
+
+def benchmark(frames: int = 50, size: Tuple[int, int] = (2000, 3000)) -> Dict[str, dict]:
+    """Measure the chain with and without pooling, each in its own process."""
+    results = {}
+    for label, pooled in (("unpooled", False), ("pooled", True)):
+        code = ("import json; from core.buffer_pool import _measure; "
+                f"print(json.dumps(_measure({pooled}, {frames}, {tuple(size)})))")
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True,
+                                text=True, check=True).stdout
+        results[label] = json.loads(output)
+    return results
+
+
+if __name__ == "__main__":
+    for label, result in benchmark().items():
+        print(f"{label:<9} {result['allocations']:>5} buffers allocated  "
+              f"{result['reuses']:>5} reused  "
+              f"peak traced {result['peak_traced_mb']:7.1f} MB  "
+              f"peak RSS {result['peak_rss_mb']:7.1f} MB  "
+              f"{result['seconds']:.2f}s")
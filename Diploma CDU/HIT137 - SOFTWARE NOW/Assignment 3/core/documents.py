@@ -0,0 +1,280 @@
+"""Several open images at once, kept within one memory budget.
+
+Each tab of the editor is a Document with its own ImageModel, undo
+history, operation log, view and selection. Only the document on screen
+has to be in memory. A MemoryGovernor adds up what every document holds
+and, once the total is over its budget, picks the least recently focused
+documents to park.
+
+Parking writes a document's pixels (the current and original images and
+any operation log keyframes) to zlib compressed files in a temp directory
+and moves its undo history to disk too (HistoryManager.pack), keeping
+only a canvas-sized thumbnail in memory. Compressing a large photo takes
+a while, so it is done in two steps: park() does the work without
+changing the document and can run on a worker thread, and finish_park()
+swaps the result in on the Tk thread, unless the document has been
+focused in the meantime. unpark() and finish_unpark() bring the pixels
+back the same way. The history stays on disk and is read back one entry
+at a time as undo reaches it.
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import shutil
+import tempfile
+import weakref
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from core.history import HistoryManager, OperationHistory
+from core.image_model import ImageModel
+from core.preview import PreviewProxy
+from core.viewport import Viewport
+
+
+class _StoredArray:
+    """An array written to a zlib compressed .npy file; key is the array's id."""
+
+    __slots__ = ("key", "path", "shape", "dtype")
+
+    def __init__(self, path: str, image: np.ndarray, level: int = 1) -> None:
+        self.key = id(image)
+        self.path = path
+        self.shape = image.shape
+        self.dtype = image.dtype
+        data = zlib.compress(np.ascontiguousarray(image).data, level)
+        np.save(path, np.frombuffer(data, dtype=np.uint8))
+
+    def read(self) -> np.ndarray:
+        data = np.load(self.path, mmap_mode="r")
+        flat = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        del data
+        # a copy, since arrays over bytes are read-only
+        return flat.view(self.dtype).reshape(self.shape).copy()
+
+
+class _Parked:
+    """What park() wrote for a document, and what it left in memory."""
+
+    def __init__(self, generation: int, arrays: Dict[int, np.ndarray],
+                 current: int, original: Optional[int]) -> None:
+        self.generation = generation
+        # id -> array while the park is being installed, so the ids stay valid
+        self.arrays: Optional[Dict[int, np.ndarray]] = arrays
+        self.current = current
+        self.original = original
+        self.stored: Dict[int, _StoredArray] = {}
+        self.history = None
+        self.thumbnail: Optional[np.ndarray] = None
+        self.scale = 1.0
+
+    @property
+    def disk_bytes(self) -> int:
+        return sum(os.path.getsize(stored.path) for stored in self.stored.values())
+
+    def discard(self) -> None:
+        for stored in self.stored.values():
+            try:
+                os.remove(stored.path)
+            except OSError:
+                pass
+
+
+class Document:
+    """One open image and everything that belongs to it; see the module docstring."""
+
+    def __init__(self, processor) -> None:
+        self.model = ImageModel()
+        self.history = HistoryManager()
+        self.op_history = OperationHistory(processor)
+        self.history_mode = "snapshot"
+        self.viewport = Viewport()
+        self.selection = None
+        self.current_file_path = None
+        self.unsaved_changes = False
+        # the path being decoded (or the _Parked being restored) and the
+        # edits waiting for it, as in EditorApp.open_file
+        self.loading = None
+        self.queued_edits: list = []
+        self.parked: Optional[_Parked] = None
+        # bumped every time the document is focused, so a park worked out
+        # before that is not installed over what happened since
+        self.generation = 0
+        self._directory: Optional[str] = None
+        self._cleanup = None
+        self._ids = itertools.count()
+
+    @property
+    def title(self) -> str:
+        path = self.current_file_path
+        if path is None and isinstance(self.loading, str):
+            path = self.loading
+        return Path(path).name if path else "Untitled"
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.model.has_image() and self.loading is None and self.parked is None
+
+    @property
+    def can_park(self) -> bool:
+        # tiled images are on disk already
+        return (self.parked is None and self.loading is None
+                and isinstance(self.model.current_image, np.ndarray))
+
+    def _arrays(self) -> Dict[int, np.ndarray]:
+        """The pixel arrays held, by id; one array is often held in several places."""
+        images = [self.model.current_image, self.model.original_image]
+        images += self.op_history.images()
+        return {id(image): image for image in images if isinstance(image, np.ndarray)}
+
+    def resident_bytes(self) -> int:
+        """Memory held for this document: pixels, undo history and layer renders."""
+        if self.parked is not None:
+            pixels = self.parked.thumbnail.nbytes
+        else:
+            pixels = sum(image.nbytes for image in self._arrays().values())
+        return pixels + self.history.stats().bytes_held + self.model.adjustments.nbytes
+
+    def _path(self) -> str:
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="hit137_parked_")
+            self._cleanup = weakref.finalize(
+                self, shutil.rmtree, self._directory, ignore_errors=True)
+        return os.path.join(self._directory, f"pixels_{next(self._ids)}.npy")
+
+    def park(self, generation: int, max_w: int, max_h: int) -> _Parked:
+        """Write the pixels and history to disk, keeping a max_w x max_h thumbnail.
+
+        Only reads the document, so it can run on a worker thread (images
+        are never changed in place). Nothing is freed until the result
+        is handed to finish_park(). generation is the document's when the
+        park was asked for; if it has been focused since, the result is
+        thrown away.
+        """
+        current = self.model.current_image
+        original = self.model.original_image
+        arrays = self._arrays()
+        parked = _Parked(generation, arrays, id(current),
+                         id(original) if original is not None else None)
+        try:
+            for key, image in arrays.items():
+                parked.stored[key] = _StoredArray(self._path(), image)
+            parked.history = self.history.pack(current)
+        except BaseException:
+            parked.discard()
+            raise
+        proxy = PreviewProxy()
+        thumbnail = proxy.get(current, max_w, max_h)
+        if thumbnail is current:
+            thumbnail = current.copy()
+        parked.thumbnail = self.model.adjustments.apply_to(thumbnail, proxy.scale)
+        parked.scale = proxy.scale
+        return parked
+
+    def finish_park(self, parked: _Parked) -> bool:
+        """Drop the pixels park() wrote out; False if the document changed since."""
+        if (parked.generation != self.generation or self.parked is not None
+                or self._arrays().keys() != parked.arrays.keys()):
+            self.history.discard_pack(parked.history)
+            parked.discard()
+            return False
+        if not self.history.install(parked.history):
+            parked.discard()
+            return False
+        stored = parked.stored
+        self.model.current_image = None
+        self.model.original_image = None
+        self.model.adjustments.set_base(None)
+        self.op_history.map_images(lambda image: stored.get(id(image), image))
+        self.viewport.forget()
+        parked.arrays = None
+        self.parked = parked
+        return True
+
+    def unpark(self):
+        """Read the parked pixels back; can run on a worker thread."""
+        parked = self.parked
+        return parked, {key: stored.read() for key, stored in parked.stored.items()}
+
+    def finish_unpark(self, result) -> bool:
+        """Put the arrays unpark() read back in place; False if it is out of date."""
+        parked, arrays = result
+        if parked is not self.parked:
+            return False
+        self.parked = None
+        self.model.current_image = arrays[parked.current]
+        self.model.original_image = arrays.get(parked.original)
+        self.model.adjustments.set_base(self.model.current_image)
+        # keyframes are _StoredArray stand-ins while parked
+        self.op_history.map_images(
+            lambda image: arrays[image.key] if isinstance(image, _StoredArray) else image)
+        parked.discard()
+        return True
+
+    def close(self) -> None:
+        """Delete the history and parked pixels, including their temp files."""
+        # a park still being worked out is not installed
+        self.generation += 1
+        self.history.close()
+        self.parked = None
+        if self._cleanup is not None:
+            self._cleanup()
+            self._cleanup = None
+            self._directory = None
+
+
+class MemoryGovernor:
+    """Keeps the open documents within one memory budget.
+
+    documents is in focus order, least recently focused first, so the
+    last one is the document on screen. parking holds the documents with
+    a park in progress.
+    """
+
+    def __init__(self, budget_bytes: int = 1024 * 1024 * 1024) -> None:
+        self.budget_bytes = budget_bytes
+        self.documents: List[Document] = []
+        self.parking: Set[Document] = set()
+
+    def add(self, document: Document) -> None:
+        self.documents.insert(0, document)
+
+    def remove(self, document: Document) -> None:
+        self.documents.remove(document)
+        self.parking.discard(document)
+
+    def focus(self, document: Document) -> None:
+        self.documents.remove(document)
+        self.documents.append(document)
+        document.generation += 1
+        self.parking.discard(document)
+
+    def resident_bytes(self) -> int:
+        return sum(document.resident_bytes() for document in self.documents)
+
+    @property
+    def parked_count(self) -> int:
+        return sum(document.parked is not None for document in self.documents)
+
+    def to_park(self) -> List[Document]:
+        """Documents to park, least recently focused first, to get back under budget.
+
+        The document on screen is never picked. Those picked are added to
+        parking, and should be removed when their park has finished.
+        """
+        # parks already under way will free their documents' memory
+        total = sum(document.resident_bytes() for document in self.documents
+                    if document not in self.parking)
+        picked = []
+        for document in self.documents[:-1]:
+            if total <= self.budget_bytes:
+                break
+            if document.can_park and document not in self.parking:
+                total -= document.resident_bytes()
+                picked.append(document)
+        self.parking.update(picked)
+        return picked
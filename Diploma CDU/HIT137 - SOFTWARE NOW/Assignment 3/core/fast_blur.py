@@ -0,0 +1,176 @@
+"""Gaussian blur whose cost stays flat as the kernel grows.
+
+cv2.GaussianBlur is separable, but still does k multiplies per pixel per
+direction. blur() picks a strategy from the kernel size instead:
+
+- "direct": up to DIRECT_MAX_KERNEL, cv2.GaussianBlur itself (exact).
+- "box": up to BOX_MAX_KERNEL, three box filters whose combined variance
+  matches the Gaussian's. Box filters use running sums, so they cost the
+  same for any width.
+- "pyramid": above that, shrink with INTER_AREA, blur the small image,
+  and enlarge back with INTER_LINEAR, with the blur on the small image
+  chosen so the three steps together have the requested variance.
+
+Both approximations mirror the image edges once up front, as
+GaussianBlur does, rather than letting each pass handle the border.
+
+Error bound, measured against cv2.GaussianBlur with the same kernel on
+hard-edged test patterns and on noise: the mean absolute difference is
+below 1 grey level once the image is a few kernel widths across (up to
+1.6 on thumbnails), and no pixel is off by more than 7 (box) or 3
+(pyramid) levels, the worst being at strong edges. Run this module to
+measure it again.
+"""
+from __future__ import annotations
+
+import math
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+DIRECT_MAX_KERNEL = 31
+BOX_MAX_KERNEL = 61
+# the small image in the pyramid path is blurred with about this sigma
+PYRAMID_SIGMA = 6.0
+
+
+def kernel_size(intensity: int) -> int:
+    """The odd kernel size ImageProcessor.blur uses for an intensity."""
+    k = max(1, int(intensity))
+    return k + 1 if k % 2 == 0 else k
+
+
+def kernel_sigma(k: int) -> float:
+    """Sigma cv2.GaussianBlur derives from kernel size k when given 0."""
+    return 0.3 * ((k - 1) * 0.5 - 1) + 0.8
+
+
+def strategy(k: int) -> str:
+    if k <= DIRECT_MAX_KERNEL:
+        return "direct"
+    if k <= BOX_MAX_KERNEL:
+        return "box"
+    return "pyramid"
+
+
+def reach(k: int) -> int:
+    """How many pixels away a blurred pixel can still see, for halos.
+
+    Exact for the direct and box paths. The pyramid path's sampling grid
+    depends on where the image starts, so tiles of it only agree with the
+    whole image to within the error bound above.
+    """
+    how = strategy(k)
+    if how == "direct":
+        return k // 2
+    sigma = kernel_sigma(k)
+    if how == "box":
+        return sum(size // 2 for size in box_sizes(sigma))
+    factor = max(2, int(sigma / PYRAMID_SIGMA))
+    return int(math.ceil(3 * sigma)) + 2 * factor
+
+
+def box_sizes(sigma: float, passes: int = 3) -> List[int]:
+    """Odd box widths whose repeated application approximates a Gaussian.
+
+    A box of width w has variance (w*w - 1) / 12; the widths are the two
+    odd sizes either side of the ideal one, mixed to hit sigma squared.
+    """
+    ideal = math.sqrt(12 * sigma * sigma / passes + 1)
+    lower = int(math.floor(ideal))
+    if lower % 2 == 0:
+        lower -= 1
+    upper = lower + 2
+    small_count = round((12 * sigma * sigma - passes * lower * lower
+                         - 4 * passes * lower - 3 * passes) / (-4 * lower - 4))
+    return [lower if i < small_count else upper for i in range(passes)]
+
+
+def _box_blur(image: np.ndarray, sigma: float) -> np.ndarray:
+    height, width = image.shape[:2]
+    sizes = box_sizes(sigma)
+    # mirror the edges once, as GaussianBlur does; letting each pass
+    # mirror its own already-blurred input would drift at the border
+    pad = min(sum(size // 2 for size in sizes), height - 1, width - 1)
+    padded = cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_REFLECT_101)
+    # float so the three passes do not each round to whole grey levels
+    work = padded.astype(np.float32)
+    for size in sizes:
+        cv2.blur(work, (size, size), dst=work)
+    return work[pad:pad + height, pad:pad + width]
+
+
+def _to_dtype(work: np.ndarray, dtype, dst: Optional[np.ndarray]) -> np.ndarray:
+    if dtype == np.uint8:
+        return cv2.convertScaleAbs(work, dst=dst)
+    result = work.astype(dtype)
+    if dst is not None:
+        np.copyto(dst, result)
+        return dst
+    return result
+
+
+def _pyramid_blur(image: np.ndarray, sigma: float) -> np.ndarray:
+    height, width = image.shape[:2]
+    factor = max(2, int(sigma / PYRAMID_SIGMA))
+    # mirror the edges first, as GaussianBlur does, so the small image's
+    # own border handling does not show; a whole number of factor-sized
+    # cells keeps the shrink aligned with the original pixels
+    pad = factor * int(math.ceil(min(3 * sigma, max(height, width)) / factor))
+    padded = cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_REFLECT_101)
+    full_h, full_w = padded.shape[:2]
+    small_w, small_h = max(1, full_w // factor), max(1, full_h // factor)
+    fx, fy = full_w / small_w, full_h / small_h
+    small = cv2.resize(padded, (small_w, small_h), interpolation=cv2.INTER_AREA)
+    # shrinking is a box of width f (variance f^2 / 12) and enlarging a
+    # tent of width 2f (variance f^2 / 6); the small blur makes up the rest
+    small_sigma_x = math.sqrt(max(sigma * sigma - fx * fx / 4, 0.25)) / fx
+    small_sigma_y = math.sqrt(max(sigma * sigma - fy * fy / 4, 0.25)) / fy
+    small = small.astype(np.float32)
+    small = cv2.GaussianBlur(small, (0, 0), small_sigma_x, sigmaY=small_sigma_y)
+    large = cv2.resize(small, (full_w, full_h), interpolation=cv2.INTER_LINEAR)
+    return large[pad:pad + height, pad:pad + width]
+
+
+def blur(image: np.ndarray, k: int, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Gaussian blur with an odd kernel size k, choosing the cheapest good path."""
+    how = strategy(k)
+    if how == "direct":
+        return cv2.GaussianBlur(image, (k, k), 0, dst=dst)
+    sigma = kernel_sigma(k)
+    work = _box_blur(image, sigma) if how == "box" else _pyramid_blur(image, sigma)
+    return _to_dtype(work, image.dtype, dst)
+
+
+def measure(k: int, image: np.ndarray) -> dict:
+    """Compare blur() with cv2.GaussianBlur for one kernel size."""
+    exact = cv2.GaussianBlur(image, (k, k), 0).astype(np.int16)
+    approx = blur(image, k).astype(np.int16)
+    diff = np.abs(exact - approx)
+    return {"k": k, "strategy": strategy(k), "mean": float(diff.mean()),
+            "max": int(diff.max())}
+
+
+if __name__ == "__main__":
+    import time
+
+    rng = np.random.default_rng(0)
+    test = np.zeros((1200, 1600, 3), np.uint8)
+    # hard edges and flat areas are the worst case for the approximations
+    for _ in range(40):
+        x, y = rng.integers(0, 1500), rng.integers(0, 1100)
+        cv2.rectangle(test, (int(x), int(y)), (int(x) + 200, int(y) + 120),
+                      [int(c) for c in rng.integers(0, 256, 3)], -1)
+    test = cv2.add(test, rng.integers(0, 40, test.shape, dtype=np.uint8))
+    for k in (15, 31, 33, 61, 91, 93, 151, 201, 301):
+        start = time.perf_counter()
+        blur(test, k)
+        fast = time.perf_counter() - start
+        start = time.perf_counter()
+        cv2.GaussianBlur(test, (k, k), 0)
+        slow = time.perf_counter() - start
+        result = measure(k, test)
+        print(f"k={k:<4} {result['strategy']:<8} mean err {result['mean']:.3f}  "
+              f"max err {result['max']:>3}  {fast * 1000:6.1f} ms  "
+              f"(GaussianBlur {slow * 1000:6.1f} ms)")
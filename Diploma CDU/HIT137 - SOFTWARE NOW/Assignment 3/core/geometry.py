@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import math
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.resample import interpolation_flag, layout, resize
+
+# Operations that only move pixels around, so any run of them can be
+# collapsed into one affine matrix.
+GEOMETRIC_OPERATIONS = {"rotate", "flip", "resize"}
+
+
+def step_matrix(name: str, params: dict, width: int, height: int) -> Tuple[np.ndarray, int, int]:
+    """Return the 3x3 matrix for one step and the size it produces.
+
+    Matrices work in continuous coordinates, where pixel i covers [i, i+1),
+    which keeps flips and resizes exact without half-pixel fix-ups.
+    Angles are clockwise, matching ImageProcessor.rotate.
+    """
+    if name == "flip":
+        if params["mode"] == "h":
+            return np.array([[-1, 0, width], [0, 1, 0], [0, 0, 1]], float), width, height
+        if params["mode"] == "v":
+            return np.array([[1, 0, 0], [0, -1, height], [0, 0, 1]], float), width, height
+        return np.eye(3), width, height
+
+    if name == "resize":
+        if params.get("width") is None and params.get("height") is None:
+            scale = max(10, min(params.get("scale", 100), 300))
+            new_w = int(width * scale / 100)
+            new_h = int(height * scale / 100)
+            return np.diag([new_w / width, new_h / height, 1.0]), new_w, new_h
+        # a target box: scale, then crop for fill (see resample.layout)
+        scaled_w, scaled_h, x0, y0, new_w, new_h = layout(
+            width, height, params.get("width"), params.get("height"),
+            params.get("mode", "fit"))
+        return np.array([[scaled_w / width, 0, -x0], [0, scaled_h / height, -y0],
+                         [0, 0, 1]], float), new_w, new_h
+
+    if name == "rotate":
+        angle = params["angle"] % 360
+        # exact values for right angles so those stay lossless
+        right = {0: (1, 0), 90: (0, 1), 180: (-1, 0), 270: (0, -1)}
+        if angle in right:
+            c, s = right[angle]
+            new_w, new_h = (height, width) if angle in (90, 270) else (width, height)
+        else:
+            rad = math.radians(angle)
+            c, s = math.cos(rad), math.sin(rad)
+            new_w = int(math.ceil(abs(c) * width + abs(s) * height - 1e-6))
+            new_h = int(math.ceil(abs(s) * width + abs(c) * height - 1e-6))
+        # rotate about the image centre, then centre on the new canvas
+        cx, cy = width / 2, height / 2
+        return np.array([
+            [c, -s, new_w / 2 - c * cx + s * cy],
+            [s, c, new_h / 2 - s * cx - c * cy],
+            [0, 0, 1],
+        ], float), new_w, new_h
+
+    raise ValueError(f"Not a geometric operation: {name}")
+
+
+def compose(steps, width: int, height: int) -> Tuple[np.ndarray, int, int]:
+    """Compose (name, params) steps into one matrix and the final size."""
+    matrix = np.eye(3)
+    for name, params in steps:
+        step, width, height = step_matrix(name, params, width, height)
+        matrix = step @ matrix
+    return matrix, width, height
+
+
+def output_shape(steps, shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """Shape of the image a chain of steps produces from one of the given shape.
+
+    Only geometric steps change the size; any others are passed over.
+    """
+    height, width = shape[:2]
+    for name, params in steps:
+        if name in GEOMETRIC_OPERATIONS:
+            _, width, height = step_matrix(name, params, width, height)
+    return (height, width) + tuple(shape[2:])
+
+
+def _covered_box(matrix: np.ndarray, width: int, height: int,
+                 out_w: int, out_h: int) -> Optional[Tuple[int, int, int, int]]:
+    """Where the output sits if matrix only flips, turns and scales the image.
+
+    Returns (x0, y0, box_w, box_h): the transformed image is box_w x
+    box_h and the output is the out_w x out_h window of it at x0, y0.
+    None if the matrix does anything else or the window is not covered.
+    """
+    linear = matrix[:2, :2]
+    nonzero = np.abs(linear) > 1e-9
+    if nonzero.sum(axis=0).max() > 1 or nonzero.sum(axis=1).max() > 1:
+        return None
+    corners = matrix @ np.array([[0, width], [0, height], [1, 1]], float)
+    low, high = corners[:2].min(axis=1), corners[:2].max(axis=1)
+    if not np.allclose(low, np.round(low), atol=1e-6) or \
+            not np.allclose(high, np.round(high), atol=1e-6):
+        return None
+    (x0, y0), (x1, y1) = -np.round(low).astype(int), np.round(high).astype(int)
+    if x0 < 0 or y0 < 0 or x1 < out_w or y1 < out_h:
+        return None
+    return int(x0), int(y0), int(x0 + x1), int(y0 + y1)
+
+
+def _interpolation(steps) -> Optional[str]:
+    """The filter the chain's resize steps ask for (the last one wins)."""
+    chosen = None
+    for name, params in steps:
+        if name == "resize" and params.get("interpolation") is not None:
+            chosen = params["interpolation"]
+    return chosen
+
+
+def _axis_aligned(image: np.ndarray, linear: np.ndarray, box_w: int, box_h: int,
+                  interpolation: Optional[str], dst: Optional[np.ndarray]) -> np.ndarray:
+    """Scale image then flip/turn it so it is box_w x box_h, as linear says."""
+    height, width = image.shape[:2]
+    swap = abs(linear[0, 1]) > abs(linear[0, 0])
+    pre_w, pre_h = (box_h, box_w) if swap else (box_w, box_h)
+    if (pre_w, pre_h) != (width, height):
+        if swap or linear[0, 0] < 0 or linear[1, 1] < 0:
+            image = resize(image, (pre_w, pre_h), interpolation)
+        else:
+            return resize(image, (pre_w, pre_h), interpolation, dst=dst)
+    if swap:
+        a, b = np.sign(linear[0, 1]), np.sign(linear[1, 0])
+        if a < 0 < b:
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=dst)
+        if b < 0 < a:
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=dst)
+        if a < 0:
+            return cv2.flip(cv2.transpose(image), -1, dst=dst)
+        return cv2.transpose(image, dst=dst)
+    sx, sy = np.sign(linear[0, 0]), np.sign(linear[1, 1])
+    if sx < 0 and sy < 0:
+        return cv2.flip(image, -1, dst=dst)
+    if sx < 0:
+        return cv2.flip(image, 1, dst=dst)
+    if sy < 0:
+        return cv2.flip(image, 0, dst=dst)
+    if dst is not None:
+        np.copyto(dst, image)
+        return dst
+    return image
+
+
+def apply_geometry(image: np.ndarray, steps, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Run a chain of rotate/flip/resize steps as a single transform.
+
+    Chains of right-angle turns, flips and resizes become at most one
+    resample (see resample.resize) plus one flip/rotate/transpose and a
+    crop for fill-mode resizes, so the image is resampled once however
+    many resizes the chain holds. Anything else (arbitrary angles) is one
+    cv2.warpAffine with the composed matrix.
+
+    The result is written into dst when given; it must have the shape
+    output_shape() reports and must not be image.
+    """
+    height, width = image.shape[:2]
+    matrix, out_w, out_h = compose(steps, width, height)
+    linear = matrix[:2, :2]
+    interpolation = _interpolation(steps)
+
+    box = _covered_box(matrix, width, height, out_w, out_h)
+    if box is not None:
+        x0, y0, box_w, box_h = box
+        if (x0, y0, box_w, box_h) == (0, 0, out_w, out_h):
+            return _axis_aligned(image, linear, box_w, box_h, interpolation, dst)
+        window = _axis_aligned(image, linear, box_w, box_h, interpolation, None)
+        window = window[y0:y0 + out_h, x0:x0 + out_w]
+        if dst is not None:
+            np.copyto(dst, window)
+            return dst
+        return window.copy()
+
+    # Large reductions are resampled first; warpAffine only looks at a
+    # few neighbours per pixel and would alias.
+    shrink = math.sqrt(abs(np.linalg.det(linear)))
+    if shrink < 1.0:
+        pre_w, pre_h = max(1, int(round(width * shrink))), max(1, int(round(height * shrink)))
+        image = resize(image, (pre_w, pre_h), "area")
+        matrix = matrix @ np.diag([width / pre_w, height / pre_h, 1.0])
+
+    # cv2 works in pixel indices, where the centre of pixel i is at i
+    to_index = np.array([[1, 0, -0.5], [0, 1, -0.5], [0, 0, 1]])
+    from_index = np.array([[1, 0, 0.5], [0, 1, 0.5], [0, 0, 1]])
+    warp = (to_index @ matrix @ from_index)[:2]
+    # warpAffine has no area filter; linear is its equivalent here
+    flag = interpolation_flag(None if interpolation == "area" else interpolation, False)
+    return cv2.warpAffine(image, warp, (out_w, out_h), dst=dst, flags=flag,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=0)
@@ -1,9 +1,255 @@
 from __future__ import annotations
 
+import itertools
+import os
+import shutil
+import tempfile
+import weakref
+import zlib
+from dataclasses import dataclass
+from typing import List, Optional
 
+import numpy as np
+
+from core.geometry import GEOMETRIC_OPERATIONS
+
+
+@dataclass
 class HistoryStats:
-    undo_count: int
-    redo_count: int
+    undo_count: int = 0
+    redo_count: int = 0
+    bytes_held: int = 0
+    raw_bytes: int = 0
+    disk_bytes: int = 0
+
+    @property
+    def compression_ratio(self) -> float:
+        """How many raw frame bytes each stored byte stands for."""
+        stored = self.bytes_held + self.disk_bytes
+        if stored == 0:
+            return 1.0
+        return self.raw_bytes / stored
+
+
+# Ways a state can be rebuilt from the state next to it on the same stack.
+# Flips and 90 degree turns are stored as the name of the move, so they cost
+# nothing no matter how large the frame is.
+_TRANSFORMS = {
+    "flip_h": lambda a: np.flip(a, 1),
+    "flip_v": lambda a: np.flip(a, 0),
+    "rotate_180": lambda a: np.flip(a, (0, 1)),
+    "rotate_cw": lambda a: np.rot90(a, -1),
+    "rotate_ccw": lambda a: np.rot90(a, 1),
+}
+
+
+def _find_transform(state: np.ndarray, neighbour: np.ndarray) -> Optional[str]:
+    """Return the name of a flip/rotation that turns neighbour into state."""
+    if state.dtype != neighbour.dtype or state.ndim != neighbour.ndim:
+        return None
+    if state.shape == neighbour.shape:
+        names = ("flip_h", "flip_v", "rotate_180")
+    elif state.shape[:2] == neighbour.shape[1::-1] and state.shape[2:] == neighbour.shape[2:]:
+        names = ("rotate_cw", "rotate_ccw")
+    else:
+        return None
+
+    step = max(1, state.shape[0] // 16)
+    for name in names:
+        view = _TRANSFORMS[name](neighbour)
+        # check a few rows first so a miss is cheap
+        if not np.array_equal(view[::step], state[::step]):
+            continue
+        if np.array_equal(view, state):
+            return name
+    return None
+
+
+class _Snapshot:
+    """One history state, stored raw or encoded against its stack neighbour.
+
+    kind is one of:
+    - "raw": the array itself (only ever the top of a stack)
+    - "transform": the state is a flip/rotation of the neighbour
+    - "delta": zlib compressed XOR against the neighbour
+    - "full": zlib compressed pixels
+    - "patch": the neighbour with a rectangle of other pixels pasted in;
+      payload is (x0, y0, pixels), and only the rectangle is held
+
+    A delta or full snapshot can be spilled to a .npy file, in which case
+    payload is None and path points at the file.
+    """
+
+    def __init__(self, kind: str, shape, dtype, payload,
+                 path: Optional[str] = None, disk_nbytes: int = 0) -> None:
+        self.kind = kind
+        self.shape = shape
+        self.dtype = np.dtype(dtype)
+        self.payload = payload
+        self.path = path
+        self.disk_nbytes = disk_nbytes
+
+    @classmethod
+    def raw(cls, state: np.ndarray) -> "_Snapshot":
+        return cls("raw", state.shape, state.dtype, state)
+
+    @classmethod
+    def patch(cls, state: np.ndarray, rect) -> "_Snapshot":
+        """state, stored as just its pixels under rect (x0, y0, x1, y1)."""
+        x0, y0, x1, y1 = rect
+        return cls("patch", state.shape, state.dtype, (x0, y0, state[y0:y1, x0:x1].copy()))
+
+    @property
+    def rect(self):
+        """(x0, y0, x1, y1) of a patch snapshot."""
+        x0, y0, pixels = self.payload
+        return x0, y0, x0 + pixels.shape[1], y0 + pixels.shape[0]
+
+    @property
+    def raw_nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def nbytes(self) -> int:
+        if self.kind == "raw":
+            return self.payload.nbytes
+        if self.kind == "patch":
+            return self.payload[2].nbytes
+        if self.kind == "transform" or self.path is not None:
+            return 0
+        return len(self.payload)
+
+    @property
+    def can_spill(self) -> bool:
+        return self.kind in ("delta", "full") and self.path is None
+
+    def spill(self, path: str) -> "_Snapshot":
+        """Write the encoded bytes to path and return the on-disk snapshot."""
+        np.save(path, np.frombuffer(self.payload, dtype=np.uint8))
+        return _Snapshot(self.kind, self.shape, self.dtype, None,
+                         path=path, disk_nbytes=os.path.getsize(path))
+
+    def discard(self) -> None:
+        """Delete the spill file, if there is one."""
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def encode(self, neighbour: np.ndarray, level: int) -> "_Snapshot":
+        """Return a compact copy of this raw snapshot relative to neighbour."""
+        state = self.payload
+        name = _find_transform(state, neighbour)
+        if name is not None:
+            return _Snapshot("transform", self.shape, self.dtype, name)
+
+        if state.shape == neighbour.shape and state.dtype == neighbour.dtype:
+            diff = np.bitwise_xor(np.ascontiguousarray(state).view(np.uint8),
+                                  np.ascontiguousarray(neighbour).view(np.uint8))
+            return _Snapshot("delta", self.shape, self.dtype,
+                             zlib.compress(diff.data, level))
+
+        data = np.ascontiguousarray(state)
+        return _Snapshot("full", self.shape, self.dtype, zlib.compress(data.data, level))
+
+    def decode(self, neighbour: np.ndarray) -> np.ndarray:
+        """Rebuild the state, given the array it was encoded against."""
+        if self.kind == "raw":
+            return self.payload
+        if self.kind == "transform":
+            return np.ascontiguousarray(_TRANSFORMS[self.payload](neighbour))
+        if self.kind == "patch":
+            x0, y0, x1, y1 = self.rect
+            state = neighbour.copy()
+            state[y0:y1, x0:x1] = self.payload[2]
+            return state
+
+        data = self.payload
+        if self.path is not None:
+            # map the spilled bytes back only now that they are needed
+            data = np.load(self.path, mmap_mode="r")
+        flat = np.frombuffer(zlib.decompress(data), dtype=np.uint8)
+        del data
+        if self.kind == "delta":
+            flat = np.bitwise_xor(flat, np.ascontiguousarray(neighbour).view(np.uint8).reshape(-1))
+        else:
+            flat = flat.copy()
+        return flat.view(self.dtype).reshape(self.shape)
+
+
+class _SnapshotStack:
+    """A stack whose top is kept raw and every lower entry is encoded
+    against the entry directly above it.
+
+    Neighbouring states are usually one edit apart, so the encoded entries
+    are small, and popping only ever has to decode a single entry.
+
+    Patch entries are the exception: they are pushed as patches, even on
+    top, and describe their state against whatever is above them, which
+    for the top entry is the caller's current image. They stay patches
+    when they reach the top, so a run of region edits never holds a whole
+    frame. HistoryManager.pack() encodes a raw top against the current
+    image in the same way.
+    """
+
+    def __init__(self, level: int) -> None:
+        self.items: List[_Snapshot] = []
+        self.level = level
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def clear(self) -> None:
+        for item in self.items:
+            item.discard()
+        self.items.clear()
+
+    def push(self, state: np.ndarray, entry: Optional[_Snapshot] = None) -> None:
+        """Push state, stored as entry (the raw array when not given)."""
+        if self.items and self.items[-1].kind == "raw":
+            self.items[-1] = self.items[-1].encode(state, self.level)
+        self.items.append(entry if entry is not None else _Snapshot.raw(state))
+
+    def pop(self, current: Optional[np.ndarray] = None) -> np.ndarray:
+        """Remove the top state and return it; current is needed for patches."""
+        state = self.items.pop().decode(current)
+        if self.items and self.items[-1].kind != "patch":
+            below = self.items[-1]
+            self.items[-1] = _Snapshot.raw(below.decode(state))
+            below.discard()
+        return state
+
+    @property
+    def top_rect(self):
+        """The rectangle of the top entry if it is a patch, else None."""
+        if self.items and self.items[-1].kind == "patch":
+            return self.items[-1].rect
+        return None
+
+    def drop_oldest(self) -> None:
+        # nothing is encoded against the bottom entry, so it can just go
+        self.items.pop(0).discard()
+
+    def spill_oldest(self, path: str) -> bool:
+        """Move the oldest in-memory encoded entry to disk."""
+        for i, item in enumerate(self.items):
+            if item.can_spill:
+                self.items[i] = item.spill(path)
+                return True
+        return False
+
+    @property
+    def nbytes(self) -> int:
+        return sum(item.nbytes for item in self.items)
+
+    @property
+    def disk_nbytes(self) -> int:
+        return sum(item.disk_nbytes for item in self.items)
+
+    @property
+    def raw_nbytes(self) -> int:
+        return sum(item.raw_nbytes for item in self.items)
 
 
 class HistoryManager:
@@ -12,42 +258,328 @@ class HistoryManager:
     Policy:
     - keeping track of past image states
     - putting states back in place when you undo or redo actions
+    - keeping the memory used by those states under max_bytes
+
+    Only the newest state on each stack is held as a plain array. Older ones
+    are stored as a flip/rotation of, or a compressed difference from, the
+    state above them, so an undo or redo only decodes one entry.
+
+    When RAM use goes over max_bytes, the oldest entries are moved to .npy
+    files in a session temp directory (up to max_disk_bytes) rather than
+    dropped, and are memory-mapped back when undo reaches them. The files
+    are removed by clear(), close(), or at interpreter exit.
+
+    pack() and install() move nearly all of it to disk at once, for a
+    document that is not being looked at (see core.documents).
     """
 
-    def __init__(self, max_states: int = 30) -> None:
-        self.undo_stack = []
-        self.redo_stack = []
+    def __init__(self, max_bytes: int = 512 * 1024 * 1024,
+                 max_states: Optional[int] = None, compress_level: int = 1,
+                 spill_to_disk: bool = True,
+                 max_disk_bytes: int = 4 * 1024 * 1024 * 1024) -> None:
+        self.undo_stack = _SnapshotStack(compress_level)
+        self.redo_stack = _SnapshotStack(compress_level)
+        self.max_bytes = max_bytes
         self.max_states = max_states
+        self.spill_to_disk = spill_to_disk
+        self.max_disk_bytes = max_disk_bytes
+        self._spill_dir: Optional[str] = None
+        self._spill_cleanup = None
+        self._spill_ids = itertools.count()
 
     def clear(self) -> None:
         self.undo_stack.clear()
         self.redo_stack.clear()
 
+    def close(self) -> None:
+        """Drop all history and delete the session temp directory."""
+        self.clear()
+        if self._spill_cleanup is not None:
+            self._spill_cleanup()
+            self._spill_cleanup = None
+            self._spill_dir = None
+
     def push(self, state) -> None:
         """Save a copy of the current state for undo."""
         if state is None:
             return
 
         # store a copy so later changes don't affect history
-        self.undo_stack.append(state.copy())
+        self.undo_stack.push(state.copy())
+        self.redo_stack.clear()
+        self._trim()
+
+    def push_region(self, state, rect) -> None:
+        """Save state for undo when the next state differs from it only inside rect.
+
+        Only the pixels under rect (x0, y0, x1, y1) are kept, and undo
+        pastes them back into the image it is given, so a region edit
+        costs history memory in proportion to the region.
+        """
+        if state is None:
+            return
+        self.undo_stack.push(state, _Snapshot.patch(state, rect))
         self.redo_stack.clear()
+        self._trim()
 
-        # keep history size under control
-        if len(self.undo_stack) > self.max_states:
-            self.undo_stack.pop(0)
+    def pack(self, current):
+        """Work out a copy of the history that holds almost nothing in memory.
+
+        The raw top of each stack is encoded against current, as patches
+        already are, and every compressed entry is written to disk. Nothing
+        is changed here, so this can run on a worker thread while the
+        history is not in use; hand the result to install(). current must
+        still be the image in use when the history is next used.
+        """
+        before = (list(self.undo_stack.items), list(self.redo_stack.items))
+        after = []
+        for items, stack in zip(before, (self.undo_stack, self.redo_stack)):
+            packed = []
+            for item in items:
+                if item.kind == "raw":
+                    # only ever the top entry
+                    item = item.encode(current, stack.level)
+                if item.can_spill and self.spill_to_disk:
+                    item = item.spill(self._spill_path())
+                packed.append(item)
+            after.append(packed)
+        return before, after
+
+    def install(self, packed) -> bool:
+        """Swap in the result of pack(), unless the history changed meanwhile."""
+        before, after = packed
+        stacks = (self.undo_stack, self.redo_stack)
+        if any(stack.items != items for stack, items in zip(stacks, before)):
+            self.discard_pack(packed)
+            return False
+        for stack, items in zip(stacks, after):
+            stack.items = items
+        self._trim()
+        return True
+
+    @staticmethod
+    def discard_pack(packed) -> None:
+        """Delete the files written for a pack() result that is not installed."""
+        before, after = packed
+        for old, new in zip(before, after):
+            for item in new:
+                if item not in old:
+                    item.discard()
+
+    @staticmethod
+    def _move(source: _SnapshotStack, target: _SnapshotStack, current_state):
+        """Pop source, pushing current_state onto target the same way."""
+        rect = source.top_rect
+        if rect is None:
+            target.push(current_state)
+        else:
+            # the two states only differ under the patch, so the way back
+            # is a patch too
+            target.push(current_state, _Snapshot.patch(current_state, rect))
+        return source.pop(current_state)
 
     def undo(self, current_state):
-        """Return the previous state, or None if not available."""
+        """Return the previous state, or None if not available.
+
+        The history takes over current_state, so the caller should replace
+        it with the returned array rather than keep editing it.
+        """
         if not self.undo_stack or current_state is None:
             return None
 
-        self.redo_stack.append(current_state.copy())
-        return self.undo_stack.pop()
+        state = self._move(self.undo_stack, self.redo_stack, current_state)
+        self._trim()
+        return state
 
     def redo(self, current_state):
         """Return the next state, or None if not available."""
         if not self.redo_stack or current_state is None:
             return None
 
-        self.undo_stack.append(current_state.copy())
-        return self.redo_stack.pop()
\ No newline at end of file
+        state = self._move(self.redo_stack, self.undo_stack, current_state)
+        self._trim()
+        return state
+
+    def stats(self) -> HistoryStats:
+        return HistoryStats(
+            undo_count=len(self.undo_stack),
+            redo_count=len(self.redo_stack),
+            bytes_held=self.undo_stack.nbytes + self.redo_stack.nbytes,
+            raw_bytes=self.undo_stack.raw_nbytes + self.redo_stack.raw_nbytes,
+            disk_bytes=self.undo_stack.disk_nbytes + self.redo_stack.disk_nbytes,
+        )
+
+    def _trim(self) -> None:
+        # keep history size under control, always leaving one undo step
+        while True:
+            can_drop = len(self.undo_stack) > 1
+            disk = self.undo_stack.disk_nbytes + self.redo_stack.disk_nbytes
+            if can_drop and (disk > self.max_disk_bytes or (
+                    self.max_states is not None and len(self.undo_stack) > self.max_states)):
+                self.undo_stack.drop_oldest()
+                continue
+
+            if self.undo_stack.nbytes + self.redo_stack.nbytes <= self.max_bytes:
+                break
+            if self._spill_one():
+                continue
+            # only entries under the top can go, and if none of them holds
+            # memory (spilled or transform entries) dropping frees nothing
+            if not can_drop or self.undo_stack.nbytes == self.undo_stack.items[-1].nbytes:
+                break
+            self.undo_stack.drop_oldest()
+
+    def _spill_one(self) -> bool:
+        """Move one in-memory entry to disk, oldest undo states first."""
+        if not self.spill_to_disk:
+            return False
+        path = self._spill_path()
+        return (self.undo_stack.spill_oldest(path)
+                or self.redo_stack.spill_oldest(path))
+
+    def _spill_path(self) -> str:
+        """A new file name in the session temp directory."""
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="hit137_history_")
+            self._spill_cleanup = weakref.finalize(
+                self, shutil.rmtree, self._spill_dir, ignore_errors=True)
+        return os.path.join(self._spill_dir, f"state_{next(self._spill_ids)}.npy")
+
+
+@dataclass
+class OperationStep:
+    """One entry in the operation log: what was done and with what settings."""
+    name: Optional[str]
+    params: dict
+    label: str
+
+
+class OperationHistory:
+    """Undo/redo by replaying a log of operations.
+
+    Instead of a picture per edit, each step records the operation name and
+    its parameters. A full keyframe is kept every keyframe_interval steps,
+    for operations that took longer than expensive_seconds, and for steps
+    that cannot be replayed by name. Any step is rebuilt by replaying from
+    the nearest keyframe at or before it, so memory grows with the number
+    of keyframes and jumping to any step is one replay away.
+
+    Step 0 is the base image (normally ImageModel.original_image).
+    """
+
+    def __init__(self, processor, keyframe_interval: int = 10,
+                 expensive_seconds: float = 0.25) -> None:
+        self.processor = processor
+        self.keyframe_interval = keyframe_interval
+        self.expensive_seconds = expensive_seconds
+        self.steps: List[OperationStep] = []
+        self.keyframes = {}
+        self.position = 0
+        self._current = None
+
+    def reset(self, base) -> None:
+        """Start a new log from base."""
+        self.steps.clear()
+        self.keyframes = {0: base} if base is not None else {}
+        self.position = 0
+        self._current = base
+
+    def clear(self) -> None:
+        self.reset(None)
+
+    def record(self, name: Optional[str], params: dict, result,
+               label: Optional[str] = None, elapsed: float = 0.0) -> None:
+        """Add a step whose output is result, dropping any redo steps.
+
+        Pass name=None for an edit that the processor cannot replay; its
+        result is then always kept as a keyframe.
+        """
+        if not self.keyframes:
+            return
+
+        del self.steps[self.position:]
+        for step in [s for s in self.keyframes if s > self.position]:
+            del self.keyframes[step]
+
+        self.steps.append(OperationStep(name, dict(params), label or name or "Edit"))
+        self.position = len(self.steps)
+        self._current = result
+        if (name is None or elapsed >= self.expensive_seconds
+                or self.position % self.keyframe_interval == 0):
+            self.keyframes[self.position] = result
+
+    def state_at(self, step: int):
+        """Rebuild the image after the given step."""
+        if self.position == step and self._current is not None:
+            return self._current
+
+        start = max(k for k in self.keyframes if k <= step)
+        return self._replay(self.keyframes[start], self.steps[start:step])
+
+    def _replay(self, image, steps: List[OperationStep]):
+        """Run logged steps on image, giving the pixels they gave when committed.
+
+        apply_chain() composes runs of rotate/flip/resize into one resample,
+        which is not what applying them one at a time gave, so those steps
+        are replayed one by one. Other runs still go through apply_chain().
+        """
+        run = []
+        for entry in steps:
+            if entry.name not in GEOMETRIC_OPERATIONS:
+                run.append((entry.name, entry.params))
+                continue
+            if run:
+                image = self.processor.apply_chain(image, run)
+                run = []
+            image = self.processor.apply(image, entry.name, **entry.params)
+        if run:
+            image = self.processor.apply_chain(image, run)
+        return image
+
+    def jump(self, step: int):
+        """Move straight to a step and return its image, or None if out of range."""
+        if not self.keyframes or not 0 <= step <= len(self.steps):
+            return None
+        if step == self.position + 1:
+            # redo by one only needs the next operation
+            entry = self.steps[self.position]
+            image = self.keyframes.get(step)
+            if image is None:
+                image = self.processor.apply(self._current, entry.name, **entry.params)
+        else:
+            image = self.state_at(step)
+        self.position = step
+        self._current = image
+        return image
+
+    def undo(self, current_state=None):
+        """Return the previous state, or None if not available."""
+        if self.position == 0:
+            return None
+        return self.jump(self.position - 1)
+
+    def redo(self, current_state=None):
+        """Return the next state, or None if not available."""
+        if self.position >= len(self.steps):
+            return None
+        return self.jump(self.position + 1)
+
+    def images(self) -> list:
+        """The images held: every keyframe and the current step."""
+        images = list(self.keyframes.values()) + [self._current]
+        return [image for image in images if image is not None]
+
+    def map_images(self, func) -> None:
+        """Replace every image held with func(image), e.g. to move them out of memory."""
+        self.keyframes = {step: func(image) for step, image in self.keyframes.items()}
+        if self._current is not None:
+            self._current = func(self._current)
+
+    def stats(self) -> HistoryStats:
+        held = sum(image.nbytes for image in self.keyframes.values())
+        return HistoryStats(
+            undo_count=self.position,
+            redo_count=len(self.steps) - self.position,
+            bytes_held=held,
+            raw_bytes=held,
+        )
@@ -0,0 +1,97 @@
+"""Open photographs in two steps: a quick reduced decode, then the full one.
+
+libjpeg can decode straight to 1/2, 1/4 or 1/8 size by skipping most of
+the inverse DCT, which OpenCV exposes as the IMREAD_REDUCED_COLOR_* flags.
+That is an order of magnitude faster than a full decode, so a large JPEG
+can be on screen at canvas size almost at once while the full picture is
+decoded in the background. Other formats have no such shortcut and are
+simply decoded in full.
+
+    python -m core.image_loader photo.jpg
+
+times the reduced and full decodes of a file.
+"""
+from __future__ import annotations
+
+import time
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+REDUCED_FLAGS = {
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+}
+JPEG_SUFFIXES = (".jpg", ".jpeg", ".jpe", ".jfif")
+
+
+def image_size(path) -> Optional[Tuple[int, int]]:
+    """(width, height) from the file header, without decoding any pixels."""
+    try:
+        with Image.open(path) as image:
+            return image.size
+    except OSError:
+        return None
+
+
+def reduction_for(size: Tuple[int, int], max_w: int, max_h: int) -> int:
+    """Largest of 8, 4 and 2 that still leaves enough pixels for max_w x max_h.
+
+    1 means a reduced decode would be smaller than the picture is shown,
+    so it is not worth doing.
+    """
+    width, height = size
+    shown = min(1.0, max_w / width, max_h / height)
+    for factor in REDUCED_FLAGS:
+        if factor * shown <= 1.0:
+            return factor
+    return 1
+
+
+def read_reduced(path, max_w: int, max_h: int) -> Optional[Tuple[np.ndarray, float]]:
+    """Decode a JPEG at the smallest size that still fills max_w x max_h.
+
+    Returns the picture and its scale relative to the full image, or None
+    when the file is not a JPEG, is too small to gain anything, or cannot
+    be read; the caller then just decodes it in full.
+    """
+    path = str(path)
+    if not path.lower().endswith(JPEG_SUFFIXES):
+        return None
+    size = image_size(path)
+    if size is None:
+        return None
+    factor = reduction_for(size, max_w, max_h)
+    if factor == 1:
+        return None
+    image = cv2.imread(path, REDUCED_FLAGS[factor])
+    if image is None:
+        return None
+    return image, 1.0 / factor
+
+
+def read_full(path) -> Optional[np.ndarray]:
+    """Decode the whole picture, or return None if it cannot be read."""
+    return cv2.imread(str(path))
+
+
+if __name__ == "__main__":
+    import sys
+
+    for name in sys.argv[1:]:
+        start = time.perf_counter()
+        reduced = read_reduced(name, 800, 600)
+        first = time.perf_counter() - start
+        start = time.perf_counter()
+        full = read_full(name)
+        whole = time.perf_counter() - start
+        if full is None:
+            print(f"{name}: cannot be read")
+            continue
+        shown = "no reduced decode" if reduced is None else \
+            f"{reduced[0].shape[1]}x{reduced[0].shape[0]} in {first * 1000:.0f} ms"
+        print(f"{name}: {shown}; full {full.shape[1]}x{full.shape[0]} "
+              f"in {whole * 1000:.0f} ms")
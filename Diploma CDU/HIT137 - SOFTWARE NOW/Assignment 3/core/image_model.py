@@ -3,22 +3,41 @@ from __future__ import annotations
 from pathlib import Path
 from typing import Optional, Tuple
 
+from core.adjustments import AdjustmentStack
+
 
 class ImageModel:
     """Stores image state + metadata.
 
-    The app should see pictures as OpenCV BGR (uint8) arrays.
+    The app should see pictures as OpenCV BGR (uint8) arrays, or as
+    single-channel 2-D arrays once they are grayscale. color_mode says
+    which ("bgr" or "gray"), so grayscale and edge maps take a third of
+    the memory here and in the history.
 
     Responsibilities:
     - Keep the original image and the current functioning image.
     - Keep track of the file location and the "dirty" status (changes that haven't been saved).
     - Give minor utility methods to keep the GUI code clean.
+
+    adjustments holds non-destructive layers (brightness, contrast, blur)
+    over current_image. Edits still change current_image itself, and the
+    layers are then worked out again over the result. Saving writes
+    adjustments.render() at full resolution.
     """
     def __init__(self) -> None:
         self.original_image = None
         self.current_image = None
         self.file_path: Optional[Path] = None
         self.dirty: bool = False
+        self.color_mode: Optional[str] = None
+        self.adjustments = AdjustmentStack()
+
+    @staticmethod
+    def color_mode_of(image) -> Optional[str]:
+        """Return "gray" for single-channel images and "bgr" otherwise."""
+        if image is None:
+            return None
+        return "gray" if len(image.shape) == 2 else "bgr"
 
     def has_image(self) -> bool:
         """Return True if an image is currently loaded."""
@@ -30,11 +49,16 @@ class ImageModel:
         self.current_image = image
         self.file_path = path
         self.dirty = False
+        self.color_mode = self.color_mode_of(image)
+        self.adjustments.clear()
+        self.adjustments.set_base(image)
 
     def apply_new_current(self, image) -> None:
         """Update the current image after processing."""
         self.current_image = image
         self.dirty = True
+        self.color_mode = self.color_mode_of(image)
+        self.adjustments.set_base(image)
 
     def mark_saved(self, path: Optional[Path] = None) -> None:
         """Mark the image as saved."""
@@ -1,8 +1,16 @@
 from __future__ import annotations
 
+from typing import Optional
+
 import cv2
 import numpy as np
 
+from core import fast_blur
+from core.buffer_pool import BufferPool, scratch
+from core.geometry import GEOMETRIC_OPERATIONS, apply_geometry, output_shape
+from core.point_ops import (POINT_OPERATIONS, apply_lut, apply_point_ops,
+                            contrast_about_mean_lut)
+
 
 class ImageProcessor:
     """Gives the app image processing functions.
@@ -14,77 +22,258 @@ class ImageProcessor:
         - Changing the brightness and contrast
         - Rotation, flipping, and resizing
     All methods should:
-        - Take photos as numpy arrays in OpenCV BGR format
-        - Send back photographs that have been processed in BGR format
+        - Take photos as numpy arrays, either OpenCV BGR or single-channel
+          grayscale (2-D)
+        - Send back photographs in the same layout, except that grayscale
+          and edge detection always give single-channel images
+
+    Brightness, contrast and invert are lookup tables (see point_ops), and
+    apply_chain() fuses runs of them into a single pass. It also folds runs
+    of rotate/flip/resize into one transform (see geometry).
+
+    Every method takes an optional dst array of the right shape and writes
+    its result there instead of allocating one. For the operations in
+    IN_PLACE_OPERATIONS dst may be the input image itself.
     """
 
     @staticmethod
-    def to_grayscale(image: np.ndarray) -> np.ndarray:
-        """Convert BGR image to grayscale (returned as 3-channel BGR)."""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        return cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    def to_grayscale(image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Convert BGR image to grayscale (returned as one channel)."""
+        if image.ndim == 2:
+            return ImageProcessor._copy(image, dst)
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=dst)
 
     @staticmethod
-    def blur(image: np.ndarray, intensity: int = 5) -> np.ndarray:
-        """Apply Gaussian blur. Intensity should be a positive odd number."""
-        k = int(intensity)
-        if k < 1:
-            k = 1
-        if k % 2 == 0:
-            k += 1
-        return cv2.GaussianBlur(image, (k, k), 0)
+    def to_bgr(image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Expand a single-channel image to 3-channel BGR (BGR passes through)."""
+        if image.ndim == 3:
+            return ImageProcessor._copy(image, dst)
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR, dst=dst)
+
+    @staticmethod
+    def blur(image: np.ndarray, intensity: int = 5,
+             dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Apply Gaussian blur. Intensity should be a positive odd number.
+
+        Large kernels use a box or pyramid approximation (see fast_blur),
+        so any radius costs about the same.
+        """
+        return fast_blur.blur(image, fast_blur.kernel_size(intensity), dst=dst)
 
     @staticmethod
-    def edge_detection(image: np.ndarray, t1: int = 80, t2: int = 160) -> np.ndarray:
-        """Detect edges using Canny (returned as 3-channel BGR)."""
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, t1, t2)
-        return cv2.cvtColor(edges, cv2.COLOR_GRAY2BGR)
+    def edge_detection(image: np.ndarray, t1: int = 80, t2: int = 160,
+                       dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Detect edges using Canny (returned as one channel)."""
+        if image.ndim == 2:
+            return cv2.Canny(image, t1, t2, edges=dst)
+        gray = scratch.acquire(image.shape[:2], np.uint8)
+        cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
+        result = cv2.Canny(gray, t1, t2, edges=dst)
+        scratch.release(gray)
+        return result
 
     @staticmethod
-    def invert(image: np.ndarray) -> np.ndarray:
+    def invert(image: np.ndarray, dst: Optional[np.ndarray] = None) -> np.ndarray:
         """Invert colours of a BGR image."""
-        return cv2.bitwise_not(image)
+        return apply_point_ops(image, [("invert", {})], dst)
 
     @staticmethod
-    def adjust_brightness(image: np.ndarray, value: int) -> np.ndarray:
+    def adjust_brightness(image: np.ndarray, value: int,
+                          dst: Optional[np.ndarray] = None) -> np.ndarray:
         """Adjust image brightness."""
-        return cv2.convertScaleAbs(image, alpha=1.0, beta=value)
+        return apply_point_ops(image, [("brightness", {"value": value})], dst)
 
     @staticmethod
-    def adjust_contrast(image: np.ndarray, value: float) -> np.ndarray:
+    def adjust_contrast(image: np.ndarray, value: float,
+                        dst: Optional[np.ndarray] = None) -> np.ndarray:
         """Adjust image contrast."""
-        return cv2.convertScaleAbs(image, alpha=value, beta=0)
+        return apply_point_ops(image, [("contrast", {"value": value})], dst)
 
     @staticmethod
-    def rotate(image: np.ndarray, angle: int) -> np.ndarray:
-        """Rotate image by 90, 180 or 270 degrees."""
+    def stretch_contrast(image: np.ndarray, factor: float, mean=None,
+                         dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Scale contrast around the mean brightness of the image.
+
+        mean can be given when it is already known (e.g. for one tile of a
+        larger image).
+        """
+        if mean is None:
+            channels = 1 if image.ndim == 2 else image.shape[2]
+            mean = sum(cv2.mean(image)[:channels]) / channels
+        if image.dtype != np.uint8:
+            return cv2.convertScaleAbs(
+                (image.astype(np.float32) - mean) * factor + mean, dst=dst)
+        return apply_lut(image, contrast_about_mean_lut(factor, mean), dst)
+
+    @staticmethod
+    def _copy(image: np.ndarray, dst: Optional[np.ndarray]) -> np.ndarray:
+        # for the no-op cases: hand back image, or fill dst with it
+        if dst is None or dst is image:
+            return image
+        np.copyto(dst, image)
+        return dst
+
+    @staticmethod
+    def rotate(image: np.ndarray, angle: float,
+               dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Rotate image clockwise by angle degrees.
+
+        90, 180 and 270 are exact. Other angles enlarge the canvas to fit
+        the turned image and fill the corners with black.
+        """
         angle = angle % 360
         if angle == 90:
-            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+            return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE, dst=dst)
         if angle == 180:
-            return cv2.rotate(image, cv2.ROTATE_180)
+            return cv2.rotate(image, cv2.ROTATE_180, dst=dst)
         if angle == 270:
-            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
-        return image
+            return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE, dst=dst)
+        if angle == 0:
+            return ImageProcessor._copy(image, dst)
+        return apply_geometry(image, [("rotate", {"angle": angle})], dst)
 
     @staticmethod
-    def flip(image: np.ndarray, mode: str) -> np.ndarray:
+    def flip(image: np.ndarray, mode: str, dst: Optional[np.ndarray] = None) -> np.ndarray:
         """Flip image horizontally or vertically."""
         if mode == "h":
-            return cv2.flip(image, 1)
+            return cv2.flip(image, 1, dst=dst)
         if mode == "v":
-            return cv2.flip(image, 0)
-        return image
+            return cv2.flip(image, 0, dst=dst)
+        return ImageProcessor._copy(image, dst)
+
+    @staticmethod
+    def resize(image: np.ndarray, scale: float = 100, dst: Optional[np.ndarray] = None,
+               width: Optional[int] = None, height: Optional[int] = None,
+               mode: str = "fit", interpolation: Optional[str] = None) -> np.ndarray:
+        """Resize image by scale percentage (10% to 300%), or to a target box.
+
+        With width and/or height the image is fitted inside the box,
+        cropped to fill it or stretched to it, as mode says (see
+        resample.layout), and scale is ignored. interpolation names the
+        filter ("area", "linear", "cubic" or "lanczos"); by default area
+        is used to shrink and linear to enlarge. Large reductions are
+        halved with a pyramid first, so they stay fast with any filter.
+        """
+        params = {"scale": scale, "width": width, "height": height,
+                  "mode": mode, "interpolation": interpolation}
+        return apply_geometry(image, [("resize", params)], dst)
+
+    # Names used for operations in recipes and the operation log history,
+    # mapped to the method that runs them.
+    OPERATIONS = {
+        "grayscale": "to_grayscale",
+        "blur": "blur",
+        "edge": "edge_detection",
+        "invert": "invert",
+        "brightness": "adjust_brightness",
+        "contrast": "adjust_contrast",
+        "stretch_contrast": "stretch_contrast",
+        "rotate": "rotate",
+        "flip": "flip",
+        "resize": "resize",
+    }
+
+    # Operations that may write their result over their own input
+    IN_PLACE_OPERATIONS = {"blur", "invert", "brightness", "contrast",
+                           "stretch_contrast", "flip"}
+    # Operations whose result is single-channel whatever they are given
+    SINGLE_CHANNEL_OPERATIONS = {"grayscale", "edge"}
+
+    @classmethod
+    def output_shape(cls, steps, shape) -> tuple:
+        """Shape of the image a chain of steps produces from one of the given shape."""
+        shape = tuple(shape)
+        for name, params in steps:
+            if name in cls.SINGLE_CHANNEL_OPERATIONS:
+                shape = shape[:2]
+            elif name in GEOMETRIC_OPERATIONS:
+                shape = output_shape([(name, params)], shape)
+        return shape
+
+    @classmethod
+    def apply(cls, image: np.ndarray, name: str, dst: Optional[np.ndarray] = None,
+              **params) -> np.ndarray:
+        """Run an operation by name, e.g. apply(image, "blur", intensity=5)."""
+        if name not in cls.OPERATIONS:
+            raise ValueError(f"Unknown operation: {name}")
+        if hasattr(image, "apply_operation"):
+            # tiled images run the operation tile by tile themselves
+            return image.apply_operation(name, **params)
+        return getattr(cls, cls.OPERATIONS[name])(image, dst=dst, **params)
+
+    @classmethod
+    def apply_inplace(cls, image: np.ndarray, name: str, **params) -> np.ndarray:
+        """Run an operation by name, overwriting image with the result."""
+        if name not in cls.IN_PLACE_OPERATIONS:
+            raise ValueError(f"{name} cannot run in place")
+        return cls.apply(image, name, dst=image, **params)
 
     @staticmethod
-    def resize(image: np.ndarray, scale: int) -> np.ndarray:
-        """Resize image by scale percentage."""
-        # Ensure scale is within a reasonable range (10% to 300%)
-        scale = max(10, min(scale, 300))
-        height, width = image.shape[:2]
-        new_w = int(width * scale / 100)
-        new_h = int(height * scale / 100)
-        # Use INTER_AREA for shrinking and INTER_LINEAR for enlarging
-        interpolation = cv2.INTER_AREA if scale < 100 else cv2.INTER_LINEAR
-        return cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+    def _runs(steps):
+        """Group steps into (kind, run) pieces that apply_chain runs in one go."""
+        runs = []
+        for name, params in steps:
+            if name in POINT_OPERATIONS:
+                kind = "point"
+            elif name in GEOMETRIC_OPERATIONS:
+                kind = "geometry"
+            else:
+                kind = None
+            if kind is not None and runs and runs[-1][0] == kind:
+                runs[-1][1].append((name, params))
+            else:
+                runs.append((kind, [(name, params)]))
+        return runs
+
+    @classmethod
+    def apply_chain(cls, image: np.ndarray, steps, dst: Optional[np.ndarray] = None,
+                    pool: Optional[BufferPool] = None) -> np.ndarray:
+        """Run a list of (name, params) steps in order.
+
+        Consecutive brightness/contrast/invert steps are merged into one
+        lookup table, so a chain of them touches each pixel only once.
+        Consecutive rotate/flip/resize steps are composed into one
+        transform, so the image is resampled at most once per run.
+
+        The final result goes into dst when given. With a pool, the
+        intermediate results come from it and go back to it as soon as
+        the next step has used them; when there is no dst the result is
+        a pool buffer the caller may release once done with it.
+        """
+        source = image
+        runs = cls._runs(steps)
+        pooled = (pool is not None and isinstance(image, np.ndarray)
+                  and image.dtype == np.uint8)
+        for index, (kind, run) in enumerate(runs):
+            out = None
+            if index == len(runs) - 1:
+                out = dst
+            if out is None and pooled:
+                out = pool.acquire(cls.output_shape(run, image.shape), image.dtype)
+            result = cls._apply_run(image, kind, run, out)
+            if pooled and image is not source and image is not result:
+                pool.release(image)
+            image = result
+        if not runs:
+            # nothing to run, but the result must still be dst or a pool buffer
+            if dst is None and pooled:
+                dst = pool.acquire(image.shape, image.dtype)
+            return cls._copy(image, dst)
+        return image
+
+    @classmethod
+    def _apply_run(cls, image, kind: Optional[str], run, dst=None) -> np.ndarray:
+        if hasattr(image, "map_tiles"):
+            # tiled images do their own tile-by-tile work
+            if kind == "point":
+                return image.map_tiles(
+                    lambda tile, ops=tuple(run): apply_point_ops(tile, ops))
+            for name, params in run:
+                image = cls.apply(image, name, **params)
+            return image
+        if kind == "point":
+            return apply_point_ops(image, run, dst)
+        if len(run) == 1:
+            name, params = run[0]
+            return cls.apply(image, name, dst=dst, **params)
+        return apply_geometry(image, run, dst)
@@ -0,0 +1,137 @@
+"""Encode images with tunable settings and write them without risking the old file.
+
+save_image() encodes to memory first and then writes a temporary file
+next to the target, which replaces the target in one rename once it is
+complete. A crash or full disk part way through leaves the old file as
+it was.
+
+Encoder settings come as EncodeOptions, usually one of PROFILES:
+
+- "fast": quickest encode; PNG skips match searching and stores only
+  Huffman codes, so files come out a little bigger
+- "balanced": the default
+- "small": smallest files; optimised JPEG Huffman tables, PNG level 9
+"""
+from __future__ import annotations
+
+import os
+import shutil
+import time
+import uuid
+from dataclasses import dataclass
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+
+@dataclass(frozen=True)
+class EncodeOptions:
+    """Settings for the encoders cv2.imencode offers."""
+
+    jpeg_quality: int = 95          # 0-100
+    jpeg_optimize: bool = False     # compute Huffman tables per image: smaller, slower
+    png_compression: int = 3        # 0 (none, fastest) to 9 (smallest)
+    png_strategy: int = cv2.IMWRITE_PNG_STRATEGY_DEFAULT
+    webp_quality: int = 90          # 1-100; above 100 is lossless
+
+    def params(self, extension: str) -> List[int]:
+        """cv2.imencode flags for a file extension such as ".png"."""
+        extension = extension.lower()
+        if extension in (".jpg", ".jpeg", ".jpe", ".jfif"):
+            return [cv2.IMWRITE_JPEG_QUALITY, int(self.jpeg_quality),
+                    cv2.IMWRITE_JPEG_OPTIMIZE, int(self.jpeg_optimize)]
+        if extension == ".png":
+            return [cv2.IMWRITE_PNG_COMPRESSION, int(self.png_compression),
+                    cv2.IMWRITE_PNG_STRATEGY, int(self.png_strategy)]
+        if extension == ".webp":
+            return [cv2.IMWRITE_WEBP_QUALITY, int(self.webp_quality)]
+        return []
+
+
+PROFILES = {
+    "fast": EncodeOptions(jpeg_quality=90, png_compression=1,
+                          png_strategy=cv2.IMWRITE_PNG_STRATEGY_HUFFMAN_ONLY,
+                          webp_quality=75),
+    "balanced": EncodeOptions(),
+    "small": EncodeOptions(jpeg_quality=90, jpeg_optimize=True, png_compression=9,
+                           webp_quality=80),
+}
+
+
+def encode(image: np.ndarray, extension: str,
+           options: EncodeOptions = PROFILES["balanced"]) -> bytes:
+    """Encode image in the format extension names."""
+    try:
+        ok, encoded = cv2.imencode(extension, image, options.params(extension))
+    except cv2.error:
+        ok = False
+    if not ok:
+        raise ValueError(f"Cannot encode {extension} images")
+    return encoded.tobytes()
+
+
+def _partial_path(target: str, suffix: str = ".part") -> str:
+    """A temporary name next to target that no other writer will pick."""
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    return f"{target}.{uuid.uuid4().hex[:8]}{suffix}"
+
+
+def _replace(partial: str, target: str) -> None:
+    if os.path.exists(target):
+        # saving over a file keeps its permissions
+        shutil.copymode(target, partial)
+    os.replace(partial, target)
+
+
+def write_atomic(target: str, data: bytes) -> None:
+    """Write data to target so that target is only ever whole or untouched.
+
+    The bytes go to a temporary file in the same folder, are flushed to
+    disk, and then renamed over target, which is atomic on one file
+    system. The temporary file is removed if anything fails.
+    """
+    partial = _partial_path(target)
+    try:
+        with open(partial, "xb") as stream:
+            stream.write(data)
+            stream.flush()
+            os.fsync(stream.fileno())
+        _replace(partial, target)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+
+
+def save_image(image, path, options: EncodeOptions = PROFILES["balanced"]) -> Tuple[int, float]:
+    """Encode and atomically write image to path.
+
+    Returns (bytes written, seconds spent encoding). Tiled images and
+    .npy files are written by numpy rather than an image encoder, and
+    for them the time includes writing.
+    """
+    path = str(path)
+    extension = os.path.splitext(path)[1].lower()
+    if hasattr(image, "to_array") and extension != ".npy":
+        # other formats have no streaming encoder, so load it whole
+        image = image.to_array()
+    start = time.perf_counter()
+    if extension == ".npy":
+        # numpy insists on the .npy ending, so it goes after .part
+        partial = _partial_path(path, ".part.npy")
+        try:
+            if hasattr(image, "save"):
+                image.save(partial)
+            else:
+                np.save(partial, image)
+            _replace(partial, path)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        return os.path.getsize(path), time.perf_counter() - start
+    data = encode(image, extension, options)
+    seconds = time.perf_counter() - start
+    write_atomic(path, data)
+    return len(data), seconds
@@ -0,0 +1,167 @@
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from typing import Callable, Iterable, List, Optional
+
+# Marks the end of the stream on a queue
+_DONE = object()
+
+
+class StageStats:
+    """Where one stage's worker threads spent their time.
+
+    busy is time inside the stage function, starved is time waiting for
+    input and blocked is time waiting for room in the next queue. A stage
+    with high utilisation is the bottleneck; stages feeding it show up as
+    blocked and stages after it as starved.
+    """
+
+    def __init__(self, name: str, workers: int) -> None:
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0
+        self.starved = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, busy: float, starved: float, blocked: float,
+            ok: Optional[bool]) -> None:
+        """Record one item; ok=None records only the wait for the end marker."""
+        with self._lock:
+            if ok is not None:
+                self.items += 1
+                self.errors += 0 if ok else 1
+            self.busy += busy
+            self.starved += starved
+            self.blocked += blocked
+
+    def utilisation(self, wall: float) -> float:
+        """Fraction of the stage's thread time spent doing work."""
+        return self.busy / (self.workers * wall) if wall > 0 else 0.0
+
+    def line(self, wall: float) -> str:
+        per_thread = self.workers * wall or 1.0
+        return (f"{self.name:<8} x{self.workers:<2} {self.items:>6} items  "
+                f"busy {100 * self.utilisation(wall):5.1f}%  "
+                f"starved {100 * self.starved / per_thread:5.1f}%  "
+                f"blocked {100 * self.blocked / per_thread:5.1f}%")
+
+
+class Stage:
+    """One step of a Pipeline: func is run on each item by `workers` threads."""
+
+    def __init__(self, name: str, func: Callable, workers: int = 1) -> None:
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+
+
+class Pipeline:
+    """Streams items through stages that each have their own threads.
+
+    Stages are joined by bounded queues, so a slow stage makes the ones
+    before it wait instead of piling up results: at most about queue_size
+    items per stage are in memory, however long the input is. OpenCV
+    releases the GIL while decoding, filtering and encoding, so threads
+    keep every core busy.
+
+    Results come back on the calling thread in completion order, not input
+    order. An item whose stage raises is reported to on_error and dropped;
+    the rest of the stream carries on.
+    """
+
+    def __init__(self, stages: List[Stage], queue_size: int = 4) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.queue_size = max(1, queue_size)
+        self.stats = [StageStats(stage.name, stage.workers) for stage in stages]
+        self.wall = 0.0
+
+    def run(self, items: Iterable, on_result: Optional[Callable] = None,
+            on_error: Optional[Callable] = None) -> float:
+        """Push items through every stage. Returns the wall time in seconds.
+
+        on_result(result) is called for each item leaving the last stage and
+        on_error(stage_name, item, exception) for each failure, both on the
+        calling thread.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        # the last stage hands results (and errors) to the calling thread
+        results: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        queues.append(results)
+        threads = []
+
+        def feed():
+            try:
+                for item in items:
+                    queues[0].put(item)
+            finally:
+                for _ in range(self.stages[0].workers):
+                    queues[0].put(_DONE)
+
+        threads.append(threading.Thread(target=feed, daemon=True))
+        for index, stage in enumerate(self.stages):
+            remaining = [stage.workers]
+            lock = threading.Lock()
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, daemon=True,
+                    args=(stage, self.stats[index], queues[index], queues[index + 1],
+                          results, remaining, lock, self._next_workers(index))))
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        while True:
+            message = results.get()
+            if message is _DONE:
+                break
+            failed, payload = message
+            if failed:
+                if on_error is not None:
+                    on_error(*payload)
+            elif on_result is not None:
+                on_result(payload)
+        for thread in threads:
+            thread.join()
+        self.wall = time.perf_counter() - start
+        return self.wall
+
+    def _next_workers(self, index: int) -> int:
+        # how many end markers the next queue needs: one per reader
+        return self.stages[index + 1].workers if index + 1 < len(self.stages) else 1
+
+    def _work(self, stage: Stage, stats: StageStats, inbox: queue.Queue,
+              outbox: queue.Queue, results: queue.Queue, remaining: list,
+              lock: threading.Lock, readers: int) -> None:
+        last = outbox is results
+        while True:
+            waited = time.perf_counter()
+            item = inbox.get()
+            started = time.perf_counter()
+            if item is _DONE:
+                stats.add(0.0, started - waited, 0.0, ok=None)
+                break
+            try:
+                result = stage.func(item)
+            except Exception as error:
+                # failures skip the remaining stages and go straight to the caller
+                finished = time.perf_counter()
+                results.put((True, (stage.name, item, error)))
+                stats.add(finished - started, started - waited, 0.0, ok=False)
+                continue
+            finished = time.perf_counter()
+            outbox.put((False, result) if last else result)
+            stats.add(finished - started, started - waited,
+                      time.perf_counter() - finished, ok=True)
+
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                for _ in range(readers):
+                    outbox.put(_DONE)
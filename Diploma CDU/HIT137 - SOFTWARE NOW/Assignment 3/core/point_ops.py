@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Iterable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Operations that map each pixel value on its own, so any run of them can
+# be collapsed into one lookup table.
+POINT_OPERATIONS = {"brightness", "contrast", "invert"}
+
+_RAMP = np.arange(256, dtype=np.float64)
+# cv2.convertScaleAbs does its arithmetic in float32, so the tables for
+# brightness and contrast do too, to round the same way
+_RAMP32 = np.arange(256, dtype=np.float32)
+
+
+def _freeze(steps: Iterable) -> Tuple:
+    """Turn [(name, params), ...] into a hashable key for the LUT cache."""
+    return tuple((name, tuple(sorted(params.items()))) for name, params in steps)
+
+
+def _to_uint8(values: np.ndarray) -> np.ndarray:
+    # same rounding as cv2.convertScaleAbs: |v|, round half to even, clamp
+    return np.clip(np.rint(np.abs(values)), 0, 255).astype(np.uint8)
+
+
+def _single_lut(name: str, params: dict) -> np.ndarray:
+    if name == "brightness":
+        return _to_uint8(_RAMP32 + np.float32(params["value"]))
+    if name == "contrast":
+        return _to_uint8(_RAMP32 * np.float32(params["value"]))
+    if name == "invert":
+        return (255 - _RAMP).astype(np.uint8)
+    raise ValueError(f"Not a point operation: {name}")
+
+
+@lru_cache(maxsize=256)
+def _chain_lut(key: Tuple) -> np.ndarray:
+    lut = np.arange(256, dtype=np.uint8)
+    for name, params in key:
+        # feeding one table through the next keeps each step's rounding,
+        # so the fused result matches running the steps one by one
+        lut = _single_lut(name, dict(params))[lut]
+    lut.setflags(write=False)
+    return lut
+
+
+def chain_lut(steps) -> np.ndarray:
+    """Return the 256-entry table for a list of (name, params) point steps.
+
+    Tables are cached by their parameters, so the next image in a batch
+    with the same settings reuses the table without rebuilding it.
+    """
+    return _chain_lut(_freeze(steps))
+
+
+def contrast_about_mean_lut(factor: float, mean: float) -> np.ndarray:
+    """Table for stretching contrast around a fixed mean value."""
+    return _to_uint8((_RAMP - mean) * factor + mean)
+
+
+def apply_lut(image: np.ndarray, lut: np.ndarray,
+              dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Apply a table in one pass.
+
+    lut is (256,) for the same curve on every channel, or (256, C) for a
+    separate curve per channel. dst may be image itself.
+    """
+    if lut.ndim == 2 and lut.shape[1] > 1:
+        return cv2.LUT(image, lut.reshape(256, 1, lut.shape[1]), dst=dst)
+    return cv2.LUT(image, lut.reshape(256), dst=dst)
+
+
+def apply_point_ops(image: np.ndarray, steps,
+                    dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """Run a list of point operations with a single pass over the pixels.
+
+    The result is written into dst when given; dst may be image itself.
+    """
+    steps = list(steps)
+    if image.dtype != np.uint8:
+        # tables only cover 8-bit values; fall back to one pass per step
+        for name, params in steps:
+            if name == "invert":
+                image = cv2.bitwise_not(image)
+            elif name == "brightness":
+                image = cv2.convertScaleAbs(image, alpha=1.0, beta=params["value"])
+            else:
+                image = cv2.convertScaleAbs(image, alpha=params["value"], beta=0)
+        if dst is not None:
+            np.copyto(dst, image)
+            return dst
+        return image
+    return apply_lut(image, chain_lut(steps), dst)
@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from core.resample import resize
+from core.tiled_image import TiledImage
+
+
+class PreviewProxy:
+    """Keeps a downscaled copy of the current image for live previews.
+
+    While a slider is being dragged the operation runs on this proxy, which
+    is only as big as the canvas, instead of on the full resolution image.
+    The proxy is rebuilt only when the source image or the canvas size
+    changes.
+    """
+
+    def __init__(self) -> None:
+        self._source = None
+        self._size: Optional[Tuple[int, int]] = None
+        self._proxy = None
+        self.scale = 1.0
+
+    def get(self, image: np.ndarray, max_w: int, max_h: int) -> np.ndarray:
+        """Return image shrunk to fit within max_w x max_h (never enlarged)."""
+        if image is self._source and self._size == (max_w, max_h):
+            return self._proxy
+
+        height, width = image.shape[:2]
+        scale = min(1.0, max_w / width, max_h / height)
+        if isinstance(image, TiledImage):
+            # built from the pyramid, never from the full resolution tiles
+            proxy = image.thumbnail(max_w, max_h)
+            scale = proxy.shape[1] / width
+        elif scale < 1.0:
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            proxy = resize(image, size, "area")
+        else:
+            proxy = image
+
+        self._source = image
+        self._size = (max_w, max_h)
+        self._proxy = proxy
+        self.scale = scale
+        return proxy
+
+    def clear(self) -> None:
+        self._source = None
+        self._size = None
+        self._proxy = None
+        self.scale = 1.0
@@ -0,0 +1,195 @@
+"""Per-phase timings of edits, with export to the Chrome trace format.
+
+The app wraps each step of an edit in Profiler.phase(): "process" (the
+filter, on a worker thread), "history" (push or undo), "model" and
+"render" (the canvas conversion). Each phase records its wall time, the
+image shape and, through tracemalloc, the bytes allocated while it ran.
+The whole edit, from the request to the redraw, is recorded as one span
+around them, queueing included.
+
+export_chrome_trace() writes the events as Chrome trace-event JSON, which
+chrome://tracing or https://ui.perfetto.dev open as a timeline with one
+row per thread.
+
+While disabled, phase() hands back a shared do-nothing context, so the
+hooks can stay in place. tracemalloc slows down every Python allocation
+while it runs, so it is only started while the profiler is enabled, and
+its counts are process-wide: phases that overlap on different threads
+see each other's allocations.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+# the order the status bar readout lists phases in
+PHASES = ("process", "history", "model", "render")
+
+
+class _NullPhase:
+    def __enter__(self) -> "_NullPhase":
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "args", "start", "memory")
+
+    def __init__(self, profiler: "Profiler", name: str, args: dict) -> None:
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self) -> "_Phase":
+        self.memory = None
+        if tracemalloc.is_tracing():
+            self.memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> bool:
+        end = time.perf_counter()
+        if self.memory is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            self.args["allocated_bytes"] = max(0, peak - self.memory)
+            self.args["retained_bytes"] = current - self.memory
+        self.profiler._record(self.name, self.start, end, self.args)
+        return False
+
+    def set(self, **args) -> None:
+        """Add details found during the phase, e.g. the output shape."""
+        self.args.update(args)
+
+
+class Profiler:
+    """Collects phase timings; see the module docstring."""
+
+    def __init__(self, max_events: int = 100_000) -> None:
+        self.enabled = False
+        self.track_memory = False
+        self._events: deque = deque(maxlen=max_events)
+        self._origin = time.perf_counter()
+        self._threads: Dict[int, str] = {}
+        self._spans = 0
+        # token -> (label, start) of the edits begun and not yet ended
+        self._open: Dict[int, Tuple[str, float]] = {}
+        self._tokens = itertools.count(1)
+        # name -> (milliseconds, allocated bytes) of its latest run
+        self.last: Dict[str, Tuple[float, Optional[int]]] = {}
+
+    def enable(self, track_memory: bool = True) -> None:
+        self.enabled = True
+        self.track_memory = track_memory
+        if track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self) -> None:
+        self.enabled = False
+        if self.track_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.track_memory = False
+
+    def clear(self) -> None:
+        self._events.clear()
+        self.last.clear()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def phase(self, name: str, image=None, **args):
+        """Context manager timing one phase; image gives the shape recorded."""
+        if not self.enabled:
+            return _NULL_PHASE
+        if image is not None:
+            args["shape"] = list(image.shape)
+        return _Phase(self, name, args)
+
+    def begin_edit(self, label: str) -> Optional[int]:
+        """Start the span of one edit and return its token.
+
+        Every token must go to end_edit() when the edit is committed, or
+        to discard_edit() when it is cancelled, fails or is replaced by a
+        newer request, which records nothing.
+        """
+        if not self.enabled:
+            return None
+        token = next(self._tokens)
+        self._open[token] = (label, time.perf_counter())
+        return token
+
+    def end_edit(self, token: Optional[int], **args) -> None:
+        edit = self._open.pop(token, None)
+        if edit is None or not self.enabled:
+            return
+        label, start = edit
+        self._spans += 1
+        self._record(label, start, time.perf_counter(), args, span=self._spans)
+
+    def discard_edit(self, token: Optional[int]) -> None:
+        self._open.pop(token, None)
+
+    @property
+    def open_edits(self) -> int:
+        """How many edits have begun and not yet ended or been discarded."""
+        return len(self._open)
+
+    def _record(self, name: str, start: float, end: float, args: dict,
+                span: Optional[int] = None) -> None:
+        thread = threading.current_thread()
+        self._threads.setdefault(thread.ident, thread.name)
+        self._events.append((name, start, end, thread.ident, args, span))
+        if span is None:
+            self.last[name] = ((end - start) * 1000, args.get("allocated_bytes"))
+
+    def readout(self) -> str:
+        """The latest time of each phase, for the status bar."""
+        parts = []
+        for name in PHASES:
+            if name not in self.last:
+                continue
+            ms, allocated = self.last[name]
+            # allocations under half a megabyte are just bookkeeping
+            memory = f" {allocated / 1e6:.0f} MB" if (allocated or 0) >= 500_000 else ""
+            parts.append(f"{name} {ms:.0f} ms{memory}")
+        return " | ".join(parts)
+
+    def chrome_trace(self) -> dict:
+        """The events in Chrome's trace-event format (times in microseconds)."""
+        pid = os.getpid()
+        events = [{"name": "thread_name", "ph": "M", "pid": pid, "tid": tid,
+                   "args": {"name": name}} for tid, name in self._threads.items()]
+        for name, start, end, tid, args, span in list(self._events):
+            ts = (start - self._origin) * 1e6
+            if span is None:
+                events.append({"name": name, "cat": "phase", "ph": "X", "ts": ts,
+                               "dur": (end - start) * 1e6, "pid": pid, "tid": tid,
+                               "args": args})
+            else:
+                # edits overlap each other and cross threads, so they are
+                # async spans rather than nested complete events
+                common = {"name": name, "cat": "edit", "id": span, "pid": pid, "tid": tid}
+                events.append(dict(common, ph="b", ts=ts, args=args))
+                events.append(dict(common, ph="e", ts=(end - self._origin) * 1e6))
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path) -> int:
+        """Write chrome_trace() to path and return the number of events."""
+        trace = self.chrome_trace()
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump(trace, handle)
+        return len(trace["traceEvents"])
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# how many rows and columns of the input go into its fingerprint
+_SAMPLE_ROWS = 64
+_SAMPLE_COLUMNS = 32
+
+
+def _freeze(params: dict) -> Tuple:
+    return tuple(sorted((name, repr(value)) for name, value in params.items()))
+
+
+def _sample_hash(image: np.ndarray) -> int:
+    """CRC of evenly spaced whole rows and whole columns of image."""
+    rows = image[::max(1, image.shape[0] // _SAMPLE_ROWS)]
+    crc = zlib.crc32(np.ascontiguousarray(rows).data)
+    if image.ndim > 1:
+        columns = image[:, ::max(1, image.shape[1] // _SAMPLE_COLUMNS)]
+        crc = zlib.crc32(np.ascontiguousarray(columns).data, crc)
+    return crc
+
+
+def _same_pixels(a: np.ndarray, b: np.ndarray) -> bool:
+    """np.array_equal, a band of rows at a time so no frame-sized mask is made."""
+    if a.shape != b.shape or a.dtype != b.dtype:
+        return False
+    if a.ndim == 0 or a.size == 0:
+        return np.array_equal(a, b)
+    rows = max(1, (1 << 20) // max(1, a[0].nbytes))
+    return all(np.array_equal(a[y:y + rows], b[y:y + rows])
+               for y in range(0, a.shape[0], rows))
+
+
+class ResultCache:
+    """Remembers operation results by input content and parameters.
+
+    Keys are a fingerprint of the input (shape, dtype and a CRC of a few
+    dozen whole rows and columns, about 1 ms on a 12 MP photo) plus the
+    operation and its parameters, so the same work on the same pixels is
+    found again even when the array is a different object, e.g. a copy
+    handed back by undo. Fingerprints are remembered per array object, so
+    an image is only sampled the first time it is seen.
+
+    A sample can miss a change, so each result is stored with the input
+    it was made from, and a hit is only returned after a full comparison
+    of the two inputs (skipped when they are the same object). Inputs and
+    results both count towards max_bytes; an input shared by several
+    results counts once.
+
+    Inputs must not be modified after they have been looked up, and the
+    results stored are made read-only so they cannot be either. Least
+    recently used results are evicted once they hold more than max_bytes.
+    Safe to share between threads.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.max_bytes = max_bytes
+        # key -> (input or None, result)
+        self._entries: "OrderedDict[Tuple, Tuple[Optional[np.ndarray], np.ndarray]]" = OrderedDict()
+        # id(input) -> [input, number of entries made from it]
+        self._sources: Dict[int, List] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # id(array) -> (weak reference, fingerprint)
+        self._fingerprints: Dict[int, Tuple[weakref.ref, Tuple]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def fingerprint(self, image: np.ndarray) -> Tuple:
+        key = id(image)
+        with self._lock:
+            known = self._fingerprints.get(key)
+            if known is not None and known[0]() is image:
+                return known[1]
+        fingerprint = (image.shape, image.dtype.str, _sample_hash(image))
+        with self._lock:
+            self._fingerprints[key] = (
+                weakref.ref(image, lambda _, k=key: self._fingerprints.pop(k, None)),
+                fingerprint)
+        return fingerprint
+
+    def key(self, image: np.ndarray, steps) -> Tuple:
+        """Cache key for running (name, params) steps on image."""
+        return (self.fingerprint(image),
+                tuple((name, _freeze(params)) for name, params in steps))
+
+    def get(self, key, image: Optional[np.ndarray] = None) -> Optional[np.ndarray]:
+        """The result stored under key, or None.
+
+        With image, the result only counts if it was made from the same
+        pixels.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and image is not None:
+            source = entry[0]
+            if source is not None and source is not image and not _same_pixels(source, image):
+                # the fingerprint samples matched but the pixels do not
+                entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result: np.ndarray, source: Optional[np.ndarray] = None) -> None:
+        """Store result under key; source is the input it was made from."""
+        if source is not None and source.base is not None:
+            # a view, e.g. the crop of a region edit, would keep its whole
+            # frame alive while counting only its own bytes
+            source = source.copy()
+        with self._lock:
+            new = source is not None and id(source) not in self._sources
+            if result.nbytes + (source.nbytes if new else 0) > self.max_bytes:
+                return
+            result.setflags(write=False)
+            self._remove(key)
+            if source is not None:
+                held = self._sources.get(id(source))
+                if held is None:
+                    held = self._sources[id(source)] = [source, 0]
+                    self._bytes += source.nbytes
+                held[1] += 1
+            self._entries[key] = (source, result)
+            self._bytes += result.nbytes
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        source, result = entry
+        self._bytes -= result.nbytes
+        if source is not None:
+            held = self._sources[id(source)]
+            held[1] -= 1
+            if held[1] == 0:
+                del self._sources[id(source)]
+                self._bytes -= source.nbytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._bytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sources.clear()
+            self._bytes = 0
+
+    def summary(self) -> str:
+        return (f"Cache: {self.hits} hits, {self.misses} misses, "
+                f"{self.evictions} evicted ({self._bytes / 1e6:.0f} MB)")
+
+
+class CachedProcessor:
+    """Puts a ResultCache in front of anything with apply()/apply_chain().
+
+    Wraps ImageProcessor or a TileExecutor and offers the same two calls,
+    so a repeated operation costs a dictionary lookup instead of a filter
+    pass. Images that are not arrays (tiled images) go straight through.
+
+    Results that are stored are made read-only. With copy_results the
+    cache keeps a copy instead and the caller gets a writable result, e.g.
+    one it can give back to a BufferPool.
+    """
+
+    def __init__(self, processor, cache: Optional[ResultCache] = None,
+                 copy_results: bool = False) -> None:
+        self.processor = processor
+        self.cache = cache if cache is not None else ResultCache()
+        self.copy_results = copy_results
+
+    def apply(self, image: np.ndarray, name: str, **params) -> np.ndarray:
+        return self.apply_chain(image, [(name, params)])
+
+    def apply_chain(self, image: np.ndarray, steps, dst: Optional[np.ndarray] = None,
+                    **options) -> np.ndarray:
+        steps = list(steps)
+        if dst is not None:
+            options = dict(options, dst=dst)
+        if not isinstance(image, np.ndarray) or not steps:
+            return self.processor.apply_chain(image, steps, **options)
+        key = self.cache.key(image, steps)
+        result = self.cache.get(key, image)
+        if result is None:
+            result = self.processor.apply_chain(image, steps, **options)
+            if result is not image:
+                # dst belongs to the caller, so the cache keeps its own copy
+                copy = self.copy_results or result is dst
+                self.cache.put(key, result.copy() if copy else result, image)
+        elif dst is not None:
+            np.copyto(dst, result)
+            return dst
+        return result
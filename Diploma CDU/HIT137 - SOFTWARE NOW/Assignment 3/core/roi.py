@@ -0,0 +1,94 @@
+"""Run an operation on a rectangle of the image instead of all of it.
+
+A region edit crops the rectangle plus the halo the operation needs
+(the blur kernel's reach, Canny's gradient window), runs the operation
+on that crop only, and pastes the inner part back into a copy of the
+image. Filter time depends on the size of the region, and the history
+only has to keep the pixels that were under the rectangle before (see
+HistoryManager.push_region).
+
+Grayscale and edge maps come back single-channel; inside a colour image
+they are turned back into three equal channels so the rest of the
+picture keeps its colour. Rotation and resizing change the image's size
+and have no region form.
+
+Rectangles are (x0, y0, x1, y1) in image pixels, end-exclusive, as in
+TiledImage.read_region.
+"""
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+from core.image_processor import ImageProcessor
+from core.point_ops import POINT_OPERATIONS
+from core.tile_executor import operation_halo
+
+Rect = Tuple[int, int, int, int]
+
+REGION_OPERATIONS = POINT_OPERATIONS | {"grayscale", "blur", "edge", "stretch_contrast", "flip"}
+
+# Canny's Sobel window and non-maximum suppression look 2 pixels out; the
+# hysteresis that follows edges further is cut off at the halo
+_EDGE_HALO = 2
+
+
+def clip_rect(rect, width: int, height: int) -> Optional[Rect]:
+    """rect put in order and clipped to the image, or None if nothing is left."""
+    x0, y0, x1, y1 = (int(round(v)) for v in rect)
+    x0, x1 = sorted((x0, x1))
+    y0, y1 = sorted((y0, y1))
+    x0, y0 = max(0, x0), max(0, y0)
+    x1, y1 = min(width, x1), min(height, y1)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1, y1
+
+
+def region_halo(name: str, params: dict) -> int:
+    """Pixels of context around the region an operation needs."""
+    if name == "edge":
+        return _EDGE_HALO
+    return operation_halo(name, params)
+
+
+def scale_rect(rect: Rect, scale: float) -> Rect:
+    """rect in the pixels of an image scale times the size, at least 1x1."""
+    x0, y0, x1, y1 = rect
+    sx0, sy0 = int(x0 * scale), int(y0 * scale)
+    return sx0, sy0, max(sx0 + 1, int(round(x1 * scale))), max(sy0 + 1, int(round(y1 * scale)))
+
+
+def apply_region(image: np.ndarray, name: str, params: dict, rect: Rect,
+                 processor=ImageProcessor) -> np.ndarray:
+    """A copy of image with the named operation applied inside rect only.
+
+    processor is anything with apply(image, name, **params), such as
+    ImageProcessor, a TileExecutor or a CachedProcessor. The input is not
+    modified.
+    """
+    if name not in REGION_OPERATIONS:
+        raise ValueError(f"{name} cannot be applied to a region")
+    height, width = image.shape[:2]
+    clipped = clip_rect(rect, width, height)
+    if clipped is None:
+        raise ValueError("The selected region is outside the image")
+    x0, y0, x1, y1 = clipped
+    halo = region_halo(name, params)
+    hx0, hy0 = max(0, x0 - halo), max(0, y0 - halo)
+    hx1, hy1 = min(width, x1 + halo), min(height, y1 + halo)
+
+    out = processor.apply(image[hy0:hy1, hx0:hx1], name, **params)
+    patch = out[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+    if patch.ndim == 2 and image.ndim == 3:
+        patch = ImageProcessor.to_bgr(patch)
+    # The input stays in use after the edit (the original image, op-log
+    # keyframes, a save or another edit still running on it, the identity
+    # checks in main.py), so the patch cannot be pasted into it or into a
+    # buffer recycled from an earlier frame. This copy is a plain memcpy,
+    # a few ms on a 12 MP photo; what scales with the region is the filter
+    # and the history.
+    result = image.copy()
+    result[y0:y1, x0:x1] = patch
+    return result
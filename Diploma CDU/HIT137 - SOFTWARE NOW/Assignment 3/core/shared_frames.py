@@ -0,0 +1,333 @@
+"""Pass images to worker processes through shared memory instead of pickling.
+
+A frame lives in a multiprocessing.shared_memory segment owned by a
+FramePool. Workers are sent only a small handle (segment name, shape and
+dtype), map the same memory and write their results straight into an
+output frame the parent allocated, so no pixels cross a pipe. Callers
+keep their images in pool frames from the start (batch --stream
+--processes decodes into them) and read results straight out of the
+output frames, releasing each one when done with it.
+
+    python -m core.shared_frames
+
+runs a benchmark comparing this with sending arrays to a
+ProcessPoolExecutor the usual way.
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+
+from core import fast_blur
+from core.buffer_pool import BufferPool
+from core.image_processor import ImageProcessor
+from core.point_ops import POINT_OPERATIONS
+
+# (segment name, shape, dtype string): all a worker needs to find a frame
+Handle = Tuple[str, Tuple[int, ...], str]
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    try:
+        # the pool that created the segment is the one that unlinks it
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # before Python 3.13 workers share the parent's resource tracker,
+        # which already knows the segment, so attaching is harmless
+        return shared_memory.SharedMemory(name=name)
+
+
+class SharedFrame:
+    """An array whose pixels live in a shared memory segment."""
+
+    def __init__(self, memory: shared_memory.SharedMemory,
+                 shape: Tuple[int, ...], dtype) -> None:
+        self.memory = memory
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=memory.buf)
+
+    @property
+    def handle(self) -> Handle:
+        return self.memory.name, self.shape, self.dtype.str
+
+    @property
+    def capacity(self) -> int:
+        return self.memory.size
+
+
+class FramePool:
+    """Creates shared frames and recycles their segments.
+
+    Released segments are kept and handed out again for any frame that
+    fits, so a steady stream of same-sized images allocates nothing after
+    the first few. Every segment is unlinked by close(), or when the pool
+    is collected. Safe to share between threads.
+    """
+
+    def __init__(self) -> None:
+        self._segments: List[shared_memory.SharedMemory] = []
+        self._free: List[shared_memory.SharedMemory] = []
+        self._lock = threading.Lock()
+        self._finalizer = weakref.finalize(self, FramePool._unlink_all, self._segments)
+
+    def acquire(self, shape, dtype=np.uint8) -> SharedFrame:
+        """Return an uninitialised frame of the given shape."""
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        with self._lock:
+            fits = [m for m in self._free if m.size >= nbytes]
+            if fits:
+                memory = min(fits, key=lambda m: m.size)
+                self._free.remove(memory)
+            else:
+                memory = shared_memory.SharedMemory(create=True, size=nbytes)
+                self._segments.append(memory)
+        return SharedFrame(memory, shape, dtype)
+
+    def put(self, image: np.ndarray) -> SharedFrame:
+        """Copy image into a shared frame."""
+        frame = self.acquire(image.shape, image.dtype)
+        np.copyto(frame.array, image)
+        return frame
+
+    def release(self, frame: SharedFrame) -> None:
+        """Give a frame's segment back. Its array must not be used afterwards."""
+        frame.array = None
+        with self._lock:
+            if frame.memory not in self._free:
+                self._free.append(frame.memory)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(m.size for m in self._segments)
+
+    def close(self) -> None:
+        self._finalizer()
+
+    @staticmethod
+    def _unlink_all(segments) -> None:
+        for memory in segments:
+            memory.close()
+            try:
+                memory.unlink()
+            except FileNotFoundError:
+                pass
+        segments.clear()
+
+
+# ---- worker side ------------------------------------------------------
+
+# segments this worker process has already mapped, by name
+_mapped: Dict[str, shared_memory.SharedMemory] = {}
+
+
+# intermediates between steps, recycled across the jobs this worker runs
+_buffers = BufferPool()
+
+
+def _view(handle: Handle) -> np.ndarray:
+    name, shape, dtype = handle
+    memory = _mapped.get(name)
+    if memory is None:
+        memory = _mapped[name] = _attach(name)
+    return np.ndarray(shape, np.dtype(dtype), buffer=memory.buf)
+
+
+def _init_worker() -> None:
+    cv2.setNumThreads(1)
+
+
+def _run_whole(src: Handle, dst: Handle, steps) -> None:
+    ImageProcessor.apply_chain(_view(src), steps, dst=_view(dst), pool=_buffers)
+
+
+def _run_band(src: Handle, dst: Handle, steps, y0: int, y1: int, halo: int) -> None:
+    source = _view(src)
+    hy0, hy1 = max(0, y0 - halo), min(source.shape[0], y1 + halo)
+    result = ImageProcessor.apply_chain(source[hy0:hy1], steps)
+    _view(dst)[y0:y1] = result[y0 - hy0:y1 - hy0]
+
+
+# ---- parent side ------------------------------------------------------
+
+def band_halo(steps) -> Optional[int]:
+    """Rows of overlap horizontal bands need for steps, or None if they cannot be split.
+
+    Halos add up along the chain. Geometric steps move rows around, and
+    the large-blur approximations depend on where a band starts, so a
+    chain that has any has to run as one piece.
+    """
+    halo = 0
+    for name, params in steps:
+        if name in POINT_OPERATIONS or name in ("grayscale", "stretch_contrast"):
+            continue
+        if name == "blur":
+            k = fast_blur.kernel_size(params.get("intensity", 5))
+            if fast_blur.strategy(k) != "direct":
+                return None
+            halo += fast_blur.reach(k) + 1
+        elif name == "edge":
+            # as for tiled images, Canny's hysteresis is only approximated
+            halo += 32
+        else:
+            return None
+    return halo
+
+
+class SharedProcessor:
+    """Runs ImageProcessor chains on a process pool over shared frames.
+
+    apply_chain() splits one image into horizontal bands, one per worker;
+    map_chain() hands whole images to workers. Inputs are frames from
+    self.pool (plain arrays are copied into one first), and results are
+    new frames from the same pool that the caller reads in place and
+    gives back with self.pool.release().
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+        self.pool = FramePool()
+
+    def _frame(self, image: Union[SharedFrame, np.ndarray]) -> Tuple[SharedFrame, bool]:
+        """image as a frame, and whether it was copied into one here."""
+        if isinstance(image, SharedFrame):
+            return image, False
+        return self.pool.put(image), True
+
+    def apply_chain(self, image: Union[SharedFrame, np.ndarray], steps) -> SharedFrame:
+        """Run steps on one image, split across the workers where possible.
+
+        Returns a new frame holding the result.
+        """
+        steps = list(steps)
+        src, copied = self._frame(image)
+        dst = self.pool.acquire(ImageProcessor.output_shape(steps, src.shape), src.dtype)
+        try:
+            halo = band_halo(steps)
+            if halo is None or self.workers == 1:
+                self.executor.submit(_run_whole, src.handle, dst.handle, steps).result()
+            else:
+                steps = self._fill_means(src.array, steps)
+                height = src.shape[0]
+                rows = math.ceil(height / self.workers)
+                futures = [
+                    self.executor.submit(_run_band, src.handle, dst.handle, steps,
+                                         y0, min(height, y0 + rows), halo)
+                    for y0 in range(0, height, rows)]
+                for future in futures:
+                    future.result()
+        except BaseException:
+            self.pool.release(dst)
+            raise
+        finally:
+            if copied:
+                self.pool.release(src)
+        return dst
+
+    def map_chain(self, images: List[Union[SharedFrame, np.ndarray]], steps) -> List[SharedFrame]:
+        """Run steps on each image, one image per worker at a time.
+
+        Returns a new frame for each result, in order.
+        """
+        steps = list(steps)
+        jobs = []
+        try:
+            for image in images:
+                src, copied = self._frame(image)
+                dst = self.pool.acquire(ImageProcessor.output_shape(steps, src.shape), src.dtype)
+                jobs.append((src, copied, dst, self.executor.submit(
+                    _run_whole, src.handle, dst.handle, steps)))
+            for _, _, _, future in jobs:
+                future.result()
+        except BaseException:
+            for _, _, dst, _ in jobs:
+                self.pool.release(dst)
+            raise
+        finally:
+            for src, copied, _, _ in jobs:
+                if copied:
+                    self.pool.release(src)
+        return [dst for _, _, dst, _ in jobs]
+
+    @staticmethod
+    def _fill_means(image: np.ndarray, steps):
+        """Give stretch_contrast steps the whole image's mean so bands agree."""
+        open_ends = [i for i, (n, p) in enumerate(steps)
+                     if n == "stretch_contrast" and p.get("mean") is None]
+        if not open_ends:
+            return steps
+        filled, current = list(steps), image
+        # only the steps up to the last stretch need running here
+        for i, (name, params) in enumerate(steps[:open_ends[-1] + 1]):
+            if i in open_ends:
+                params = dict(params, mean=float(current.mean()))
+                filled[i] = (name, params)
+            current = ImageProcessor.apply(current, name, **params)
+        return filled
+
+    def close(self) -> None:
+        self.executor.shutdown()
+        self.pool.close()
+
+    def __enter__(self) -> "SharedProcessor":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def benchmark(frames: int = 16, size: Tuple[int, int] = (2000, 3000),
+              steps=(("blur", {"intensity": 9}),), workers: Optional[int] = None) -> dict:
+    """Time the same work sent to workers by pickling and by shared frames.
+
+    The processing is identical, so the difference in wall time is what
+    the transport costs; it is reported per frame. The shared images are
+    made in pool frames, as a caller of SharedProcessor keeps them, and
+    the result frames are released without being copied out.
+    """
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, size + (3,), dtype=np.uint8) for _ in range(frames)]
+    steps = list(steps)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as executor:
+        list(executor.map(ImageProcessor.apply_chain, images[:1], [steps]))  # warm up
+        start = time.perf_counter()
+        list(executor.map(ImageProcessor.apply_chain, images, [steps] * frames))
+        pickled = time.perf_counter() - start
+
+    with SharedProcessor(workers) as processor:
+        inputs = [processor.pool.put(image) for image in images]
+        for result in processor.map_chain(inputs[:1], steps):
+            processor.pool.release(result)
+        start = time.perf_counter()
+        for result in processor.map_chain(inputs, steps):
+            processor.pool.release(result)
+        shared = time.perf_counter() - start
+        for frame in inputs:
+            processor.pool.release(frame)
+
+    return {
+        "frames": frames,
+        "frame_mb": images[0].nbytes / 1e6,
+        "pickled_seconds": pickled,
+        "shared_seconds": shared,
+        "saved_ms_per_frame": 1000 * (pickled - shared) / frames,
+    }
+
+
+if __name__ == "__main__":
+    result = benchmark()
+    print(f"{result['frames']} frames of {result['frame_mb']:.1f} MB")
+    print(f"pickled: {result['pickled_seconds']:.3f}s  "
+          f"shared: {result['shared_seconds']:.3f}s  "
+          f"saved {result['saved_ms_per_frame']:.2f} ms per frame")
@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class Job:
+    """A single piece of work handed to the BackgroundRunner."""
+
+    def __init__(self, key, future, on_done, on_error, on_cancel=None) -> None:
+        self.key = key
+        self.future = future
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.cancelled = False
+
+
+class BackgroundRunner:
+    """Runs image operations on a worker pool so the Tk mainloop never blocks.
+
+    Jobs are grouped by key, normally one key per control. Submitting a job
+    for a key that already has one in flight supersedes the old job: it is
+    cancelled if it has not started, otherwise its result is thrown away.
+    Results are handed back on the Tk thread by polling with root.after, so
+    callbacks are free to touch widgets, the model and the history.
+
+    OpenCV releases the GIL, so threads are enough to keep the UI responsive.
+    """
+
+    def __init__(self, root, max_workers: int = 2, poll_ms: int = 30,
+                 on_busy_change: Optional[Callable[[bool], None]] = None) -> None:
+        self.root = root
+        self.poll_ms = poll_ms
+        self.on_busy_change = on_busy_change
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.jobs: Dict[object, Job] = {}
+        self._ids = itertools.count()
+        self._polling = False
+
+    @property
+    def busy(self) -> bool:
+        return bool(self.jobs)
+
+    def submit(self, key, func: Callable, on_done: Callable,
+               on_error: Optional[Callable] = None,
+               on_cancel: Optional[Callable] = None) -> Job:
+        """Run func() in the background.
+
+        on_done(result, elapsed_seconds) or on_error(exception) is called on
+        the Tk thread when it finishes. If the job is cancelled or superseded
+        instead, on_cancel() is called, on the thread that cancelled it. Pass
+        key=None for a job that should never be superseded.
+        """
+        if key is None:
+            key = ("job", next(self._ids))
+        was_busy = self.busy
+        self._drop(key)
+
+        def timed():
+            start = time.perf_counter()
+            result = func()
+            return result, time.perf_counter() - start
+
+        job = Job(key, self.executor.submit(timed), on_done, on_error, on_cancel)
+        self.jobs[key] = job
+        if not was_busy and self.on_busy_change is not None:
+            self.on_busy_change(True)
+        self._schedule_poll()
+        return job
+
+    def cancel(self, key=None, keep=()) -> None:
+        """Cancel the job for key, or every job except those in keep when key is None.
+
+        A job that is already running cannot be interrupted, but its result
+        will be ignored.
+        """
+        keys = [k for k in self.jobs if k not in keep] if key is None else [key]
+        removed = [self._drop(k) for k in keys]
+        if any(removed) and not self.busy and self.on_busy_change is not None:
+            self.on_busy_change(False)
+
+    def _drop(self, key) -> bool:
+        job = self.jobs.pop(key, None)
+        if job is None:
+            return False
+        job.cancelled = True
+        job.future.cancel()
+        if job.on_cancel is not None:
+            job.on_cancel()
+        return True
+
+    def shutdown(self) -> None:
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _schedule_poll(self) -> None:
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self) -> None:
+        self._polling = False
+        for key, job in list(self.jobs.items()):
+            if not job.future.done():
+                continue
+            del self.jobs[key]
+            if job.cancelled or job.future.cancelled():
+                continue
+
+            error = job.future.exception()
+            if error is not None:
+                if job.on_error is not None:
+                    job.on_error(error)
+            else:
+                job.on_done(*job.future.result())
+
+        if self.jobs:
+            self._schedule_poll()
+        elif self.on_busy_change is not None:
+            self.on_busy_change(False)
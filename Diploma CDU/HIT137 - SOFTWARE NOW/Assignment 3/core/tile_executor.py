@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core import fast_blur
+from core.geometry import GEOMETRIC_OPERATIONS
+from core.image_processor import ImageProcessor
+from core.point_ops import POINT_OPERATIONS
+
+# Operations that only look at a bounded neighbourhood of each pixel, so
+# they can run on strips with enough overlap and stitch back exactly.
+LOCAL_OPERATIONS = POINT_OPERATIONS | {"grayscale", "blur"}
+
+
+def is_local(name: str, params: dict) -> bool:
+    """Whether a step can run on strips and stitch back exactly.
+
+    Blur only can on its direct path: the box and pyramid approximations
+    round differently depending on where a strip starts.
+    """
+    if name == "blur":
+        k = fast_blur.kernel_size(params.get("intensity", 5))
+        return fast_blur.strategy(k) == "direct"
+    return name in LOCAL_OPERATIONS
+
+
+def operation_halo(name: str, params: dict) -> int:
+    """Rows of overlap a strip needs for one local operation."""
+    if name == "blur":
+        return fast_blur.reach(fast_blur.kernel_size(params.get("intensity", 5))) + 1
+    return 0
+
+
+class TileExecutor:
+    """Runs ImageProcessor operations on horizontal strips in a thread pool.
+
+    OpenCV releases the GIL, so strips really do run side by side. Each
+    strip is read with enough extra rows (the halo) for the neighbourhood
+    the operation looks at, and only its own rows are written into the
+    output, so the result is identical to one call on the whole image.
+    Runs of local operations share a single pass over the strips.
+
+    Canny's hysteresis can follow an edge anywhere in the image, so edge
+    detection tiles its colour conversion and runs Canny on the whole
+    image. Geometric operations, large blurs and anything else not listed
+    in LOCAL_OPERATIONS run in one call (see is_local).
+
+    Offers apply() and apply_chain() like ImageProcessor, so it can stand
+    in for it wherever operations are run by name.
+    """
+
+    # images smaller than this are not worth splitting
+    MIN_PIXELS = 512 * 512
+    # strips smaller than this spend too much time on halos and overhead
+    MIN_STRIP_PIXELS = 128 * 1024
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        self.workers = workers or os.cpu_count() or 1
+        self.executor = ThreadPoolExecutor(max_workers=self.workers)
+
+    def strips(self, height: int, width: int, halo: int = 0) -> List[Tuple[int, int]]:
+        """Split height rows into strips sized for the image and core count.
+
+        Aims for a few strips per worker so uneven strips balance out, but
+        keeps each strip big enough that its halo is a small overhead.
+        """
+        if self.workers == 1 or height * width < self.MIN_PIXELS:
+            return [(0, height)]
+        rows = math.ceil(height / (self.workers * 4))
+        rows = max(rows, math.ceil(self.MIN_STRIP_PIXELS / width), 8 * halo)
+        return [(y0, min(height, y0 + rows)) for y0 in range(0, height, rows)]
+
+    def map_strips(self, image: np.ndarray, func: Callable[[np.ndarray], np.ndarray],
+                   halo: int = 0, out: Optional[np.ndarray] = None) -> np.ndarray:
+        """Run func on every strip (with halo rows) and stitch the results into out.
+
+        func must keep the number of rows and columns. out is allocated
+        from the first strip's result when not given. out may be image
+        itself, or share memory with it.
+        """
+        height, width = image.shape[:2]
+        plan = self.strips(height, width, halo)
+        if len(plan) == 1:
+            result = func(image)
+            if out is None:
+                return result
+            np.copyto(out, result)
+            return out
+        if out is not None and (halo or out is not image) and np.shares_memory(out, image):
+            # a strip would overwrite rows its neighbours still read as
+            # halo, so stitch into a new array and copy that back
+            np.copyto(out, self.map_strips(image, func, halo))
+            return out
+
+        def run(y0, y1, target):
+            hy0, hy1 = max(0, y0 - halo), min(height, y1 + halo)
+            result = func(image[hy0:hy1])
+            if target is None:
+                return result[y0 - hy0:y1 - hy0]
+            target[y0:y1] = result[y0 - hy0:y1 - hy0]
+            return None
+
+        if out is None:
+            # the first strip tells us the output's channels and dtype
+            first = run(*plan[0], None)
+            out = np.empty((height, width) + first.shape[2:], first.dtype)
+            out[:plan[0][1]] = first
+            plan = plan[1:]
+        for future in [self.executor.submit(run, y0, y1, out) for y0, y1 in plan]:
+            future.result()
+        return out
+
+    def apply(self, image: np.ndarray, name: str, dst: Optional[np.ndarray] = None,
+              **params) -> np.ndarray:
+        """Same as ImageProcessor.apply, split across the thread pool where exact."""
+        if not isinstance(image, np.ndarray):
+            # tiled images run tile by tile themselves
+            return ImageProcessor.apply(image, name, **params)
+        if name == "stretch_contrast" and params.get("mean") is None:
+            channels = 1 if image.ndim == 2 else image.shape[2]
+            # the mean has to come from the whole image, not each strip
+            params = dict(params, mean=sum(cv2.mean(image)[:channels]) / channels)
+        if is_local(name, params) or name == "stretch_contrast":
+            return self.map_strips(
+                image, lambda strip: ImageProcessor.apply(strip, name, **params),
+                operation_halo(name, params), out=dst)
+        if name == "edge":
+            return self._edges(image, dst=dst, **params)
+        return ImageProcessor.apply(image, name, dst=dst, **params)
+
+    def apply_chain(self, image: np.ndarray, steps,
+                    dst: Optional[np.ndarray] = None) -> np.ndarray:
+        """Same as ImageProcessor.apply_chain; runs of local steps share one strip pass.
+
+        The final result goes into dst when given.
+        """
+        if not isinstance(image, np.ndarray):
+            return ImageProcessor.apply_chain(image, steps)
+        runs = []
+        for name, params in steps:
+            if is_local(name, params):
+                kind = "local"
+            elif name in GEOMETRIC_OPERATIONS:
+                kind = "geometry"
+            else:
+                kind = None
+            if kind is not None and runs and runs[-1][0] == kind:
+                runs[-1][1].append((name, params))
+            else:
+                runs.append((kind, [(name, params)]))
+        if not runs:
+            return ImageProcessor.apply_chain(image, [], dst=dst)
+        for index, (kind, run) in enumerate(runs):
+            out = dst if index == len(runs) - 1 else None
+            if kind is None:
+                name, params = run[0]
+                image = self.apply(image, name, dst=out, **params)
+            else:
+                image = self._apply_run(image, kind, run, out)
+        return image
+
+    def _apply_run(self, image: np.ndarray, kind: str, run,
+                   dst: Optional[np.ndarray] = None) -> np.ndarray:
+        if kind == "geometry":
+            # composed into one transform, exactly as ImageProcessor does
+            return ImageProcessor.apply_chain(image, run, dst=dst)
+        # halos add up: each step needs its neighbours from the one before
+        halo = sum(operation_halo(name, params) for name, params in run)
+        return self.map_strips(
+            image, lambda strip, ops=tuple(run): ImageProcessor.apply_chain(strip, ops),
+            halo, out=dst)
+
+    def _edges(self, image: np.ndarray, t1: int = 80, t2: int = 160,
+               dst: Optional[np.ndarray] = None) -> np.ndarray:
+        gray = image
+        if image.ndim == 3:
+            gray = self.map_strips(image, lambda s: cv2.cvtColor(s, cv2.COLOR_BGR2GRAY))
+        return cv2.Canny(gray, t1, t2, edges=dst)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,359 @@
+from __future__ import annotations
+
+import math
+import os
+import shutil
+import tempfile
+import weakref
+from collections import OrderedDict
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core import fast_blur
+from core.image_processor import ImageProcessor
+from core.resample import interpolation_flag, layout
+
+
+class TiledImage:
+    """An image kept on disk as a multi-resolution pyramid of tiles.
+
+    Level 0 is full resolution and each level above it is half the size of
+    the one below, down to a single tile. Every level is a memory-mapped
+    .npy file in a temp directory and is read in tile_size x tile_size
+    tiles through a bounded LRU cache, so only the tiles that are actually
+    looked at are held in memory.
+
+    Operations run tile by tile and return a new TiledImage, leaving this
+    one untouched, which lets the operation log history keep it as a
+    keyframe. The temp directory is deleted when the object is collected.
+    """
+
+    def __init__(self, levels: List[np.ndarray], directory: str,
+                 tile_size: int = 512, cache_tiles: int = 256) -> None:
+        self.levels = levels
+        self.directory = directory
+        self.tile_size = tile_size
+        self.cache_tiles = cache_tiles
+        self._cache: "OrderedDict[Tuple[int, int, int], np.ndarray]" = OrderedDict()
+        self._cleanup = weakref.finalize(
+            self, shutil.rmtree, directory, ignore_errors=True)
+
+    # ---- construction -------------------------------------------------
+
+    @classmethod
+    def create(cls, shape, dtype=np.uint8, tile_size: int = 512,
+               cache_tiles: int = 256) -> "TiledImage":
+        """Allocate an empty level 0. Fill it, then call build_pyramid()."""
+        directory = tempfile.mkdtemp(prefix="hit137_tiles_")
+        level0 = np.lib.format.open_memmap(
+            os.path.join(directory, "level_0.npy"), mode="w+",
+            dtype=dtype, shape=tuple(shape))
+        return cls([level0], directory, tile_size, cache_tiles)
+
+    @classmethod
+    def from_array(cls, image: np.ndarray, tile_size: int = 512,
+                   cache_tiles: int = 256) -> "TiledImage":
+        """Copy an array (or memmap) into a new tiled pyramid."""
+        tiled = cls.create(image.shape, image.dtype, tile_size, cache_tiles)
+        level0 = tiled.levels[0]
+        for y0 in range(0, image.shape[0], tile_size):
+            level0[y0:y0 + tile_size] = image[y0:y0 + tile_size]
+        tiled.build_pyramid()
+        return tiled
+
+    @classmethod
+    def open(cls, path, tile_size: int = 512, cache_tiles: int = 256) -> Optional["TiledImage"]:
+        """Open an image file as a tiled pyramid, or return None if it cannot be read.
+
+        .npy files are memory-mapped and copied across strip by strip, so
+        they can be far larger than RAM. Other formats have to go through
+        cv2.imread, which decodes the whole picture once.
+        """
+        path = str(path)
+        if path.lower().endswith(".npy"):
+            source = np.load(path, mmap_mode="r")
+        else:
+            source = cv2.imread(path)
+            if source is None:
+                return None
+        return cls.from_array(source, tile_size, cache_tiles)
+
+    def build_pyramid(self) -> None:
+        """(Re)build every level above 0 by halving the one below."""
+        del self.levels[1:]
+        self._cache.clear()
+        strip = self.tile_size * 2
+        level = self.levels[0]
+        while max(level.shape[:2]) > self.tile_size:
+            height, width = level.shape[:2]
+            half_h, half_w = max(1, height // 2), max(1, width // 2)
+            path = os.path.join(self.directory, f"level_{len(self.levels)}.npy")
+            upper = np.lib.format.open_memmap(
+                path, mode="w+", dtype=level.dtype,
+                shape=(half_h, half_w) + level.shape[2:])
+            # even strip heights keep every 2x2 block inside one strip
+            for y0 in range(0, half_h * 2, strip):
+                block = level[y0:min(y0 + strip, half_h * 2), :half_w * 2]
+                out = cv2.resize(np.asarray(block),
+                                 (half_w, block.shape[0] // 2),
+                                 interpolation=cv2.INTER_AREA)
+                upper[y0 // 2:y0 // 2 + out.shape[0]] = out.reshape(
+                    (out.shape[0], half_w) + level.shape[2:])
+            self.levels.append(upper)
+            level = upper
+
+    # ---- array-like helpers used by the rest of the app ---------------
+
+    @property
+    def shape(self):
+        return self.levels[0].shape
+
+    @property
+    def dtype(self):
+        return self.levels[0].dtype
+
+    @property
+    def nbytes(self) -> int:
+        # what the history should count: tiles live on disk, not in RAM
+        return sum(tile.nbytes for tile in self._cache.values())
+
+    def to_array(self) -> np.ndarray:
+        """Load the full resolution image into memory."""
+        return np.array(self.levels[0])
+
+    def save(self, path) -> bool:
+        """Export to path. .npy is streamed; other formats need the full image in RAM."""
+        path = str(path)
+        if path.lower().endswith(".npy"):
+            out = np.lib.format.open_memmap(
+                path, mode="w+", dtype=self.dtype, shape=self.shape)
+            for y0, y1, _, _ in self.iter_tiles(full_width=True):
+                out[y0:y1] = self.levels[0][y0:y1]
+            out.flush()
+            del out
+            return True
+        return cv2.imwrite(path, self.to_array())
+
+    # ---- tiles --------------------------------------------------------
+
+    def level_for_scale(self, scale: float) -> int:
+        """Pick the smallest level that still has enough detail for scale."""
+        if scale <= 0:
+            return len(self.levels) - 1
+        level = int(math.floor(math.log2(1.0 / scale))) if scale < 1.0 else 0
+        return min(max(level, 0), len(self.levels) - 1)
+
+    def tile(self, level: int, tx: int, ty: int) -> np.ndarray:
+        """Return one tile of a level, going through the LRU cache."""
+        key = (level, tx, ty)
+        cached = self._cache.get(key)
+        if cached is not None:
+            self._cache.move_to_end(key)
+            return cached
+
+        size = self.tile_size
+        data = np.array(self.levels[level][ty * size:(ty + 1) * size,
+                                           tx * size:(tx + 1) * size])
+        self._cache[key] = data
+        if len(self._cache) > self.cache_tiles:
+            self._cache.popitem(last=False)
+        return data
+
+    def read_region(self, level: int, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Assemble the pixels of a region of one level from its tiles."""
+        source = self.levels[level]
+        out = np.empty((y1 - y0, x1 - x0) + source.shape[2:], dtype=source.dtype)
+        size = self.tile_size
+        for ty in range(y0 // size, (y1 - 1) // size + 1):
+            for tx in range(x0 // size, (x1 - 1) // size + 1):
+                tile = self.tile(level, tx, ty)
+                ox, oy = tx * size, ty * size
+                ax0, ay0 = max(x0, ox), max(y0, oy)
+                ax1 = min(x1, ox + tile.shape[1])
+                ay1 = min(y1, oy + tile.shape[0])
+                out[ay0 - y0:ay1 - y0, ax0 - x0:ax1 - x0] = \
+                    tile[ay0 - oy:ay1 - oy, ax0 - ox:ax1 - ox]
+        return out
+
+    def thumbnail(self, max_w: int, max_h: int) -> np.ndarray:
+        """Return the whole image shrunk to fit max_w x max_h."""
+        height, width = self.shape[:2]
+        scale = min(1.0, max_w / width, max_h / height)
+        level = self.level_for_scale(scale)
+        source = self.levels[level]
+        region = self.read_region(level, 0, 0, source.shape[1], source.shape[0])
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if size == (region.shape[1], region.shape[0]):
+            return region
+        return cv2.resize(region, size, interpolation=cv2.INTER_AREA)
+
+    def iter_tiles(self, full_width: bool = False) -> Iterator[Tuple[int, int, int, int]]:
+        """Yield (y0, y1, x0, x1) for every tile (or full-width strip) of level 0."""
+        height, width = self.shape[:2]
+        size = self.tile_size
+        for y0 in range(0, height, size):
+            y1 = min(height, y0 + size)
+            if full_width:
+                yield y0, y1, 0, width
+                continue
+            for x0 in range(0, width, size):
+                yield y0, y1, x0, min(width, x0 + size)
+
+    # ---- tile by tile operations --------------------------------------
+
+    def map_tiles(self, func: Callable[[np.ndarray], np.ndarray], halo: int = 0) -> "TiledImage":
+        """Apply func to every tile and return the result as a new image.
+
+        Each tile is read with halo extra pixels on every side, so that
+        neighbourhood filters whose radius is at most halo give the same
+        result as running them on the whole image.
+        """
+        source = self.levels[0]
+        height, width = source.shape[:2]
+        result = None
+        for y0, y1, x0, x1 in self.iter_tiles():
+            hy0, hx0 = max(0, y0 - halo), max(0, x0 - halo)
+            hy1, hx1 = min(height, y1 + halo), min(width, x1 + halo)
+            out = func(np.asarray(source[hy0:hy1, hx0:hx1]))
+            if result is None:
+                result = TiledImage.create(
+                    (height, width) + out.shape[2:], out.dtype,
+                    self.tile_size, self.cache_tiles)
+            result.levels[0][y0:y1, x0:x1] = out[y0 - hy0:y1 - hy0, x0 - hx0:x1 - hx0]
+        result.build_pyramid()
+        return result
+
+    def transformed(self, name: str) -> "TiledImage":
+        """Flip or rotate by multiples of 90 degrees, one tile at a time.
+
+        name is "flip_h", "flip_v", "rotate_cw", "rotate_ccw" or "rotate_180".
+        """
+        source = self.levels[0]
+        height, width = source.shape[:2]
+        turned = name in ("rotate_cw", "rotate_ccw")
+        shape = ((width, height) if turned else (height, width)) + source.shape[2:]
+        result = TiledImage.create(shape, source.dtype, self.tile_size, self.cache_tiles)
+        target = result.levels[0]
+
+        for y0, y1, x0, x1 in self.iter_tiles():
+            tile = np.asarray(source[y0:y1, x0:x1])
+            if name == "flip_h":
+                target[y0:y1, width - x1:width - x0] = cv2.flip(tile, 1)
+            elif name == "flip_v":
+                target[height - y1:height - y0, x0:x1] = cv2.flip(tile, 0)
+            elif name == "rotate_180":
+                target[height - y1:height - y0, width - x1:width - x0] = \
+                    cv2.rotate(tile, cv2.ROTATE_180)
+            elif name == "rotate_cw":
+                target[x0:x1, height - y1:height - y0] = \
+                    cv2.rotate(tile, cv2.ROTATE_90_CLOCKWISE)
+            else:
+                target[width - x1:width - x0, y0:y1] = \
+                    cv2.rotate(tile, cv2.ROTATE_90_COUNTERCLOCKWISE)
+        result.build_pyramid()
+        return result
+
+    def resized(self, scale: float = 100, interpolation: Optional[str] = None,
+                size: Optional[Tuple[int, int]] = None) -> "TiledImage":
+        """Resize by a percentage, or to size (width, height), without loading the whole image.
+
+        Reductions start from the smallest pyramid level that is still at
+        least the target size, so the halvings are already done. The
+        resize is then two separable passes: widths first, on full-width
+        strips of rows, then heights, on full-height strips of columns.
+        Each pass sees every pixel it needs, so the only difference from
+        a single cv2.resize call is rounding to uint8 between the passes
+        (at most one grey level). interpolation is as for
+        resample.resize.
+        """
+        height, width = self.shape[:2]
+        if size is None:
+            scale = max(10, min(scale, 300))
+            size = (max(1, int(width * scale / 100)), max(1, int(height * scale / 100)))
+        new_w, new_h = size
+        shrinking = new_w <= width and new_h <= height
+        flag = interpolation_flag(interpolation, shrinking)
+        source = self.levels[0]
+        if shrinking:
+            for level in self.levels[1:]:
+                if level.shape[1] < new_w or level.shape[0] < new_h:
+                    break
+                source = level
+        height = source.shape[0]
+        channels = source.shape[2:]
+
+        wide = TiledImage.create((height, new_w) + channels, source.dtype,
+                                 self.tile_size, self.cache_tiles)
+        for y0 in range(0, height, self.tile_size):
+            y1 = min(height, y0 + self.tile_size)
+            rows = cv2.resize(np.asarray(source[y0:y1]), (new_w, y1 - y0),
+                              interpolation=flag)
+            wide.levels[0][y0:y1] = rows.reshape((y1 - y0, new_w) + channels)
+
+        result = TiledImage.create((new_h, new_w) + channels, source.dtype,
+                                   self.tile_size, self.cache_tiles)
+        for x0 in range(0, new_w, self.tile_size):
+            x1 = min(new_w, x0 + self.tile_size)
+            cols = cv2.resize(np.asarray(wide.levels[0][:, x0:x1]), (x1 - x0, new_h),
+                              interpolation=flag)
+            result.levels[0][:, x0:x1] = cols.reshape((new_h, x1 - x0) + channels)
+        result.build_pyramid()
+        return result
+
+    def cropped(self, x0: int, y0: int, width: int, height: int) -> "TiledImage":
+        """Copy out a width x height window at (x0, y0), strip by strip."""
+        source = self.levels[0]
+        result = TiledImage.create((height, width) + source.shape[2:], source.dtype,
+                                   self.tile_size, self.cache_tiles)
+        for top in range(0, height, self.tile_size):
+            bottom = min(height, top + self.tile_size)
+            result.levels[0][top:bottom] = source[y0 + top:y0 + bottom, x0:x0 + width]
+        result.build_pyramid()
+        return result
+
+    def apply_operation(self, name: str, **params) -> "TiledImage":
+        """Run an ImageProcessor operation by name, tile by tile."""
+        if name == "rotate":
+            angle = params["angle"] % 360
+            names = {90: "rotate_cw", 180: "rotate_180", 270: "rotate_ccw"}
+            if angle == 0:
+                return self
+            if angle not in names:
+                # any other angle resamples across tiles, which is not supported
+                raise ValueError("Tiled images can only be rotated by multiples of 90 degrees")
+            return self.transformed(names[angle])
+        if name == "flip":
+            names = {"h": "flip_h", "v": "flip_v"}
+            return self.transformed(names[params["mode"]]) if params["mode"] in names else self
+        if name == "resize":
+            if params.get("width") is None and params.get("height") is None:
+                return self.resized(params.get("scale", 100), params.get("interpolation"))
+            height, width = self.shape[:2]
+            scaled_w, scaled_h, x0, y0, out_w, out_h = layout(
+                width, height, params.get("width"), params.get("height"),
+                params.get("mode", "fit"))
+            result = self.resized(interpolation=params.get("interpolation"),
+                                  size=(scaled_w, scaled_h))
+            if (out_w, out_h) != (scaled_w, scaled_h):
+                result = result.cropped(x0, y0, out_w, out_h)
+            return result
+
+        halo = 0
+        if name == "stretch_contrast" and params.get("mean") is None:
+            # the mean has to come from the whole image, not each tile
+            total = 0.0
+            for y0, y1, _, _ in self.iter_tiles(full_width=True):
+                total += float(np.asarray(self.levels[0][y0:y1], dtype=np.float64).sum())
+            params = dict(params, mean=total / self.levels[0].size)
+        elif name == "blur":
+            # exact up to the direct and box kernel sizes; tiles of the
+            # pyramid path agree with the whole image to within its error
+            halo = fast_blur.reach(fast_blur.kernel_size(params.get("intensity", 5))) + 1
+        elif name == "edge":
+            # Canny's hysteresis can follow an edge further than any fixed
+            # halo, so tiled edges may differ slightly at tile borders
+            halo = 32
+        return self.map_tiles(
+            lambda tile: ImageProcessor.apply(tile, name, **params), halo)
@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+import math
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.resample import resize
+from core.tiled_image import TiledImage
+
+
+class Viewport:
+    """Works out which part of the image is visible and renders only that.
+
+    zoom is None for fit-to-window, otherwise the number of screen pixels
+    per image pixel. center is the image point (x, y) shown in the middle
+    of the canvas, or None for the middle of the image.
+
+    Coordinates are always in full resolution image pixels. render() also
+    takes an image_scale for pictures that are a shrunken stand-in for the
+    real image (such as a live preview proxy). For a TiledImage only the
+    tiles of the pyramid level matching the zoom that fall inside the view
+    are read.
+    """
+
+    MIN_ZOOM = 0.01
+    MAX_ZOOM = 32.0
+
+    def __init__(self) -> None:
+        self.zoom: Optional[float] = None
+        self.center: Optional[Tuple[float, float]] = None
+        # last (image, settings) rendered and its result, so redraws that
+        # change nothing (e.g. repeated <Configure> events) are free
+        self._cache_image = None
+        self._cache_key = None
+        self._cache_result = None
+
+    def reset(self) -> None:
+        """Go back to fit-to-window."""
+        self.zoom = None
+        self.center = None
+
+    def forget(self) -> None:
+        """Drop the last render, which keeps its image alive."""
+        self._cache_image = None
+        self._cache_key = None
+        self._cache_result = None
+
+    def scale_for(self, image_w: float, image_h: float,
+                  canvas_w: int, canvas_h: int) -> float:
+        """Screen pixels per image pixel for the current zoom."""
+        if self.zoom is not None:
+            return self.zoom
+        # fit the whole image, but never blow small images up
+        return min(1.0, canvas_w / image_w, canvas_h / image_h)
+
+    def _center_for(self, image_w: float, image_h: float) -> Tuple[float, float]:
+        if self.center is None:
+            return image_w / 2, image_h / 2
+        x, y = self.center
+        return min(max(x, 0.0), image_w), min(max(y, 0.0), image_h)
+
+    def render(self, image: np.ndarray, canvas_w: int, canvas_h: int,
+               image_scale: float = 1.0) -> Tuple[np.ndarray, Tuple[int, int]]:
+        """Crop and resample the visible part of image to screen size.
+
+        Returns the pixels to draw and the canvas position of their
+        top-left corner.
+        """
+        key = (canvas_w, canvas_h, image_scale, self.zoom, self.center)
+        if image is self._cache_image and key == self._cache_key:
+            return self._cache_result
+
+        height, width = image.shape[:2]
+        full_w, full_h = width / image_scale, height / image_scale
+        scale = self.scale_for(full_w, full_h, canvas_w, canvas_h)
+        cx, cy = self._center_for(full_w, full_h)
+
+        # work in the pixels of the image we were given
+        s = scale / image_scale
+        cx, cy = cx * image_scale, cy * image_scale
+        half_w, half_h = canvas_w / (2 * s), canvas_h / (2 * s)
+        x0 = max(0, int(math.floor(cx - half_w)))
+        y0 = max(0, int(math.floor(cy - half_h)))
+        x1 = min(width, int(math.ceil(cx + half_w)))
+        y1 = min(height, int(math.ceil(cy + half_h)))
+        if isinstance(image, TiledImage):
+            crop = self._read_tiles(image, s, x0, y0, x1, y1)
+        else:
+            crop = image[y0:y1, x0:x1]
+
+        out_w = max(1, int(round((x1 - x0) * s)))
+        out_h = max(1, int(round((y1 - y0) * s)))
+        if (out_w, out_h) == (crop.shape[1], crop.shape[0]):
+            view = crop
+        else:
+            if s < 1.0:
+                # through the pyramid, so fitting a huge photo stays quick
+                view = resize(crop, (out_w, out_h), "area")
+            else:
+                # show individual pixels when zoomed right in
+                interpolation = cv2.INTER_NEAREST if s >= 2.0 else cv2.INTER_LINEAR
+                view = cv2.resize(crop, (out_w, out_h), interpolation=interpolation)
+
+        left = int(round(canvas_w / 2 + (x0 - cx) * s))
+        top = int(round(canvas_h / 2 + (y0 - cy) * s))
+        self._cache_image = image
+        self._cache_key = key
+        self._cache_result = (view, (left, top))
+        return self._cache_result
+
+    @staticmethod
+    def _read_tiles(image: TiledImage, scale: float,
+                    x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Read a level 0 region from the coarsest level with enough detail."""
+        level = image.level_for_scale(scale)
+        factor = 2 ** level
+        level_h, level_w = image.levels[level].shape[:2]
+        lx0, ly0 = min(x0 // factor, level_w - 1), min(y0 // factor, level_h - 1)
+        lx1 = max(lx0 + 1, min(level_w, -(-x1 // factor)))
+        ly1 = max(ly0 + 1, min(level_h, -(-y1 // factor)))
+        return image.read_region(level, lx0, ly0, lx1, ly1)
+
+    def to_image(self, canvas_x: float, canvas_y: float, image_w: int, image_h: int,
+                 canvas_w: int, canvas_h: int) -> Tuple[float, float]:
+        """The image point under a canvas point."""
+        scale = self.scale_for(image_w, image_h, canvas_w, canvas_h)
+        cx, cy = self._center_for(image_w, image_h)
+        return cx + (canvas_x - canvas_w / 2) / scale, cy + (canvas_y - canvas_h / 2) / scale
+
+    def to_canvas(self, x: float, y: float, image_w: int, image_h: int,
+                  canvas_w: int, canvas_h: int) -> Tuple[float, float]:
+        """The canvas point an image point is drawn at."""
+        scale = self.scale_for(image_w, image_h, canvas_w, canvas_h)
+        cx, cy = self._center_for(image_w, image_h)
+        return canvas_w / 2 + (x - cx) * scale, canvas_h / 2 + (y - cy) * scale
+
+    def zoom_at(self, factor: float, canvas_x: float, canvas_y: float,
+                image_w: int, image_h: int, canvas_w: int, canvas_h: int) -> None:
+        """Zoom by factor, keeping the image point under the cursor still."""
+        scale = self.scale_for(image_w, image_h, canvas_w, canvas_h)
+        cx, cy = self._center_for(image_w, image_h)
+        px = cx + (canvas_x - canvas_w / 2) / scale
+        py = cy + (canvas_y - canvas_h / 2) / scale
+
+        new_scale = min(max(scale * factor, self.MIN_ZOOM), self.MAX_ZOOM)
+        self.zoom = new_scale
+        self.center = (px - (canvas_x - canvas_w / 2) / new_scale,
+                       py - (canvas_y - canvas_h / 2) / new_scale)
+        self.center = self._center_for(image_w, image_h)
+
+    def pan(self, dx: float, dy: float, image_w: int, image_h: int,
+            canvas_w: int, canvas_h: int) -> None:
+        """Move the view by a drag of (dx, dy) screen pixels."""
+        scale = self.scale_for(image_w, image_h, canvas_w, canvas_h)
+        cx, cy = self._center_for(image_w, image_h)
+        self.zoom = scale
+        self.center = (cx - dx / scale, cy - dy / scale)
+        self.center = self._center_for(image_w, image_h)
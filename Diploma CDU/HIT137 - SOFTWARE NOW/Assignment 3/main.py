@@ -1,15 +1,32 @@
 import tkinter as tk
+from dataclasses import replace
 from pathlib import Path
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, simpledialog, ttk
 from PIL import Image, ImageTk
 
 import cv2
 
-from core.history import HistoryManager
+from core.adjustments import ADJUSTMENTS, LABELS, display_scale
 # We split the logic into separate modules to meet the HD requirement for
 # code structure and readability by avoiding a single massive file.
-from core.image_model import ImageModel
+from core.documents import Document, MemoryGovernor
+from core.image_loader import read_full, read_reduced
+from core.image_writer import PROFILES, save_image
 from core.image_processor import ImageProcessor
+from core.preview import PreviewProxy
+from core.profiler import Profiler
+from core.resample import INTERPOLATIONS, RESIZE_MODES
+from core.result_cache import CachedProcessor, ResultCache
+from core.roi import REGION_OPERATIONS, apply_region, clip_rect, scale_rect
+from core.task_runner import BackgroundRunner
+from core.tile_executor import TileExecutor
+from core.tiled_image import TiledImage
+
+
+def _document_attribute(name):
+    """A property for state that each open document keeps for itself."""
+    return property(lambda self: getattr(self.document, name),
+                    lambda self, value: setattr(self.document, name, value))
 
 
 class EditorApp:
@@ -19,6 +36,27 @@ class EditorApp:
     user interface (View), satisfying the 'Class Interaction' OOP requirement[cite: 15].
     """
 
+    # Images bigger than this are kept as an on-disk tiled pyramid
+    # (TiledImage) instead of one array in memory.
+    TILED_PIXELS = 100_000_000
+
+    # Every tab has its own image, history, view and selection; these read
+    # and write those of the document in the focused tab (self.document).
+    model = _document_attribute("model")
+    history = _document_attribute("history")
+    op_history = _document_attribute("op_history")
+    history_mode = _document_attribute("history_mode")
+    viewport = _document_attribute("viewport")
+    selection = _document_attribute("selection")
+    current_file_path = _document_attribute("current_file_path")
+    unsaved_changes = _document_attribute("unsaved_changes")
+    # While a large JPEG is decoded in the background a reduced copy is
+    # shown; _loading is its path, and edits made in the meantime wait in
+    # _queued_edits to be replayed on the full image. A parked document is
+    # restored the same way, from its thumbnail.
+    _loading = _document_attribute("loading")
+    _queued_edits = _document_attribute("queued_edits")
+
     def __init__(self, root):
         self.root = root
         # A professional title and size ensure the app meets the
@@ -29,16 +67,64 @@ class EditorApp:
         # Initializing these here demonstrates the 'Constructor' OOP concept[cite: 15].
         # We instantiate these classes so that EditorApp can delegate specialized
         # tasks (like history tracking or image filtering) to them[cite: 15].
-        self.model = ImageModel()
-        self.history = HistoryManager()
         self.processor = ImageProcessor()
-        self.current_file_path = None
-        self.unsaved_changes = False
+        # Runs named operations strip by strip across the cores; results
+        # are identical to calling the processor on the whole image.
+        self.tiles = TileExecutor()
+        # Results are remembered by input content and parameters, so undoing
+        # and re-applying, or returning a slider to an earlier value, is a
+        # lookup instead of another filter pass.
+        self.cache = ResultCache()
+        self.ops = CachedProcessor(self.tiles, self.cache)
+        # Each open image is a Document with its own ImageModel and history.
+        # In a document, history_mode "snapshot" keeps pictures in
+        # HistoryManager; "operations" keeps a replayable log of operation
+        # names and parameters instead. The governor keeps all documents
+        # within one memory budget by parking the least recently used ones
+        # on disk; parks are compressed on their own worker.
+        self.governor = MemoryGovernor()
+        self.parker = BackgroundRunner(self.root, max_workers=1)
+        self._tabs = {}
+        self.document = None
+        self.history_panel = None
+        self.adjustments_panel = None
+        # the layer the panel's slider is editing, None while it is being set up
+        self._layer_slider_index = None
+        # Filters run on a worker pool so the window keeps repainting.
+        self.runner = BackgroundRunner(self.root, on_busy_change=self.show_busy)
+        # Saves are encoded on their own single worker, so they finish in
+        # the order they were asked for and edits never cancel them.
+        self.saver = BackgroundRunner(self.root, max_workers=1)
+        self.save_options = PROFILES["balanced"]
+        # Live slider previews run on a canvas-sized proxy and never touch
+        # the history; the full image is processed once on release.
+        self.preview = PreviewProxy()
+        self._preview_control = None
+        self._preview_job = None
+        # Only the part of the image that fits the canvas is converted for
+        # display (see each document's viewport); the Tk image is reused
+        # between redraws when it can be.
+        self.tk_image = None
+        self._display_source = None
+        self._redraw_job = None
+        self._drag_start = None
+        # Shift-drag selects a rectangle (self.selection, x0, y0, x1, y1 in
+        # image pixels); while there is one, filters only run inside it and
+        # the undo history keeps just the pixels it covered.
+        self._select_start = None
+        # Times each phase of an edit when turned on from the View menu;
+        # the hooks cost next to nothing while it is off.
+        self.profiler = Profiler()
         # Modularizing setup into methods keeps the constructor clean and
         # allows for easier debugging of specific UI components.
         self.setup_menu()
         self.setup_gui()
         self.setup_status_bar()
+        self.document = self._new_document()
+        self.governor.focus(self.document)
+        # Closing the window goes through exit_app so history temp files
+        # are removed.
+        self.root.protocol("WM_DELETE_WINDOW", self.exit_app)
 
     def setup_menu(self):
         """
@@ -53,8 +139,20 @@ class EditorApp:
         file_menu.add_command(label="Open", command=self.open_file)
         file_menu.add_command(label="Save", command=self.save_file)
         file_menu.add_command(label="Save As", command=self.save_as_file)
+        options_menu = tk.Menu(file_menu, tearoff=0)
+        self.save_profile_var = tk.StringVar(value="balanced")
+        for profile in PROFILES:
+            options_menu.add_radiobutton(
+                label=profile.capitalize(), value=profile,
+                variable=self.save_profile_var, command=self.set_save_profile)
+        options_menu.add_separator()
+        options_menu.add_command(label="JPEG/WebP Quality...", command=self.ask_save_quality)
+        options_menu.add_command(label="PNG Compression...", command=self.ask_png_compression)
+        file_menu.add_cascade(label="Save Options", menu=options_menu)
+        file_menu.add_command(label="Close Tab", command=self.close_tab)
+        file_menu.add_command(label="Memory Budget...", command=self.ask_memory_budget)
         file_menu.add_separator()
-        file_menu.add_command(label="Exit", command=self.root.quit)
+        file_menu.add_command(label="Exit", command=self.exit_app)
         menubar.add_cascade(label="File", menu=file_menu)
 
         # The Edit menu is specifically required to support
@@ -62,8 +160,32 @@ class EditorApp:
         edit_menu = tk.Menu(menubar, tearoff=0)
         edit_menu.add_command(label="Undo", command=self.undo_action)
         edit_menu.add_command(label="Redo", command=self.redo_action)
+        edit_menu.add_separator()
+        self.op_log_var = tk.BooleanVar(value=False)
+        edit_menu.add_checkbutton(label="Operation Log History",
+                                  variable=self.op_log_var,
+                                  command=self.toggle_history_mode)
+        edit_menu.add_command(label="History Panel", command=self.show_history_panel)
+        edit_menu.add_command(label="Adjustment Layers", command=self.show_adjustments_panel)
+        edit_menu.add_separator()
+        edit_menu.add_command(label="Clear Selection (Esc)", command=self.clear_selection)
         menubar.add_cascade(label="Edit", menu=edit_menu)
 
+        view_menu = tk.Menu(menubar, tearoff=0)
+        view_menu.add_command(label="Fit to Window", command=self.zoom_fit)
+        view_menu.add_command(label="Actual Size (100%)",
+                              command=lambda: self.zoom_to(1.0))
+        view_menu.add_command(label="Zoom In",
+                              command=lambda: self.zoom_by(1.25))
+        view_menu.add_command(label="Zoom Out",
+                              command=lambda: self.zoom_by(0.8))
+        view_menu.add_separator()
+        self.profile_var = tk.BooleanVar(value=False)
+        view_menu.add_checkbutton(label="Show Timings", variable=self.profile_var,
+                                  command=self.toggle_profiling)
+        view_menu.add_command(label="Export Trace...", command=self.export_trace)
+        menubar.add_cascade(label="View", menu=view_menu)
+
         self.root.config(menu=menubar)
 
     def setup_gui(self):
@@ -76,10 +198,27 @@ class EditorApp:
         self.controls = tk.Frame(self.root, width=200, bg="gray85")
         self.controls.pack(side=tk.LEFT, fill=tk.Y)
 
+        # One tab per open image; the canvas below shows the focused one.
+        self.tabs = ttk.Notebook(self.root)
+        self.tabs.pack(side=tk.TOP, fill=tk.X)
+        self.tabs.bind("<<NotebookTabChanged>>", self.on_tab_changed)
+
         # The Canvas is the primary visual feedback for the user;
         # it must expand to utilize available screen space[cite: 28].
         self.canvas = tk.Canvas(self.root, bg="gray30")
         self.canvas.pack(expand=True, fill=tk.BOTH)
+        # Mouse wheel zooms (Windows/macOS send <MouseWheel>, X11 sends
+        # buttons 4 and 5), dragging pans, and window resizes redraw once.
+        self.canvas.bind("<MouseWheel>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-4>", self.on_mouse_wheel)
+        self.canvas.bind("<Button-5>", self.on_mouse_wheel)
+        self.canvas.bind("<ButtonPress-1>", self.on_drag_start)
+        self.canvas.bind("<B1-Motion>", self.on_drag)
+        self.canvas.bind("<Shift-ButtonPress-1>", self.on_select_start)
+        self.canvas.bind("<Shift-B1-Motion>", self.on_select_drag)
+        self.canvas.bind("<Shift-ButtonRelease-1>", self.on_select_end)
+        self.root.bind("<Escape>", lambda e: self.clear_selection())
+        self.canvas.bind("<Configure>", lambda e: self.schedule_redraw(50))
 
         # A slider is explicitly required to allow for variable
         # parameter inputs (like blur radius)[cite: 33].
@@ -88,12 +227,21 @@ class EditorApp:
 
         tk.Label(self.controls, text="Blur Intensity").pack()
         self.blur_slider = tk.Scale(
-            self.controls, from_=0, to=10, orient=tk.HORIZONTAL)
+            self.controls, from_=0, to=201, orient=tk.HORIZONTAL,
+            command=lambda _: self.on_slider_move("blur"))
         self.blur_slider.pack(pady=5)
+        self.blur_slider.bind(
+            "<ButtonRelease-1>", lambda e: self.on_slider_release("blur"))
         tk.Label(self.controls, text="Brightness", bg="gray85").pack()
         self.brightness_slider = tk.Scale(
-            self.controls, from_=-100, to=100, orient=tk.HORIZONTAL)
+            self.controls, from_=-100, to=100, orient=tk.HORIZONTAL,
+            command=lambda _: self.on_slider_move("brightness"))
         self.brightness_slider.pack(pady=5, fill="x", padx=10)
+        self.brightness_slider.bind(
+            "<ButtonRelease-1>", lambda e: self.on_slider_release("brightness"))
+        self.live_preview_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(self.controls, text="Live Preview", bg="gray85",
+                       variable=self.live_preview_var).pack()
         tk.Button(self.controls, text="Adjust Brightness",
                   command=self.apply_brightness).pack(pady=5, fill="x")
         tk.Button(self.controls, text="Grayscale",
@@ -138,93 +286,142 @@ class EditorApp:
 
         tk.Button(manual_resize_frame, text="Go",
                   command=self.apply_manual_resize).pack(side=tk.LEFT, fill="x", expand=True)
+        # Resize to a target box (fit inside, fill and crop, or stretch)
+        box_resize_frame = tk.Frame(self.controls, bg="gray85")
+        box_resize_frame.pack(pady=5, fill="x", padx=10)
+
+        self.box_w_entry = tk.Entry(box_resize_frame, width=5)
+        self.box_w_entry.insert(0, "1920")
+        self.box_w_entry.pack(side=tk.LEFT)
+        tk.Label(box_resize_frame, text="x", bg="gray85").pack(side=tk.LEFT)
+        self.box_h_entry = tk.Entry(box_resize_frame, width=5)
+        self.box_h_entry.insert(0, "1080")
+        self.box_h_entry.pack(side=tk.LEFT)
+        self.box_mode = tk.StringVar(value="fit")
+        tk.OptionMenu(box_resize_frame, self.box_mode, *RESIZE_MODES).pack(side=tk.LEFT)
+        tk.Button(box_resize_frame, text="Go",
+                  command=self.apply_box_resize).pack(side=tk.LEFT, fill="x", expand=True)
+        # Filter used by every resize above
+        filter_frame = tk.Frame(self.controls, bg="gray85")
+        filter_frame.pack(pady=5, fill="x", padx=10)
+
+        tk.Label(filter_frame, text="Resize filter:", bg="gray85").pack(side=tk.LEFT)
+        self.resize_filter = tk.StringVar(value="auto")
+        tk.OptionMenu(filter_frame, self.resize_filter,
+                      "auto", *INTERPOLATIONS).pack(side=tk.LEFT, fill="x", expand=True)
 
     def prepare_action(self) -> bool:
         """
         Member 4 Task: Gatekeeper method to ensure an image is loaded 
-        and state is saved to history before processing.
+        before processing. History is saved when the result is committed
+        (see _commit_result), since filters now finish in the background.
         """
         if not self.model.has_image():
             messagebox.showinfo("Info", "Please open an image first.")
             return False
-
-        # Save to history so Undo/Redo works
-        self.history.push(self.model.current_image)
         return True
 
-    def apply_grayscale(self):
-        if not self.model.has_image():
-            messagebox.showinfo("Info", "Please open an image first.")
+    def on_slider_move(self, control: str):
+        """
+        Schedule a preview frame for a slider. Slider events arrive much
+        faster than frames can be drawn, so they are coalesced and only the
+        latest value is rendered.
+        """
+        if not self.live_preview_var.get() or not self.model.has_image():
             return
-        self.history.push(self.model.current_image)
-        out = self.processor.to_grayscale(self.model.current_image)
-        self.model.apply_new_current(out)
-        self.display_image(self.model.current_image)
-        self.status_text.set("Applied: Grayscale")
+        self._preview_control = control
+        if self._preview_job is None:
+            self._preview_job = self.root.after(15, self._render_preview)
 
-    def apply_blur(self):
-        if not self.model.has_image():
-            messagebox.showinfo("Info", "Please open an image first.")
+    def _render_preview(self):
+        self._preview_job = None
+        if self._preview_control is None or not self.model.has_image():
             return
-        self.history.push(self.model.current_image)
-        out = self.processor.blur(
-            self.model.current_image, self.blur_slider.get())
-        self.model.apply_new_current(out)
-        self.display_image(self.model.current_image)
-        self.status_text.set("Applied: Blur")
 
-    def apply_edge(self):
-        if not self.model.has_image():
-            messagebox.showinfo("Info", "Please open an image first.")
+        proxy = self.preview.get(
+            self.model.current_image,
+            max(self.canvas.winfo_width(), 100),
+            max(self.canvas.winfo_height(), 100))
+        if self._preview_control == "blur":
+            # scale the kernel so the proxy looks like the full result
+            name = "blur"
+            params = {"intensity": round(self.blur_slider.get() * self.preview.scale)}
+        else:
+            name, params = "brightness", {"value": self.brightness_slider.get()}
+        if self.selection is not None:
+            region = scale_rect(self.selection, self.preview.scale)
+            out = apply_region(proxy, name, params, region)
+        else:
+            out = self.processor.apply(proxy, name, **params)
+        if self.model.adjustments:
+            out = self.model.adjustments.apply_to(out, self.preview.scale)
+        self.display_image(out, self.preview.scale)
+
+    def on_slider_release(self, control: str):
+        """Process the full image once, when the user lets go of a slider."""
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+        self._preview_control = None
+        if not self.live_preview_var.get():
+            return
+        if not self.model.has_image() and self._loading is None:
             return
-        self.history.push(self.model.current_image)
-        out = self.processor.edge_detection(self.model.current_image)
-        self.model.apply_new_current(out)
-        self.display_image(self.model.current_image)
-        self.status_text.set("Applied: Edge")
 
-    def apply_brightness(self):
-        if self.prepare_action():
-            val = self.brightness_slider.get()
-            out = self.processor.adjust_brightness(
-                self.model.current_image, val)
-            self.model.apply_new_current(out)
+        if control == "blur":
+            if self.blur_slider.get() > 1:
+                self.apply_blur()
+                return
+        elif self.brightness_slider.get() != 0:
+            self.apply_brightness()
+            return
+        # a neutral value changes nothing, so just drop the preview
+        if self.model.has_image():
             self.display_image(self.model.current_image)
-            self.status_text.set(f"Brightness: {val}")
+
+    def apply_grayscale(self):
+        self._apply_operation("grayscale", {}, "Applied: Grayscale")
+
+    def apply_blur(self):
+        self._apply_operation(
+            "blur", {"intensity": self.blur_slider.get()}, "Applied: Blur",
+            key="blur")
+
+    def apply_edge(self):
+        self._apply_operation("edge", {}, "Applied: Edge")
+
+    def apply_brightness(self):
+        val = self.brightness_slider.get()
+        self._apply_operation("brightness", {"value": val}, f"Brightness: {val}",
+                              key="brightness")
 
     def apply_contrast(self, factor):
-        if self.prepare_action():
-            out = self.processor.adjust_contrast(
-                self.model.current_image, factor)
-            self.model.apply_new_current(out)
-            self.display_image(self.model.current_image)
-            self.status_text.set(f"Contrast adjusted by {factor}")
+        self._apply_operation(
+            "contrast", {"value": factor}, f"Contrast adjusted by {factor}",
+            key="contrast")
 
     def apply_rotate(self, angle):
         """Controller method to handle rotation request."""
-        if self.prepare_action():
-            out = self.processor.rotate(self.model.current_image, angle)
-            self.model.apply_new_current(out)
-            self.display_image(self.model.current_image)
-            self.status_text.set(f"Applied: Rotation {angle}°")
+        self._apply_operation(
+            "rotate", {"angle": angle}, f"Applied: Rotation {angle}°")
 
     def apply_flip(self, mode):
         """Controller method to handle flip request."""
-        if self.prepare_action():
-            out = self.processor.flip(self.model.current_image, mode)
-            self.model.apply_new_current(out)
-            self.display_image(self.model.current_image)
-            direction = "Horizontally" if mode == "h" else "Vertically"
-            self.status_text.set(f"Applied: Flipped {direction}")
+        direction = "Horizontally" if mode == "h" else "Vertically"
+        self._apply_operation(
+            "flip", {"mode": mode}, f"Applied: Flipped {direction}")
+
+    def _resize_params(self, **params):
+        """Resize parameters plus the filter chosen in the menu."""
+        if self.resize_filter.get() != "auto":
+            params["interpolation"] = self.resize_filter.get()
+        return params
 
     def apply_resize(self, percent):
         """Controller method to handle resize request via the Processor."""
-        if self.prepare_action():
-            # This calls the static method in your ImageProcessor class
-            out = self.processor.resize(self.model.current_image, percent)
-            self.model.apply_new_current(out)
-            self.display_image(out)
-            self.status_text.set(f"Applied: Resized to {percent}%")
+        self._apply_operation(
+            "resize", self._resize_params(scale=percent),
+            f"Applied: Resized to {percent}%", key="resize")
 
     def apply_manual_resize(self):
         """Allows user to enter a custom percentage for resizing."""
@@ -232,16 +429,32 @@ class EditorApp:
             val = float(self.resize_entry.get())
             if val <= 0:
                 raise ValueError
-
-            # Use the existing processor logic
-            if self.prepare_action():
-                out = self.processor.resize(self.model.current_image, val)
-                self.model.apply_new_current(out)
-                self.display_image(out)
-                self.status_text.set(f"Applied: Manual Resize to {val}%")
         except ValueError:
             messagebox.showerror(
                 "Error", "Please enter a valid positive number for resize percentage.")
+            return
+
+        # Use the existing processor logic
+        self._apply_operation(
+            "resize", self._resize_params(scale=val),
+            f"Applied: Manual Resize to {val}%", key="resize")
+
+    def apply_box_resize(self):
+        """Resize to the width x height box in the mode chosen beside it."""
+        try:
+            width = int(self.box_w_entry.get())
+            height = int(self.box_h_entry.get())
+            if width <= 0 or height <= 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror(
+                "Error", "Please enter a positive whole width and height.")
+            return
+
+        mode = self.box_mode.get()
+        self._apply_operation(
+            "resize", self._resize_params(width=width, height=height, mode=mode),
+            f"Applied: Resized to {width}x{height} ({mode})", key="resize")
 
     def setup_status_bar(self):
         """
@@ -249,34 +462,218 @@ class EditorApp:
         mandatory GUI element for the status bar requirement[cite: 30].
         """
         self.status_text = tk.StringVar(value="Ready")
+        status_frame = tk.Frame(self.root, relief=tk.SUNKEN, bd=1)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
         status_bar = tk.Label(
-            self.root, textvariable=self.status_text, relief=tk.SUNKEN, anchor=tk.W)
-        status_bar.pack(side=tk.BOTTOM, fill=tk.X)
-
-    def display_image(self, image):
+            status_frame, textvariable=self.status_text, anchor=tk.W)
+        status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
+        # result cache counters, refreshed whenever an edit finishes
+        self.cache_text = tk.StringVar(value="")
+        tk.Label(status_frame, textvariable=self.cache_text, anchor=tk.E,
+                 fg="gray40").pack(side=tk.RIGHT, padx=5)
+        # memory held by the open documents against the budget
+        self.memory_text = tk.StringVar(value="")
+        tk.Label(status_frame, textvariable=self.memory_text, anchor=tk.E,
+                 fg="gray40").pack(side=tk.RIGHT, padx=5)
+        # per-phase timings of the last edit, while profiling is on
+        self.profile_text = tk.StringVar(value="")
+        tk.Label(status_frame, textvariable=self.profile_text, anchor=tk.E,
+                 fg="gray40").pack(side=tk.RIGHT, padx=5)
+
+        # Busy indicator, only shown while a background job is running.
+        self.cancel_button = tk.Button(
+            status_frame, text="Cancel", command=self.cancel_jobs)
+        self.progress = ttk.Progressbar(
+            status_frame, mode="indeterminate", length=120)
+
+    def show_busy(self, busy: bool):
+        """Show or hide the progress bar and Cancel button."""
+        if busy:
+            self.cancel_button.pack(side=tk.RIGHT, padx=2)
+            self.progress.pack(side=tk.RIGHT, padx=5)
+            self.progress.start(10)
+        else:
+            self.progress.stop()
+            self.progress.pack_forget()
+            self.cancel_button.pack_forget()
+
+    def cancel_jobs(self):
+        self.runner.cancel()
+        self._queued_edits = []
+        if self._loading is not None:
+            # without the full picture there is nothing to edit
+            self._loading = None
+            self.canvas.delete("image")
+            self._display_source = None
+        self.status_text.set("Cancelled")
+
+    def display_image(self, image, image_scale: float = 1.0):
         """
-        Display an OpenCV image on the Tkinter canvas at its actual size
-        without automatically stretching to the canvas.
+        Display an OpenCV image on the Tkinter canvas, fitted to the window
+        or at the current zoom and pan.
+
+        Only the visible part of the image is cropped and resampled to
+        screen size before the BGR -> RGB -> PhotoImage conversion, so the
+        cost depends on the canvas size, not the image size. Single-channel
+        images go to PIL as they are.
+        image_scale is set when image is a shrunken stand-in for the model
+        image (e.g. a live preview proxy).
         """
-        # Convert BGR to RGB
-        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        self._display_source = (image, image_scale)
+        with self.profiler.phase("render", image):
+            if image is self.model.current_image and self.model.adjustments:
+                image, image_scale = self._adjusted_view(image)
+            self._draw(image, image_scale)
+
+    def _adjusted_view(self, image):
+        """The model image with its adjustment layers, at about screen resolution."""
+        width, height = image.shape[1], image.shape[0]
+        scale = display_scale(self.viewport.scale_for(width, height, *self._canvas_size()))
+        return self.model.adjustments.render(scale), scale
+
+    def _draw(self, image, image_scale):
+        canvas_w, canvas_h = self._canvas_size()
+        view, (left, top) = self.viewport.render(
+            image, canvas_w, canvas_h, image_scale)
+
+        # Convert BGR to RGB; grayscale needs no conversion
+        if view.ndim == 3:
+            view = cv2.cvtColor(view, cv2.COLOR_BGR2RGB)
 
         # Convert to PIL image
-        pil_img = Image.fromarray(rgb)
+        pil_img = Image.fromarray(view)
 
-        # Convert to Tk image
-        self.tk_image = ImageTk.PhotoImage(pil_img)
+        # Reuse the Tk image when the size is unchanged, which is much
+        # cheaper than creating a new one
+        if self.tk_image is not None and (
+                self.tk_image.width(), self.tk_image.height()) == pil_img.size:
+            self.tk_image.paste(pil_img)
+        else:
+            self.tk_image = ImageTk.PhotoImage(pil_img)
 
-        # Clear canvas and draw image centered
-        self.canvas.delete("all")
+        self.canvas.delete("image")
+        self.canvas.create_image(
+            left, top, anchor=tk.NW, image=self.tk_image, tags="image")
+        self.canvas.tag_lower("image")
+        self._draw_selection()
+
+    def _canvas_size(self):
+        # before the window is first drawn the canvas reports 1x1
         canvas_w = self.canvas.winfo_width()
         canvas_h = self.canvas.winfo_height()
-        self.canvas.create_image(
-            canvas_w // 2,
-            canvas_h // 2,
-            anchor=tk.CENTER,
-            image=self.tk_image
-        )
+        if canvas_w <= 1 or canvas_h <= 1:
+            canvas_w = self.canvas.winfo_reqwidth()
+            canvas_h = self.canvas.winfo_reqheight()
+        return canvas_w, canvas_h
+
+    def schedule_redraw(self, delay_ms: int = 0):
+        """Redraw once after a burst of resize/zoom events has settled."""
+        if self._redraw_job is not None:
+            self.root.after_cancel(self._redraw_job)
+        self._redraw_job = self.root.after(delay_ms, self._redraw)
+
+    def _redraw(self):
+        self._redraw_job = None
+        if self._display_source is not None:
+            self.display_image(*self._display_source)
+
+    def zoom_fit(self):
+        self.viewport.reset()
+        self.schedule_redraw()
+        self.status_text.set("Zoom: Fit to Window")
+
+    def zoom_to(self, zoom: float):
+        self.viewport.zoom = zoom
+        self.schedule_redraw()
+        self.status_text.set(f"Zoom: {zoom * 100:.0f}%")
+
+    def zoom_by(self, factor: float, x=None, y=None):
+        """Zoom around canvas point (x, y), or around the centre."""
+        if not self.model.has_image():
+            return
+        width, height = self.model.get_dimensions()
+        canvas_w, canvas_h = self._canvas_size()
+        if x is None:
+            x, y = canvas_w / 2, canvas_h / 2
+        self.viewport.zoom_at(factor, x, y, width, height, canvas_w, canvas_h)
+        self.schedule_redraw()
+        self.status_text.set(f"Zoom: {self.viewport.zoom * 100:.0f}%")
+
+    def on_mouse_wheel(self, event):
+        if event.num == 5 or event.delta < 0:
+            self.zoom_by(0.8, event.x, event.y)
+        else:
+            self.zoom_by(1.25, event.x, event.y)
+
+    def on_drag_start(self, event):
+        self._drag_start = (event.x, event.y)
+
+    def on_drag(self, event):
+        if self._drag_start is None or not self.model.has_image():
+            return
+        dx = event.x - self._drag_start[0]
+        dy = event.y - self._drag_start[1]
+        self._drag_start = (event.x, event.y)
+        width, height = self.model.get_dimensions()
+        self.viewport.pan(dx, dy, width, height, *self._canvas_size())
+        self.schedule_redraw()
+
+    def on_select_start(self, event):
+        image = self.model.current_image
+        if image is None or isinstance(image, TiledImage):
+            return
+        self._select_start = self._image_point(event.x, event.y)
+        self.selection = None
+        self._draw_selection()
+
+    def on_select_drag(self, event):
+        if self._select_start is None or not self.model.has_image():
+            return
+        width, height = self.model.get_dimensions()
+        self.selection = clip_rect(
+            self._select_start + self._image_point(event.x, event.y), width, height)
+        self._draw_selection()
+
+    def on_select_end(self, event):
+        if self._select_start is None:
+            return
+        self.on_select_drag(event)
+        self._select_start = None
+        if self.selection is not None:
+            x0, y0, x1, y1 = self.selection
+            self.status_text.set(
+                f"Selected {x1 - x0}x{y1 - y0} at ({x0}, {y0}); "
+                "filters now apply inside it (Esc clears)")
+
+    def clear_selection(self):
+        if self.selection is None:
+            return
+        self.selection = None
+        self._select_start = None
+        self._draw_selection()
+        self.status_text.set("Selection cleared")
+
+    def _image_point(self, canvas_x, canvas_y):
+        width, height = self.model.get_dimensions()
+        return self.viewport.to_image(
+            canvas_x, canvas_y, width, height, *self._canvas_size())
+
+    def _draw_selection(self):
+        """Outline the selection on the canvas, over the image."""
+        self.canvas.delete("selection")
+        if self.selection is None or not self.model.has_image():
+            return
+        width, height = self.model.get_dimensions()
+        # undo or redo may have brought back an image of another size
+        self.selection = clip_rect(self.selection, width, height)
+        if self.selection is None:
+            return
+        x0, y0, x1, y1 = self.selection
+        canvas_size = self._canvas_size()
+        left, top = self.viewport.to_canvas(x0, y0, width, height, *canvas_size)
+        right, bottom = self.viewport.to_canvas(x1, y1, width, height, *canvas_size)
+        self.canvas.create_rectangle(left, top, right, bottom, outline="yellow",
+                                     dash=(4, 2), tags="selection")
 
     def open_file(self):
         """
@@ -284,25 +681,296 @@ class EditorApp:
         (JPG, PNG, BMP) are passed to the processor[cite: 32].
         """
         file_path = filedialog.askopenfilename(
-            filetypes=[("Image files", "*.jpg *.png *.bmp")]
+            filetypes=[("Image files", "*.jpg *.png *.bmp"),
+                       ("Raw image arrays", "*.npy")]
         )
-        if file_path:
-            # Updating the status bar here provides immediate visual
-            # confirmation that the user's action was successful[cite: 30].
-            # self.status_text.set(f"Loaded: {file_path}")
-            bgr = cv2.imread(file_path)
-            if bgr is None:
-                messagebox.showerror("Error", "Cannot load image.")
-                return
+        if not file_path:
+            return
+        if not self.document.is_empty:
+            # every image opens in a tab of its own
+            self.focus_document(self._new_document())
+        self._load(file_path)
 
-            self.model.set_image(bgr, Path(file_path))
-            self.history.clear()
-            self.display_image(self.model.current_image)
+    def _load(self, file_path):
+        """Decode file_path into the focused document.
+
+        Also restarts a load that was cut short by switching tabs, in
+        which case the edits queued for it are kept.
+        """
+        # results still being computed belong to the previous image
+        self.runner.cancel()
+        self._loading = None
+        self.selection = None
+        # raw arrays are mapped tile by tile, so they can be bigger than
+        # RAM; copying them into tiles and building the pyramid takes a
+        # while, so it is done in the background too
+        tiled = file_path.lower().endswith(".npy")
+        reduced = None if tiled else read_reduced(file_path, *self._canvas_size())
+        if reduced is None and not tiled:
+            self._show_loaded(read_full(file_path), file_path)
+            return
 
-            self.current_file_path = file_path
-            self.unsaved_changes = False
+        # Show a quick reduced decode now (nothing for a raw array) and swap
+        # in the full picture when the background load finishes; edits made
+        # until then are queued.
+        self.model.set_image(None)
+        self.history.clear()
+        self.op_history.reset(None)
+        self.refresh_history_panel()
+        self.refresh_adjustments_panel()
+        self.viewport.reset()
+        self._loading = file_path
+        self._refresh_tab()
+        if reduced is None:
+            self.canvas.delete("image")
+            self.status_text.set(f"Loading: {file_path}")
+        else:
+            preview, scale = reduced
+            self.display_image(preview, scale)
             self.status_text.set(
-                f"Loaded: {file_path} ({bgr.shape[1]}x{bgr.shape[0]})")
+                f"Loading: {file_path} (showing {preview.shape[1]}x{preview.shape[0]})")
+
+        def load():
+            if tiled:
+                return TiledImage.open(file_path)
+            image = read_full(file_path)
+            if image is not None and image.shape[0] * image.shape[1] > self.TILED_PIXELS:
+                image = TiledImage.from_array(image)
+            return image
+
+        def done(image, elapsed):
+            if self._loading != file_path:
+                return
+            self._loading = None
+            self._show_loaded(image, file_path)
+            self._replay_queued_edits()
+
+        self.runner.submit("open", load, done, self._on_load_error)
+
+    def _on_load_error(self, error):
+        self._loading = None
+        self._queued_edits = []
+        self.canvas.delete("image")
+        messagebox.showerror("Error", f"Cannot load image: {error}")
+        self.status_text.set("Load failed")
+
+    def _show_loaded(self, bgr, file_path):
+        """Make a freshly decoded image the model image and show it."""
+        if bgr is None:
+            self._queued_edits = []
+            self.canvas.delete("image")
+            messagebox.showerror("Error", "Cannot load image.")
+            return
+        if not isinstance(bgr, TiledImage) and \
+                bgr.shape[0] * bgr.shape[1] > self.TILED_PIXELS:
+            bgr = TiledImage.from_array(bgr)
+
+        self.model.set_image(bgr, Path(file_path))
+        self.viewport.reset()
+        self.history.clear()
+        self.op_history.reset(self.model.original_image)
+        if isinstance(bgr, TiledImage):
+            # tiled images are never copied whole, so their undo
+            # history has to be the operation log
+            self.op_log_var.set(True)
+            self.history_mode = "operations"
+        self.refresh_history_panel()
+        self.refresh_adjustments_panel()
+        self.display_image(self.model.current_image)
+
+        self.current_file_path = file_path
+        self.unsaved_changes = False
+        self._refresh_tab()
+        # Updating the status bar here provides immediate visual
+        # confirmation that the user's action was successful[cite: 30].
+        self.status_text.set(
+            f"Loaded: {file_path} ({bgr.shape[1]}x{bgr.shape[0]})")
+        self._enforce_budget()
+
+    def _queue_edit(self, edit):
+        """Hold an edit made while the full image is still loading."""
+        key = edit[3]
+        for i, queued in enumerate(self._queued_edits):
+            if key is not None and queued[3] == key:
+                # like a job in flight, a newer edit from the same
+                # control replaces the older one
+                self._queued_edits[i] = edit
+                break
+        else:
+            self._queued_edits.append(edit)
+        self.status_text.set(f"Queued until loaded: {edit[1]}")
+
+    def _replay_queued_edits(self):
+        """Run the queued edits, in order, on the full image as one job."""
+        edits, self._queued_edits = self._queued_edits, []
+        if not edits or not self.model.has_image():
+            return
+        source = self.model.current_image
+
+        def run():
+            results, image = [], source
+            for transform_func, _, op, _, _ in edits:
+                image = self._process(transform_func, image, op)
+                results.append(image)
+            return results
+
+        def done(results, elapsed):
+            if self.model.current_image is not source:
+                # another edit landed first, so replay on top of it
+                self._queued_edits = edits + self._queued_edits
+                self._replay_queued_edits()
+                return
+            image = source
+            for (_, status_msg, op, _, region), out in zip(edits, results):
+                self._commit_result(image, out, status_msg, op, elapsed / len(edits),
+                                    region)
+                image = out
+            self._show_timings()
+            self.status_text.set(f"Replayed {len(edits)} queued edit(s)")
+
+        self.runner.submit("replay", run, done, self._on_job_error)
+        self.status_text.set(f"Replaying {len(edits)} queued edit(s)")
+
+    def _new_document(self):
+        """Add an empty document in a tab of its own."""
+        document = Document(self.ops)
+        tab = tk.Frame(self.tabs, height=0)
+        self.tabs.add(tab, text=document.title)
+        self._tabs[str(tab)] = document
+        self.governor.add(document)
+        return document
+
+    def _tab_of(self, document):
+        return next(tab for tab, owner in self._tabs.items() if owner is document)
+
+    def _refresh_tab(self, document=None):
+        document = document or self.document
+        if document in self.governor.documents:
+            self.tabs.tab(self._tab_of(document), text=document.title)
+
+    def on_tab_changed(self, event=None):
+        document = self._tabs.get(self.tabs.select())
+        if document is not None:
+            self.focus_document(document)
+
+    def focus_document(self, document):
+        """Show another open document, reading its pixels back if it was parked."""
+        if document is self.document:
+            return
+        # edits, previews and loads in flight belong to the tab being left;
+        # a load cut short starts again when its tab is shown
+        self.runner.cancel()
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+            self._preview_job = None
+        self._preview_control = None
+        self._select_start = None
+        self._display_source = None
+        self.preview.clear()
+        self.canvas.delete("image")
+        self.canvas.delete("selection")
+
+        self.document = document
+        self.governor.focus(document)
+        self.tabs.select(self._tab_of(document))
+        self.op_log_var.set(self.history_mode == "operations")
+        self._layer_slider_index = None
+        self.refresh_history_panel()
+        self.refresh_adjustments_panel()
+        if document.parked is not None:
+            self._restore(document)
+        elif isinstance(self._loading, str):
+            self._load(self._loading)
+        elif self.model.has_image():
+            self.display_image(self.model.current_image)
+            width, height = self.model.get_dimensions()
+            self.status_text.set(f"{document.title} ({width}x{height})")
+        else:
+            self.status_text.set("Empty tab")
+        self._enforce_budget()
+
+    def close_tab(self):
+        """Close the focused document, asking first if it has unsaved changes."""
+        document = self.document
+        if (document.model.dirty or document.unsaved_changes) and not messagebox.askyesno(
+                "Close Tab", f"Close {document.title} without saving?"):
+            return
+        tab = self._tab_of(document)
+        self.governor.remove(document)
+        del self._tabs[tab]
+        if not self.governor.documents:
+            self._new_document()
+        # back to the tab used most recently before this one
+        self.focus_document(self.governor.documents[-1])
+        self.tabs.forget(tab)
+        self.root.nametowidget(tab).destroy()
+        document.close()
+        self._show_memory()
+
+    def _restore(self, document):
+        """Show a parked document's thumbnail now and read its pixels back behind it."""
+        parked = document.parked
+        self.display_image(parked.thumbnail, parked.scale)
+        self._loading = parked
+        self.status_text.set(f"Restoring: {document.title}")
+
+        def done(result, elapsed):
+            if self._loading is not parked or not document.finish_unpark(result):
+                return
+            self._loading = None
+            self.display_image(self.model.current_image)
+            self.status_text.set(f"Restored: {document.title} ({elapsed * 1000:.0f} ms)")
+            self._replay_queued_edits()
+            self._enforce_budget()
+
+        self.runner.submit("open", document.unpark, done, self._on_load_error)
+
+    def _enforce_budget(self):
+        """Park the least recently used documents while over the memory budget."""
+        for document in self.governor.to_park():
+            self._park(document)
+        self._show_memory()
+
+    def _park(self, document):
+        """Compress a document that is not on screen to disk, on the parker's worker."""
+        # focusing the document before the park is installed cancels it
+        generation = document.generation
+        canvas_w, canvas_h = self._canvas_size()
+
+        def done(parked, elapsed):
+            self.governor.parking.discard(document)
+            if document.finish_park(parked):
+                self._show_memory()
+
+        def failed(error):
+            self.governor.parking.discard(document)
+            self.status_text.set(f"Could not move {document.title} to disk: {error}")
+
+        self.parker.submit(None, lambda: document.park(generation, canvas_w, canvas_h),
+                           done, failed)
+
+    def _show_memory(self):
+        megabyte = 1024 * 1024
+        text = (f"Memory: {self.governor.resident_bytes() / megabyte:.0f} of "
+                f"{self.governor.budget_bytes / megabyte:.0f} MB")
+        parked = self.governor.parked_count
+        self.memory_text.set(f"{text}, {parked} parked" if parked else text)
+
+    def ask_memory_budget(self):
+        megabytes = simpledialog.askinteger(
+            "Memory Budget", "Memory for all open images (MB):", parent=self.root,
+            initialvalue=self.governor.budget_bytes // (1024 * 1024), minvalue=64)
+        if megabytes is not None:
+            self.governor.budget_bytes = megabytes * 1024 * 1024
+            self._enforce_budget()
+            self.status_text.set(f"Memory budget: {megabytes} MB")
+
+    def _still_loading(self) -> bool:
+        """True, with a note in the status bar, while the image is still being read."""
+        if self._loading is None:
+            return False
+        self.status_text.set("Still loading, try again in a moment")
+        return True
 
     def save_file(self):
         """
@@ -319,9 +987,7 @@ class EditorApp:
             self.save_as_file()
         else:
             if self.model.has_image():
-                cv2.imwrite(self.current_file_path, self.model.current_image)
-                self.unsaved_changes = False
-                self.status_text.set(f"Saved: {self.current_file_path}")
+                self._write_image(self.current_file_path, "Saved")
             else:
                 messagebox.showinfo("Info", "No image to save.")
 
@@ -340,6 +1006,8 @@ class EditorApp:
             filetypes=[
                 ("PNG files", "*.png"),
                 ("JPEG files", "*.jpg"),
+                ("WebP files", "*.webp"),
+                ("Raw image arrays", "*.npy"),
                 ("All files", "*.*")
             ]
         )
@@ -348,13 +1016,72 @@ class EditorApp:
             return
 
         if self.model.has_image():
-            cv2.imwrite(file_path, self.model.current_image)
-            self.current_file_path = file_path
-            self.unsaved_changes = False
-            self.status_text.set(f"Saved as: {file_path}")
+            self._write_image(file_path, "Saved as")
         else:
             messagebox.showinfo("Info", "No image to save.")
 
+    def _write_image(self, file_path, verb):
+        """Encode and write the current image on the saver thread.
+
+        The file is written under a temporary name and renamed into place
+        (see image_writer), so a crash mid-save leaves the old file whole.
+        Edits always make new arrays, so the image can be encoded while
+        the user carries on working.
+        """
+        # adjustment layers are applied at full resolution only now, on
+        # the saver thread, to a copy of the stack as it is at this moment
+        adjustments = self.model.adjustments.frozen()
+        options = self.save_options
+        # the user may have switched tabs, or gone on editing, by the time
+        # the save finishes
+        document = self.document
+        image = self.model.current_image
+
+        def done(result, elapsed):
+            size, encode_seconds = result
+            document.current_file_path = file_path
+            model = document.model
+            if model.current_image is image and model.adjustments.layers == adjustments.layers:
+                document.unsaved_changes = False
+                model.mark_saved(Path(file_path))
+            else:
+                # edits made during the save are not in the file
+                model.file_path = Path(file_path)
+            self._refresh_tab(document)
+            self.status_text.set(
+                f"{verb}: {file_path} ({size / 1e6:.1f} MB, "
+                f"encoded in {encode_seconds * 1000:.0f} ms)")
+
+        def failed(error):
+            messagebox.showerror("Error", f"Could not save {file_path}: {error}")
+            self.status_text.set("Save failed")
+
+        self.saver.submit(
+            None, lambda: save_image(adjustments.render(1.0, store=False), file_path, options),
+            done, failed)
+        self.status_text.set(f"Saving: {file_path}")
+
+    def set_save_profile(self):
+        self.save_options = PROFILES[self.save_profile_var.get()]
+        self.status_text.set(f"Save profile: {self.save_profile_var.get()}")
+
+    def ask_save_quality(self):
+        quality = simpledialog.askinteger(
+            "Save Options", "JPEG and WebP quality (1-100):", parent=self.root,
+            initialvalue=self.save_options.jpeg_quality, minvalue=1, maxvalue=100)
+        if quality is not None:
+            self.save_options = replace(
+                self.save_options, jpeg_quality=quality, webp_quality=quality)
+            self.status_text.set(f"Save quality: {quality}")
+
+    def ask_png_compression(self):
+        level = simpledialog.askinteger(
+            "Save Options", "PNG compression (0 fastest - 9 smallest):", parent=self.root,
+            initialvalue=self.save_options.png_compression, minvalue=0, maxvalue=9)
+        if level is not None:
+            self.save_options = replace(self.save_options, png_compression=level)
+            self.status_text.set(f"PNG compression: {level}")
+
     def undo_action(self):
         """
         Undo the last image operation.
@@ -362,68 +1089,196 @@ class EditorApp:
 
 
         """
-        image = self.history.undo(self.model.current_image)
+        if self._still_loading():
+            return
+        self._cancel_edits()
+        with self.profiler.phase("history", self.model.current_image, action="undo"):
+            image = self.active_history().undo(self.model.current_image)
         if image is not None:
             self.model.apply_new_current(image)
             self.display_image(image)
+            self.refresh_history_panel()
+            self._show_timings()
             self.status_text.set("Undo performed")
+            self._enforce_budget()
         else:
             self.status_text.set("Nothing to undo")
 
-    def _apply_transformation(self, transform_func, status_msg: str):
-        """Helper to apply a transformation to the current image."""
-        if not self.model.has_image():
-            messagebox.showinfo("Info", "Please open an image first.")
+    def _apply_transformation(self, transform_func, status_msg: str, op=None, key=None,
+                              region=None, edit=None):
+        """Helper to apply a transformation to the current image.
+
+        The transformation runs on the background runner and the result is
+        committed on the Tk thread. A newer request with the same key (one
+        per control) replaces one that is still in flight.
+
+        op is an optional (name, params) pair naming the ImageProcessor
+        operation, so the operation log can replay it later. Without it
+        the result is stored as a keyframe.
+
+        region is the rectangle a region edit changed (see core.roi); only
+        the pixels under it are kept for undo.
+
+        While the full image is still loading the edit is queued instead.
+
+        edit is the profiler token of an earlier attempt at the same edit,
+        so its span covers the whole wait.
+        """
+        if self._loading is not None:
+            self.profiler.discard_edit(edit)
+            self._queue_edit((transform_func, status_msg, op, key, region))
+            return
+        if not self.prepare_action():
+            self.profiler.discard_edit(edit)
+            return
+        source = self.model.current_image
+        if op is None and isinstance(source, TiledImage):
+            self.profiler.discard_edit(edit)
+            messagebox.showinfo(
+                "Info", "This adjustment is not available for very large images.")
             return
-        self.history.push(self.model.current_image)
-        out = transform_func(self.model.current_image)
-        self.model.apply_new_current(out)
+        if edit is None:
+            edit = self.profiler.begin_edit(status_msg)
+
+        def done(out, elapsed):
+            if self.model.current_image is not source:
+                # another edit landed first, so redo this one on top of it
+                self._apply_transformation(transform_func, status_msg, op, key, region,
+                                           edit)
+                return
+            self._commit_result(source, out, status_msg, op, elapsed, region)
+            self.profiler.end_edit(edit, op=op[0] if op else None)
+            self._show_timings()
+
+        def failed(error):
+            self.profiler.discard_edit(edit)
+            self._on_job_error(error)
+
+        # a job superseded by a newer one for the same key, or cancelled by
+        # a tab switch, never reaches done
+        self.runner.submit(key, lambda: self._process(transform_func, source, op),
+                           done, failed, lambda: self.profiler.discard_edit(edit))
+        self.status_text.set(f"Working: {status_msg}")
+
+    def _process(self, transform_func, source, op):
+        """Run transform_func on source; called on a worker thread."""
+        with self.profiler.phase("process", source, op=op[0] if op else None) as phase:
+            out = transform_func(source)
+            phase.set(out_shape=list(out.shape))
+        return out
+
+    def _commit_result(self, source, out, status_msg: str, op, elapsed: float,
+                       region=None):
+        """Store a finished result in the model and history, then redraw."""
+        # Save to history so Undo/Redo works
+        with self.profiler.phase("history", source, action="push"):
+            if self.history_mode == "operations":
+                name, params = op if op is not None else (None, {})
+                self.op_history.record(name, params, out, label=status_msg,
+                                       elapsed=elapsed)
+                self.refresh_history_panel()
+            elif region is not None:
+                self.history.push_region(source, region)
+            else:
+                self.history.push(source)
+        with self.profiler.phase("model", out):
+            self.model.apply_new_current(out)
         self.display_image(out)
-        self.status_text.set(status_msg)
+        self.status_text.set(f"{status_msg} ({elapsed * 1000:.0f} ms)")
+        self.cache_text.set(self.cache.summary())
+        self._enforce_budget()
+
+    def _show_timings(self):
+        if self.profiler.enabled:
+            self.profile_text.set(self.profiler.readout())
+
+    def toggle_profiling(self):
+        if self.profile_var.get():
+            self.profiler.enable()
+            self.status_text.set("Timing edits (memory tracking slows them slightly)")
+        else:
+            self.profiler.disable()
+            self.profile_text.set("")
+            self.status_text.set("Timings off")
+
+    def export_trace(self):
+        """Save the recorded timings as a Chrome trace (chrome://tracing, Perfetto)."""
+        if not len(self.profiler):
+            messagebox.showinfo("Info", "Nothing recorded yet. Turn on View > Show Timings first.")
+            return
+        file_path = filedialog.asksaveasfilename(
+            defaultextension=".json",
+            filetypes=[("Chrome trace", "*.json")])
+        if not file_path:
+            return
+        try:
+            count = self.profiler.export_chrome_trace(file_path)
+        except OSError as error:
+            messagebox.showerror("Error", f"Could not write {file_path}: {error}")
+            return
+        self.status_text.set(f"Trace of {count} events saved: {file_path}")
 
-    def rotate_image(self):
+    def _cancel_edits(self):
+        """Drop edits in flight, but keep decoding an image being opened."""
+        self.runner.cancel(keep=("open",))
+
+    def _on_job_error(self, error):
+        messagebox.showerror("Error", f"Operation failed: {error}")
+        self.status_text.set("Operation failed")
+
+    def _apply_operation(self, name: str, params: dict, status_msg: str, key=None):
+        """Apply a named ImageProcessor operation to the current image.
+
+        With a selection, operations that have a region form run only
+        inside it. The others (rotate, resize) move every pixel, so they
+        drop the selection and apply to the whole image.
+        """
+        if self.selection is not None and self.model.has_image():
+            if name in REGION_OPERATIONS:
+                region = self.selection
+                # the op log cannot replay a region, so it keeps a keyframe
+                self._apply_transformation(
+                    lambda img: apply_region(img, name, params, region, self.ops),
+                    f"{status_msg} (selection)", key=key, region=region)
+                return
+            self.clear_selection()
         self._apply_transformation(
-            lambda img: cv2.rotate(img, cv2.ROTATE_90_CLOCKWISE),
-            "Applied: Rotate 90°"
-        )
+            lambda img: self.ops.apply(img, name, **params),
+            status_msg, op=(name, params), key=key)
+
+    def rotate_image(self):
+        self._apply_operation("rotate", {"angle": 90}, "Applied: Rotate 90°")
 
     def flip_horizontal(self):
-        self._apply_transformation(
-            lambda img: cv2.flip(img, 1),
-            "Applied: Flip Horizontal"
-        )
+        self._apply_operation("flip", {"mode": "h"}, "Applied: Flip Horizontal")
 
     def flip_vertical(self):
-        self._apply_transformation(
-            lambda img: cv2.flip(img, 0),
-            "Applied: Flip Vertical"
-        )
+        self._apply_operation("flip", {"mode": "v"}, "Applied: Flip Vertical")
 
     def resize_image(self, scale_factor: float):
         if scale_factor <= 0:
             messagebox.showerror("Error", "Scale factor must be positive.")
             return
 
-        def resize(img):
-            h, w = img.shape[:2]
-            return cv2.resize(img, (int(w * scale_factor), int(h * scale_factor)), interpolation=cv2.INTER_AREA)
-
-        self._apply_transformation(
-            resize, f"Applied: Resize {int(scale_factor*100)}%")
+        # the same resize operation as the buttons, so it gets the chosen
+        # filter and the pyramid for large reductions
+        self._apply_operation(
+            "resize", self._resize_params(scale=scale_factor * 100),
+            f"Applied: Resize {int(scale_factor*100)}%", key="resize")
 
     def adjust_brightness(self, factor: float):
-        self._apply_transformation(
-            lambda img: cv2.convertScaleAbs(img, alpha=factor, beta=0),
-            f"Applied: Brightness x{factor}"
-        )
+        # multiplying every pixel by factor is the processor's "contrast"
+        # lookup table
+        self._apply_operation(
+            "contrast", {"value": factor}, f"Applied: Brightness x{factor}",
+            key="brightness")
 
     def adjust_contrast(self, factor: float):
-        def contrast(img):
-            img_float = img.astype('float32')
-            mean = img_float.mean()
-            return cv2.convertScaleAbs((img_float - mean) * factor + mean)
-
-        self._apply_transformation(contrast, f"Applied: Contrast x{factor}")
+        # one lookup-table pass around the image mean instead of a float32
+        # copy of the whole frame
+        self._apply_operation(
+            "stretch_contrast", {"factor": factor},
+            f"Applied: Contrast x{factor}", key="contrast")
 
     def redo_action(self):
         """
@@ -432,14 +1287,211 @@ class EditorApp:
         Updates the canvas and status bar.
 
         """
-        image = self.history.redo(self.model.current_image)
+        if self._still_loading():
+            return
+        self._cancel_edits()
+        with self.profiler.phase("history", self.model.current_image, action="redo"):
+            image = self.active_history().redo(self.model.current_image)
         if image is not None:
             self.model.apply_new_current(image)
             self.display_image(image)
+            self.refresh_history_panel()
+            self._show_timings()
             self.status_text.set("Redo performed")
+            self._enforce_budget()
         else:
             self.status_text.set("Nothing to redo")
 
+    def exit_app(self):
+        """Release every document's history and parked pixels (temp files included) and quit."""
+        self.runner.shutdown()
+        self.parker.shutdown()
+        # let saves in progress finish, or the file would not be written
+        self.saver.executor.shutdown(wait=True)
+        self.tiles.shutdown()
+        for document in self.governor.documents:
+            document.close()
+        self.root.quit()
+
+    def active_history(self):
+        """Return the history object for the current history mode."""
+        if self.history_mode == "operations":
+            return self.op_history
+        return self.history
+
+    def toggle_history_mode(self):
+        """
+        Switch between snapshot history and the operation log.
+        The existing history is dropped and the current image becomes
+        the base of the new one.
+        """
+        if self._still_loading():
+            self.op_log_var.set(self.history_mode == "operations")
+            return
+        if isinstance(self.model.current_image, TiledImage) and not self.op_log_var.get():
+            self.op_log_var.set(True)
+            messagebox.showinfo(
+                "Info", "Very large images always use the operation log history.")
+            return
+        self._cancel_edits()
+        self.history_mode = "operations" if self.op_log_var.get() else "snapshot"
+        self.history.clear()
+        self.op_history.reset(self.model.current_image)
+        self.refresh_history_panel()
+        label = "Operation log" if self.history_mode == "operations" else "Snapshot"
+        self.status_text.set(f"{label} history enabled")
+
+    def show_history_panel(self):
+        """
+        Open a small window listing the operation log. Selecting a step
+        jumps straight to it without undoing one step at a time.
+        """
+        if self.history_panel is not None and self.history_panel.winfo_exists():
+            self.history_panel.lift()
+            return
+
+        self.history_panel = tk.Toplevel(self.root)
+        self.history_panel.title("History")
+        self.history_list = tk.Listbox(self.history_panel, width=40, height=20)
+        self.history_list.pack(expand=True, fill=tk.BOTH)
+        self.history_list.bind("<<ListboxSelect>>", self.on_history_select)
+        self.refresh_history_panel()
+
+    def show_adjustments_panel(self):
+        """
+        Open a window listing the adjustment layers. They sit on top of
+        the image without changing it, so any layer can be changed or
+        switched off later; only the layers above it are worked out again.
+        """
+        if self.adjustments_panel is not None and self.adjustments_panel.winfo_exists():
+            self.adjustments_panel.lift()
+            return
+
+        self.adjustments_panel = tk.Toplevel(self.root)
+        self.adjustments_panel.title("Adjustment Layers")
+        self.adjustments_list = tk.Listbox(self.adjustments_panel, width=32, height=10,
+                                           exportselection=False)
+        self.adjustments_list.pack(expand=True, fill=tk.BOTH)
+        self.adjustments_list.bind("<<ListboxSelect>>", self.on_adjustment_select)
+        self.layer_slider = tk.Scale(self.adjustments_panel, orient=tk.HORIZONTAL,
+                                     command=self.on_layer_slider)
+        self.layer_slider.pack(fill="x", padx=5)
+        add_frame = tk.Frame(self.adjustments_panel)
+        add_frame.pack(fill="x")
+        for name in ADJUSTMENTS:
+            tk.Button(add_frame, text=f"+ {LABELS[name]}",
+                      command=lambda n=name: self.add_adjustment(n)).pack(
+                side=tk.LEFT, expand=True, fill="x")
+        edit_frame = tk.Frame(self.adjustments_panel)
+        edit_frame.pack(fill="x")
+        tk.Button(edit_frame, text="On/Off", command=self.toggle_adjustment).pack(
+            side=tk.LEFT, expand=True, fill="x")
+        tk.Button(edit_frame, text="Remove", command=self.remove_adjustment).pack(
+            side=tk.LEFT, expand=True, fill="x")
+        self.refresh_adjustments_panel()
+
+    def refresh_adjustments_panel(self, select=None):
+        if self.adjustments_panel is None or not self.adjustments_panel.winfo_exists():
+            return
+        self.adjustments_list.delete(0, tk.END)
+        for i, layer in enumerate(self.model.adjustments.layers, start=1):
+            self.adjustments_list.insert(tk.END, f"{i}: {layer.label}")
+        if select is not None and select < len(self.model.adjustments):
+            self.adjustments_list.selection_set(select)
+            self.on_adjustment_select()
+
+    def _selected_layer(self):
+        selection = self.adjustments_list.curselection()
+        return selection[0] if selection else None
+
+    def on_adjustment_select(self, event=None):
+        index = self._selected_layer()
+        if index is None:
+            return
+        layer = self.model.adjustments.layers[index]
+        parameter, _, low, high = ADJUSTMENTS[layer.name]
+        # set the range before the value, and without redrawing for it
+        self._layer_slider_index = None
+        self.layer_slider.config(from_=low, to=high, label=LABELS[layer.name],
+                                 resolution=0.1 if isinstance(low, float) else 1)
+        self.layer_slider.set(layer.params[parameter])
+        self._layer_slider_index = index
+
+    def add_adjustment(self, name):
+        image = self.model.current_image
+        if image is None or isinstance(image, TiledImage):
+            messagebox.showinfo("Info", "Adjustment layers need an image that fits in memory.")
+            return
+        index = self.model.adjustments.add(name)
+        self.refresh_adjustments_panel(select=index)
+        self.display_image(image)
+        self.status_text.set(f"Added {LABELS[name]} layer")
+
+    def on_layer_slider(self, value):
+        index = self._layer_slider_index
+        if index is None or index >= len(self.model.adjustments):
+            return
+        layer = self.model.adjustments.layers[index]
+        parameter, default = ADJUSTMENTS[layer.name][:2]
+        value = type(default)(float(value))
+        if layer.params[parameter] == value:
+            return
+        self.model.adjustments.update(index, **{parameter: value})
+        self.unsaved_changes = True
+        self.adjustments_list.delete(index)
+        self.adjustments_list.insert(index, f"{index + 1}: {self.model.adjustments.layers[index].label}")
+        self.adjustments_list.selection_set(index)
+        # only this layer and the ones above it are worked out again
+        self.display_image(self.model.current_image)
+
+    def toggle_adjustment(self):
+        index = self._selected_layer()
+        if index is None:
+            return
+        layer = self.model.adjustments.layers[index]
+        self.model.adjustments.set_enabled(index, not layer.enabled)
+        self.unsaved_changes = True
+        self.refresh_adjustments_panel(select=index)
+        self.display_image(self.model.current_image)
+
+    def remove_adjustment(self):
+        index = self._selected_layer()
+        if index is None:
+            return
+        self.model.adjustments.remove(index)
+        self.unsaved_changes = True
+        self.refresh_adjustments_panel(select=min(index, len(self.model.adjustments) - 1))
+        self.display_image(self.model.current_image)
+
+    def refresh_history_panel(self):
+        if self.history_panel is None or not self.history_panel.winfo_exists():
+            return
+
+        self.history_list.delete(0, tk.END)
+        if self.history_mode != "operations":
+            self.history_list.insert(tk.END, "Enable Edit > Operation Log History")
+            return
+        self.history_list.insert(tk.END, "0: Original")
+        for i, step in enumerate(self.op_history.steps, start=1):
+            self.history_list.insert(tk.END, f"{i}: {step.label}")
+        self.history_list.selection_set(self.op_history.position)
+        self.history_list.see(self.op_history.position)
+
+    def on_history_select(self, event=None):
+        selection = self.history_list.curselection()
+        if self.history_mode != "operations" or not selection:
+            return
+        step = selection[0]
+        if step == self.op_history.position or self._still_loading():
+            return
+
+        self._cancel_edits()
+        image = self.op_history.jump(step)
+        if image is not None:
+            self.model.apply_new_current(image)
+            self.display_image(image)
+            self.status_text.set(f"Jumped to step {step}")
+
 
 if __name__ == "__main__":
     # Standard boilerplate to ensure the app only launches when
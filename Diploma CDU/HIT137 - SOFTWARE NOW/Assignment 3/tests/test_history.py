@@ -0,0 +1,286 @@
+import os
+
+import numpy as np
+import pytest
+
+from core.history import HistoryManager, OperationHistory
+from core.result_cache import CachedProcessor
+from core.tile_executor import TileExecutor
+
+# a mix of geometric and pixel steps, as the GUI applies them one at a time
+STEPS = [
+    ("resize", {"scale": 50}),
+    ("resize", {"scale": 200}),
+    ("invert", {}),
+    ("rotate", {"angle": 30}),
+    ("rotate", {"angle": -30}),
+    ("brightness", {"value": 20}),
+    ("contrast", {"value": 1.5}),
+    ("flip", {"mode": "h"}),
+    ("blur", {"intensity": 7}),
+    ("resize", {"scale": 75}),
+]
+
+
+def _frame(seed=0, shape=(60, 80, 3)):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def _edit(rng, image, kinds):
+    """A new state from image, and the rectangle it changed if it is a region edit."""
+    kind = kinds[rng.integers(len(kinds))]
+    if kind == "flip":
+        return np.ascontiguousarray(image[:, ::-1]), None
+    if kind == "rotate":
+        return np.ascontiguousarray(np.rot90(image)), None
+    if kind == "resize":
+        height, width = image.shape[:2]
+        return _frame(int(rng.integers(1 << 30)), (width, height, 3)), None
+    height, width = image.shape[:2]
+    x0, y0 = int(rng.integers(width - 8)), int(rng.integers(height - 8))
+    rect = (x0, y0, x0 + 8, y0 + 8)
+    state = image.copy()
+    state[y0:y0 + 8, x0:x0 + 8] = rng.integers(0, 256, (8, 8, 3), dtype=np.uint8)
+    return state, (rect if kind == "region" else None)
+
+
+def _exercise(history, kinds, steps=200, seed=0):
+    """Random edits, undos and redos, checked against plain lists of states."""
+    rng = np.random.default_rng(seed)
+    current = _frame(seed)
+    undo, redo = [], []
+    for _ in range(steps):
+        action = rng.choice(["edit", "edit", "undo", "redo"])
+        if action == "edit":
+            state, rect = _edit(rng, current, kinds)
+            if rect is None:
+                history.push(current)
+            else:
+                history.push_region(current, rect)
+            undo.append(current)
+            redo.clear()
+            current = state
+        elif action == "undo" and undo:
+            redo.append(current)
+            current = history.undo(current)
+            assert np.array_equal(current, undo.pop())
+        elif action == "redo" and redo:
+            undo.append(current)
+            current = history.redo(current)
+            assert np.array_equal(current, redo.pop())
+        # states beyond the budget go from the bottom of the undo stack
+        del undo[:len(undo) - len(history.undo_stack)]
+        assert len(history.redo_stack) == len(redo)
+    return current
+
+
+def test_undo_redo_is_exact_for_each_snapshot_kind():
+    history = HistoryManager(spill_to_disk=False)
+    states = [_frame()]
+    for make in (lambda a: np.ascontiguousarray(a[:, ::-1]),       # transform
+                 lambda a: np.ascontiguousarray(np.rot90(a, -1)),  # transform
+                 lambda a: np.where(a > 200, 0, a).astype(np.uint8),  # delta
+                 lambda a: _frame(1, (30, 40, 3)),                 # full
+                 lambda a: 255 - a):
+        history.push(states[-1])
+        states.append(make(states[-1]))
+    kinds = [item.kind for item in history.undo_stack.items]
+    assert kinds == ["transform", "transform", "delta", "full", "raw"]
+
+    current = states[-1]
+    for expected in reversed(states[:-1]):
+        current = history.undo(current)
+        assert np.array_equal(current, expected)
+    for expected in states[1:]:
+        current = history.redo(current)
+        assert np.array_equal(current, expected)
+
+
+def test_budget_drops_the_oldest_states():
+    image = _frame()
+    history = HistoryManager(max_bytes=3 * image.nbytes, spill_to_disk=False)
+    current = image
+    for seed in range(1, 11):
+        history.push(current)
+        current = _frame(seed)
+    stats = history.stats()
+    assert stats.bytes_held <= history.max_bytes
+    assert 1 <= stats.undo_count < 10
+    assert stats.disk_bytes == 0
+
+    # one undo step is always kept, however small the budget
+    history = HistoryManager(max_bytes=0, spill_to_disk=False)
+    history.push(image)
+    history.push(_frame(1))
+    assert len(history.undo_stack) == 1
+    assert np.array_equal(history.undo(_frame(2)), _frame(1))
+
+
+@pytest.mark.parametrize("max_bytes", [None, 30_000])
+def test_random_undo_redo_in_memory(max_bytes):
+    history = HistoryManager(max_bytes=max_bytes or 1 << 40, spill_to_disk=False)
+    _exercise(history, ["flip", "rotate", "delta", "resize"])
+    assert history.stats().compression_ratio >= 1.0
+
+
+def test_spilled_states_are_mapped_back_exactly():
+    history = HistoryManager(max_bytes=0)
+    states = [_frame()]
+    for seed in range(1, 6):
+        history.push(states[-1])
+        states.append(_frame(seed))
+    spilled = [item for item in history.undo_stack.items if item.path is not None]
+    assert len(spilled) == 4
+    assert all(item.payload is None and os.path.exists(item.path) for item in spilled)
+    stats = history.stats()
+    assert stats.bytes_held == states[0].nbytes  # only the raw top
+    assert stats.disk_bytes > 0
+
+    current = states[-1]
+    for expected in reversed(states[:-1]):
+        current = history.undo(current)
+        assert np.array_equal(current, expected)
+    # a state that has been read back no longer has a file
+    assert not any(os.path.exists(item.path) for item in spilled)
+
+    directory = history._spill_dir
+    history.close()
+    assert not os.path.exists(directory)
+
+
+def test_disk_budget_drops_the_oldest_spilled_states():
+    image = _frame()
+    history = HistoryManager(max_bytes=0, max_disk_bytes=3 * image.nbytes)
+    current = image
+    for seed in range(1, 11):
+        history.push(current)
+        current = _frame(seed)
+    assert history.stats().disk_bytes <= history.max_disk_bytes
+    assert len(history.undo_stack) < 10
+    history.close()
+
+
+@pytest.mark.parametrize("max_bytes", [0, 30_000])
+def test_random_undo_redo_with_spilling(max_bytes):
+    history = HistoryManager(max_bytes=max_bytes)
+    _exercise(history, ["flip", "rotate", "delta", "resize"])
+    assert history.stats().bytes_held <= max(max_bytes, 3 * _frame().nbytes)
+    history.close()
+
+
+def test_region_edits_keep_only_their_patch():
+    history = HistoryManager()
+    image = _frame(0, (600, 800, 3))
+    states, rects = [image], [(10, 20, 50, 60), (700, 500, 800, 600), (0, 0, 8, 8)]
+    for seed, (x0, y0, x1, y1) in enumerate(rects, 1):
+        state = states[-1].copy()
+        state[y0:y1, x0:x1] = _frame(seed, (y1 - y0, x1 - x0, 3))
+        history.push_region(states[-1], (x0, y0, x1, y1))
+        states.append(state)
+    patch_bytes = sum((x1 - x0) * (y1 - y0) * 3 for x0, y0, x1, y1 in rects)
+    assert [item.kind for item in history.undo_stack.items] == ["patch"] * 3
+    assert history.stats().bytes_held == patch_bytes
+
+    current = states[-1]
+    for expected in reversed(states[:-1]):
+        current = history.undo(current)
+        assert np.array_equal(current, expected)
+    # the way back is stored as patches too
+    assert history.stats().bytes_held == patch_bytes
+    for expected in states[1:]:
+        current = history.redo(current)
+        assert np.array_equal(current, expected)
+
+
+@pytest.mark.parametrize("max_bytes", [0, 30_000, None])
+def test_random_undo_redo_with_region_edits(max_bytes):
+    history = HistoryManager(max_bytes=1 << 40 if max_bytes is None else max_bytes)
+    _exercise(history, ["flip", "rotate", "delta", "resize", "region", "region"])
+    history.close()
+
+
+def _history_with_redo():
+    """A history with delta, patch and raw entries on both stacks, and its states."""
+    history = HistoryManager()
+    states = [_frame()]
+    for seed in range(1, 5):
+        history.push(states[-1])
+        states.append(np.where(_frame(seed) > 128, states[-1], 0).astype(np.uint8))
+    state = states[-1].copy()
+    state[5:15, 5:15] = 0
+    history.push_region(states[-1], (5, 5, 15, 15))
+    states.append(state)
+    current = states[-1]
+    for _ in range(2):
+        current = history.undo(current)
+    return history, states, current
+
+
+def _files(packed):
+    before, after = packed
+    return [item.path for items in after for item in items if item.path is not None]
+
+
+def test_pack_and_install_round_trip():
+    history, states, current = _history_with_redo()
+    packed = history.pack(current)
+    assert history.install(packed)
+    assert all(os.path.exists(path) for path in _files(packed))
+    # nothing but patches is left in memory
+    assert history.stats().bytes_held == 10 * 10 * 3
+
+    position = len(states) - 3
+    for expected in reversed(states[:position]):
+        current = history.undo(current)
+        assert np.array_equal(current, expected)
+    for expected in states[1:]:
+        current = history.redo(current)
+        assert np.array_equal(current, expected)
+    history.close()
+
+
+def test_install_is_refused_once_the_history_changes():
+    history, states, current = _history_with_redo()
+    packed = history.pack(current)
+    assert _files(packed)
+    # an undo after the pack was worked out
+    current = history.undo(current)
+    assert not history.install(packed)
+    assert not any(os.path.exists(path) for path in _files(packed))
+
+    # the history is as it was, and still works
+    assert history.stats().bytes_held > 10 * 10 * 3
+    for expected in reversed(states[:len(states) - 4]):
+        current = history.undo(current)
+        assert np.array_equal(current, expected)
+    history.close()
+
+
+def _committed(processor, image):
+    """The image after each step, applied the way an edit is committed."""
+    states = [image]
+    for name, params in STEPS:
+        states.append(processor.apply(states[-1], name, **params))
+    return states
+
+
+def test_replay_matches_committed_results():
+    processor = CachedProcessor(TileExecutor())
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    states = _committed(processor, image)
+
+    # no keyframes after the base, so every state is a replay from step 0
+    history = OperationHistory(processor, keyframe_interval=1000, expensive_seconds=1e9)
+    history.reset(image)
+    for (name, params), state in zip(STEPS, states[1:]):
+        history.record(name, params, state)
+
+    for step, state in enumerate(states):
+        assert np.array_equal(history.state_at(step), state), step
+
+    for step in range(len(STEPS) - 1, -1, -1):
+        assert np.array_equal(history.undo(), states[step]), step
+    for step in range(1, len(STEPS) + 1):
+        assert np.array_equal(history.redo(), states[step]), step
+    processor.processor.shutdown()
@@ -0,0 +1,59 @@
+import threading
+
+from core.profiler import Profiler
+from core.task_runner import BackgroundRunner
+
+
+class _Root:
+    """Stands in for Tk: after() callbacks run when poll() is called."""
+
+    def __init__(self):
+        self.callbacks = []
+
+    def after(self, ms, callback):
+        self.callbacks.append(callback)
+
+    def poll(self):
+        while self.callbacks:
+            self.callbacks.pop(0)()
+
+
+def _spans(profiler):
+    return [event[0] for event in profiler._events if event[5] is not None]
+
+
+def test_superseded_and_cancelled_edits_leave_no_open_records():
+    profiler = Profiler()
+    profiler.enable(track_memory=False)
+    root = _Root()
+    runner = BackgroundRunner(root)
+    release = threading.Event()
+
+    def submit(label, key):
+        edit = profiler.begin_edit(label)
+        return runner.submit(key, release.wait,
+                             lambda result, elapsed: profiler.end_edit(edit),
+                             lambda error: profiler.discard_edit(edit),
+                             lambda: profiler.discard_edit(edit))
+
+    submit("blur 5", "blur")
+    submit("blur 9", "blur")     # supersedes blur 5
+    submit("edge", "edge")
+    runner.cancel("edge")
+    assert profiler.open_edits == 1
+
+    release.set()
+    runner.jobs["blur"].future.result()
+    root.poll()
+    assert profiler.open_edits == 0
+    assert _spans(profiler) == ["blur 9"]
+    runner.shutdown()
+
+
+def test_end_after_discard_records_nothing():
+    profiler = Profiler()
+    profiler.enable(track_memory=False)
+    edit = profiler.begin_edit("grayscale")
+    profiler.discard_edit(edit)
+    profiler.end_edit(edit)
+    assert profiler.open_edits == 0 and len(profiler) == 0
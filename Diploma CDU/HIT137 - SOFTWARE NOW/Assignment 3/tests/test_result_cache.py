@@ -0,0 +1,90 @@
+import numpy as np
+
+from core.history import HistoryManager
+from core.image_processor import ImageProcessor
+from core.result_cache import CachedProcessor, ResultCache
+from core.tile_executor import TileExecutor
+
+
+def _image(seed=0, shape=(300, 400, 3)):
+    return np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+
+def test_same_edit_after_undo_is_a_hit():
+    processor = CachedProcessor(ImageProcessor)
+    history = HistoryManager()
+    image = _image()
+
+    # apply, undo and apply again, the way the editor commits an edit
+    history.push(image)
+    blurred = processor.apply(image, "blur", intensity=9)
+    restored = history.undo(blurred)
+    assert restored is not image and np.array_equal(restored, image)
+    again = processor.apply(restored, "blur", intensity=9)
+
+    assert again is blurred
+    assert (processor.cache.hits, processor.cache.misses) == (1, 1)
+
+
+def test_change_between_samples_is_not_a_hit():
+    processor = CachedProcessor(ImageProcessor)
+    image = _image()
+    processor.apply(image, "invert")
+    changed = image.copy()
+    # a pixel off the sampled rows and columns gives the same fingerprint
+    changed[1, 1] ^= 0xFF
+    assert processor.cache.fingerprint(changed) == processor.cache.fingerprint(image)
+
+    result = processor.apply(changed, "invert")
+    assert np.array_equal(result, 255 - changed)
+    assert (processor.cache.hits, processor.cache.misses) == (0, 2)
+
+
+def test_copy_results_hands_back_writable_arrays():
+    processor = CachedProcessor(ImageProcessor, copy_results=True)
+    image = _image()
+    result = processor.apply(image, "invert")
+    assert result.flags.writeable
+    result[:] = 0
+    assert np.array_equal(processor.apply(image.copy(), "invert"), 255 - image)
+
+
+def test_inputs_count_towards_the_budget_once():
+    cache = ResultCache(max_bytes=10_000_000)
+    processor = CachedProcessor(ImageProcessor, cache)
+    image = _image()
+    processor.apply(image, "invert")
+    processor.apply(image, "flip", mode="h")
+    assert cache.nbytes == 3 * image.nbytes
+
+    cache.max_bytes = 2 * image.nbytes
+    processor.apply(_image(1), "invert")
+    assert len(cache) == 1 and cache.nbytes == 2 * image.nbytes
+    assert cache.evictions == 2
+
+
+def test_a_cropped_input_does_not_pin_its_frame():
+    processor = CachedProcessor(ImageProcessor)
+    image = _image()
+    crop = image[10:50, 20:80]
+    processor.apply(crop, "invert")
+    assert processor.cache.nbytes == 2 * crop.nbytes
+    held = [source for source, _ in processor.cache._entries.values()]
+    assert not np.shares_memory(held[0], image)
+    assert processor.apply(image[10:50, 20:80].copy(), "invert") is not None
+    assert processor.cache.hits == 1
+
+
+def test_dst_through_a_tile_executor():
+    processor = CachedProcessor(TileExecutor(workers=4))
+    image = _image(shape=(1200, 800, 3))
+    steps = [("invert", {}), ("blur", {"intensity": 9}), ("flip", {"mode": "v"})]
+    expected = ImageProcessor.apply_chain(image, steps)
+    try:
+        for _ in range(2):  # a miss, then a hit
+            dst = np.empty_like(image)
+            assert processor.apply_chain(image, steps, dst=dst) is dst
+            assert np.array_equal(dst, expected)
+    finally:
+        processor.processor.shutdown()
+    assert processor.cache.hits == 1
@@ -0,0 +1,33 @@
+import numpy as np
+
+from core.image_processor import ImageProcessor
+from core.shared_frames import SharedFrame, SharedProcessor
+
+STEPS = [("invert", {}), ("blur", {"intensity": 9}), ("stretch_contrast", {"factor": 1.4})]
+
+
+def test_results_are_frames_read_in_place():
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, (600, 400, 3), dtype=np.uint8) for _ in range(3)]
+    with SharedProcessor(workers=2) as processor:
+        frames = [processor.pool.put(image) for image in images]
+        banded = processor.apply_chain(frames[0], STEPS)
+        assert isinstance(banded, SharedFrame)
+        assert np.array_equal(banded.array, ImageProcessor.apply_chain(images[0], STEPS))
+        processor.pool.release(banded)
+
+        results = processor.map_chain(frames, STEPS)
+        for image, frame, result in zip(images, frames, results):
+            # the input frames are used as they are, not copied
+            assert np.array_equal(frame.array, image)
+            assert np.array_equal(result.array, ImageProcessor.apply_chain(image, STEPS))
+        segments = len(processor.pool._segments)
+        for frame in frames + results:
+            processor.pool.release(frame)
+
+        # released segments are handed out again
+        frame = processor.pool.put(images[0])
+        result = processor.apply_chain(frame, STEPS)
+        assert len(processor.pool._segments) == segments
+        processor.pool.release(frame)
+        processor.pool.release(result)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from core.image_processor import ImageProcessor
+from core.tile_executor import TileExecutor
+
+
+def _image(shape):
+    return np.random.default_rng(0).integers(0, 256, shape, dtype=np.uint8)
+
+
+def test_in_place_blur_on_several_strips():
+    executor = TileExecutor(workers=4)
+    try:
+        for intensity in (9, 31):
+            image = _image((6000, 800, 3))
+            expected = ImageProcessor.blur(image, intensity)
+            assert len(executor.strips(6000, 800, 1)) > 1
+            assert executor.apply(image, "blur", dst=image, intensity=intensity) is image
+            assert np.array_equal(image, expected), intensity
+    finally:
+        executor.shutdown()
+
+
+def test_in_place_point_operation_on_several_strips():
+    executor = TileExecutor(workers=4)
+    try:
+        image = _image((3000, 800, 3))
+        expected = 255 - image
+        assert executor.apply(image, "invert", dst=image) is image
+        assert np.array_equal(image, expected)
+    finally:
+        executor.shutdown()